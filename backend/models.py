@@ -165,13 +165,14 @@ class Alert(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
     symbol: str
-    alert_type: str  # "price_above", "price_below"
+    alert_type: str  # "price_above", "price_below", "volatility_high"
     target_value: float
     is_active: bool = True
     is_triggered: bool = False
     is_acknowledged: bool = False  # User has seen/dismissed the notification
     triggered_at: Optional[datetime] = None
     triggered_price: Optional[float] = None
+    triggered_value: Optional[float] = None  # Price or annualized volatility (%) that crossed target_value
     notes: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
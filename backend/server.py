@@ -1,18 +1,23 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, BackgroundTasks, UploadFile, File
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, DeleteMany
 import os
+import asyncio
 import logging
 import uuid
+import codecs
+import tempfile
 from pathlib import Path
 from typing import List, Optional
 from datetime import datetime
 from passlib.context import CryptContext
 from models import (
     UserCreate, UserLogin, User, UserResponse,
-    PositionCreate, Position, PositionWithMetrics,
-    TransactionCreate, Transaction,
+    PositionCreate, PositionWithMetrics,
+    TransactionCreate,
     PortfolioCreate, Portfolio, PortfolioSummary,
     CorrelationItem, Recommendation,
     PerformanceResponse, DividendCreate, Dividend,
@@ -23,9 +28,27 @@ from models import (
 )
 from utils.yahoo_finance import YahooFinanceService
 from utils.portfolio_analytics import PortfolioAnalytics
-from utils.performance_service import PerformanceService
+from utils.performance_service import PerformanceService, empty_performance
 from utils.sector_analysis import SectorAnalysisService
-from utils.alert_manager import AlertManager
+from utils.market_data import AsyncMarketDataService
+from utils.history_cache import history_cache
+from utils.price_history import PriceHistoryStore
+from utils.risk_engine import RiskEngine
+from utils.history_window import HistoryWindowPlanner
+from utils.ledger import LedgerReplayEngine
+from utils.quote_board import QuoteBoard
+from utils.symbol_metadata import SymbolMetadataStore
+from utils.csv_import import CsvImportPipeline
+from utils.portfolio_resolver import PortfolioResolver
+from utils.trade_booking import TradeBookingService, TradeRejected, TradeConflict
+from utils.alert_engine import AlertEngine
+from utils.alert_manager import ALERT_TYPES
+from utils.event_bus import EventBus
+from utils.db_indexes import ensure_indexes, index_usage_report
+from utils.portfolio_snapshot import PortfolioSnapshotService, get_capital_totals
+from utils.pagination import (
+    InvalidCursorError, decode_cursor, fetch_page, sorted_cursor, stream_ndjson
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -43,7 +66,36 @@ yf_service = YahooFinanceService()
 analytics_service = PortfolioAnalytics()
 performance_service = PerformanceService()
 sector_service = SectorAnalysisService()
-alert_manager = AlertManager()
+risk_engine = RiskEngine()
+# Exact per-symbol date ranges for each request instead of fixed '1y'/'2y' downloads
+history_planner = HistoryWindowPlanner()
+# Day-by-day holdings replayed from the transaction ledger (incremental, cached per user)
+ledger_engine = LedgerReplayEngine(db)
+# All blocking market-data work goes through this pool so it never stalls the event loop
+market_data = AsyncMarketDataService()
+# Daily closes persisted in MongoDB, topped up incrementally from Yahoo Finance
+price_history_store = PriceHistoryStore(db, market_data)
+# Names, sectors and quote types, fetched once per symbol and persisted
+symbol_metadata = SymbolMetadataStore(db, market_data)
+# Default portfolio and portfolio ids of each user, cached until their portfolios change
+portfolio_resolver = PortfolioResolver(db)
+# Atomic position + ledger + cash writes for each trade
+trade_booking = TradeBookingService(client, db)
+# Chunked position imports (JSON rows or background CSV upload jobs)
+csv_import = CsvImportPipeline(db, symbol_metadata, trade_booking)
+# Live quotes of every held or alerted symbol, refreshed in the background
+quote_board = QuoteBoard(db, market_data)
+# Price and volatility alerts of all users indexed by symbol, evaluated on each quote board refresh
+alert_engine = AlertEngine(db, quote_board, price_history_store)
+# Fan-out of quote updates and alert triggers to the open /events streams
+event_bus = EventBus()
+# Memoized positions + summary per (user, portfolio), shared by the dashboard endpoints
+snapshot_service = PortfolioSnapshotService(
+    db, market_data, risk_engine, analytics_service,
+    quote_board=quote_board,
+    # Resolved at call time: load_portfolio_returns is defined with the performance helpers below
+    returns_loader=lambda user_id, portfolio_id, positions: load_portfolio_returns(user_id, portfolio_id, positions)
+)
 
 # Create the main app without a prefix
 app = FastAPI(title="PortfolioHub API")
@@ -67,6 +119,36 @@ async def get_current_user(user_id: str) -> dict:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
+def clean_document(doc: dict) -> dict:
+    """Remove MongoDB _id and convert datetime objects to ISO strings"""
+    return {
+        k: (v.isoformat() if isinstance(v, datetime) else v)
+        for k, v in doc.items() if k != '_id'
+    }
+
+async def paginated_history(collection, query: dict, sort_field: str, clean=clean_document,
+                            limit: Optional[int] = None, cursor: Optional[str] = None, stream: bool = False):
+    """
+    Serve a history collection, newest first:
+    - stream=true: NDJSON lines yielded as the cursor returns them
+    - limit set: one keyset page {"items": [...], "next_cursor": ...}
+    - otherwise: the full list (legacy response shape)
+    """
+    try:
+        if cursor:
+            decode_cursor(cursor)
+        if stream:
+            return StreamingResponse(
+                stream_ndjson(collection, query, sort_field, clean, limit=limit, cursor=cursor),
+                media_type="application/x-ndjson"
+            )
+        if limit:
+            return await fetch_page(collection, query, sort_field, clean, limit, cursor=cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return [clean(doc) async for doc in sorted_cursor(collection, query, sort_field, cursor)]
+
 # Routes
 
 @api_router.get("/")
@@ -103,71 +185,20 @@ async def login(credentials: UserLogin):
 # Positions
 @api_router.get("/positions")
 async def get_positions(user_id: str, portfolio_id: Optional[str] = None):
-    # Build query based on portfolio_id
-    query = {"user_id": user_id}
-    if portfolio_id:
-        query["portfolio_id"] = portfolio_id
-    
-    # Only get current positions (quantity > 0)
-    query["quantity"] = {"$gt": 0}
-    
-    positions = await db.positions.find(query).to_list(1000)
-    
-    # Get user's benchmark setting
-    user_settings = await db.user_settings.find_one({"user_id": user_id})
-    benchmark_index = user_settings.get('benchmark_index', '^GSPC') if user_settings else '^GSPC'
-    
-    # Enrich with current market data and metrics
-    enriched_positions = []
-    for pos in positions:
-        current_price = yf_service.get_current_price(pos['symbol'])
-        if current_price is None:
-            current_price = pos['avg_price']
-        
-        total_value = pos['quantity'] * current_price
-        invested = pos['quantity'] * pos['avg_price']
-        gain_loss = total_value - invested
-        gain_loss_percent = (gain_loss / invested * 100) if invested > 0 else 0
-        
-        # Calculate metrics using user's benchmark
-        beta = analytics_service.calculate_position_beta(pos['symbol'], market_index=benchmark_index)
-        volatility = analytics_service.calculate_position_volatility(pos['symbol'])
-        
-        # Create clean position dict without MongoDB _id
-        clean_pos = {k: v for k, v in pos.items() if k != '_id'}
-        # Convert datetime objects to ISO strings
-        if 'created_at' in clean_pos and hasattr(clean_pos['created_at'], 'isoformat'):
-            clean_pos['created_at'] = clean_pos['created_at'].isoformat()
-        if 'updated_at' in clean_pos and hasattr(clean_pos['updated_at'], 'isoformat'):
-            clean_pos['updated_at'] = clean_pos['updated_at'].isoformat()
-        if 'purchase_date' in clean_pos and hasattr(clean_pos['purchase_date'], 'isoformat'):
-            clean_pos['purchase_date'] = clean_pos['purchase_date'].isoformat()
-        
-        enriched_positions.append({
-            **clean_pos,
-            'current_price': round(current_price, 2),
-            'total_value': round(total_value, 2),
-            'invested': round(invested, 2),
-            'gain_loss': round(gain_loss, 2),
-            'gain_loss_percent': round(gain_loss_percent, 2),
-            'weight': 0,  # Will be calculated in portfolio summary
-            'beta': beta,
-            'volatility': volatility,
-            'last_update': datetime.utcnow().isoformat()
-        })
-    
-    # Calculate weights
-    total_portfolio_value = sum(p['total_value'] for p in enriched_positions)
-    if total_portfolio_value > 0:
-        for pos in enriched_positions:
-            pos['weight'] = round((pos['total_value'] / total_portfolio_value) * 100, 2)
-    
-    return enriched_positions
+    snapshot = await snapshot_service.get(user_id, portfolio_id)
+    return snapshot.positions
+
+async def resolve_portfolio_id(user_id: str, portfolio_id: Optional[str] = None) -> str:
+    """Target portfolio of a write: the given one, else the default (created if the user has none)"""
+    resolved = await portfolio_resolver.resolve(user_id, portfolio_id)
+    if resolved is None:
+        raise HTTPException(status_code=404, detail="Portefeuille non trouvé")
+    return resolved
 
 @api_router.post("/positions")
 async def add_position(position_data: PositionCreate, user_id: str):
     # Get ticker info to validate and get name
-    ticker_info = yf_service.get_ticker_info(position_data.symbol)
+    ticker_info = await symbol_metadata.get(position_data.symbol.upper())
     if not ticker_info:
         raise HTTPException(status_code=404, detail=f"Symbole {position_data.symbol} non trouvé")
     
@@ -175,24 +206,7 @@ async def add_position(position_data: PositionCreate, user_id: str):
     transaction_date = position_data.purchase_date if position_data.purchase_date else datetime.utcnow()
     
     # Get portfolio_id - use provided one or get the default portfolio
-    portfolio_id = position_data.portfolio_id
-    if not portfolio_id:
-        default_portfolio = await db.portfolios.find_one({"user_id": user_id, "is_default": True})
-        if not default_portfolio:
-            first_portfolio = await db.portfolios.find_one({"user_id": user_id})
-            if first_portfolio:
-                portfolio_id = first_portfolio['id']
-            else:
-                new_portfolio = Portfolio(
-                    user_id=user_id,
-                    name="Portefeuille Principal",
-                    description="Mon portefeuille par défaut",
-                    is_default=True
-                )
-                await db.portfolios.insert_one(new_portfolio.dict())
-                portfolio_id = new_portfolio.id
-        else:
-            portfolio_id = default_portfolio['id']
+    portfolio_id = await resolve_portfolio_id(user_id, position_data.portfolio_id)
     
     symbol_upper = position_data.symbol.upper()
     quantity = position_data.quantity
@@ -200,287 +214,198 @@ async def add_position(position_data: PositionCreate, user_id: str):
     transaction_type = position_data.transaction_type or "buy"
     link_to_cash = position_data.link_to_cash
     cash_currency = position_data.cash_currency or "EUR"
-    transaction_total = quantity * price
+    event_bus.watch(user_id, [symbol_upper])
     
-    # Check if position already exists for this symbol in this portfolio
-    existing_position = await db.positions.find_one({
-        "user_id": user_id,
-        "portfolio_id": portfolio_id,
-        "symbol": symbol_upper
-    })
+    # Position, ledger and cash are written atomically (one transaction on a replica set)
+    try:
+        booked = await trade_booking.book({
+            "user_id": user_id,
+            "portfolio_id": portfolio_id,
+            "symbol": symbol_upper,
+            "name": ticker_info['name'],
+            "type": position_data.type,
+            "side": "sell" if transaction_type == "sell" else "buy",
+            "quantity": quantity,
+            "price": price,
+            "date": transaction_date,
+            "link_to_cash": link_to_cash,
+            "cash_currency": cash_currency
+        })
+    except TradeRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    snapshot_service.invalidate(user_id)
+    
+    trade_total = quantity * price
+    new_balance = booked['new_balance']
+    cash_result = {
+        "new_cash_balance": round(new_balance, 2) if link_to_cash else None,
+        "currency": cash_currency if link_to_cash else None
+    }
     
     if transaction_type == "sell":
-        # SELL TRANSACTION
-        if not existing_position:
-            raise HTTPException(status_code=400, detail=f"Vous ne détenez pas de position sur {symbol_upper}")
-        
-        old_quantity = existing_position['quantity']
-        
-        if quantity > old_quantity:
-            raise HTTPException(status_code=400, detail=f"Quantité insuffisante. Vous détenez {old_quantity} unités de {symbol_upper}")
-        
-        new_quantity = old_quantity - quantity
-        sale_total = quantity * price
-        
-        # Create sell transaction with portfolio_id
-        transaction = Transaction(
-            user_id=user_id,
-            symbol=symbol_upper,
-            type="sell",
-            quantity=quantity,
-            price=price,
-            total=sale_total,
-            date=transaction_date
-        )
-        transaction_dict = transaction.dict()
-        transaction_dict['portfolio_id'] = portfolio_id
-        await db.transactions.insert_one(transaction_dict)
-        
-        new_balance = 0
-        # Update cash balance only if linked (selling adds money)
-        if link_to_cash:
-            account = await db.cash_accounts.find_one({"user_id": user_id, "portfolio_id": portfolio_id, "currency": cash_currency})
-            current_balance = account['balance'] if account else 0.0
-            new_balance = current_balance + sale_total
-            
-            if account:
-                await db.cash_accounts.update_one(
-                    {"user_id": user_id, "portfolio_id": portfolio_id, "currency": cash_currency},
-                    {"$set": {"balance": new_balance, "updated_at": datetime.utcnow()}}
-                )
-            else:
-                await db.cash_accounts.insert_one({
-                    "id": str(uuid.uuid4()),
-                    "user_id": user_id,
-                    "portfolio_id": portfolio_id,
-                    "currency": cash_currency,
-                    "balance": new_balance,
-                    "created_at": datetime.utcnow(),
-                    "updated_at": datetime.utcnow()
-                })
-            
-            # Create automatic cash transaction for the sale
-            cash_transaction = CashTransaction(
-                user_id=user_id,
-                type="deposit",
-                amount=sale_total,
-                description=f"Vente {quantity} x {symbol_upper} à {price}€",
-                date=transaction_date
-            )
-            cash_tx_dict = cash_transaction.dict()
-            cash_tx_dict['currency'] = cash_currency
-            cash_tx_dict['portfolio_id'] = portfolio_id
-            await db.cash_transactions.insert_one(cash_tx_dict)
-        
-        cash_msg = f" +{round(sale_total, 2)} {cash_currency} ajoutés au solde cash." if link_to_cash else ""
-        
-        if new_quantity <= 0:
-            # Position completely sold - delete it
-            await db.positions.delete_one({"id": existing_position['id']})
+        cash_msg = f" +{round(trade_total, 2)} {cash_currency} ajoutés au solde cash." if link_to_cash else ""
+        if booked['closed']:
             return {
-                "id": existing_position['id'],
+                "id": booked['position_id'],
                 "symbol": symbol_upper,
                 "quantity": 0,
-                "sale_total": round(sale_total, 2),
-                "new_cash_balance": round(new_balance, 2) if link_to_cash else None,
-                "currency": cash_currency if link_to_cash else None,
+                "sale_total": round(trade_total, 2),
+                **cash_result,
                 "message": f"Position {symbol_upper} entièrement vendue ({quantity} unités à {price}€).{cash_msg}"
             }
+        return {
+            "id": booked['position_id'],
+            "symbol": symbol_upper,
+            "quantity": booked['quantity'],
+            "avg_price": booked['avg_price'],
+            "sale_total": round(trade_total, 2),
+            **cash_result,
+            "message": f"Vente partielle: {quantity} unités vendues à {price}€. Reste {booked['quantity']} unités.{cash_msg}"
+        }
+    
+    cash_msg = f" -{round(trade_total, 2)} {cash_currency} déduits du solde cash." if link_to_cash else ""
+    if not booked['created']:
+        return {
+            "id": booked['position_id'],
+            "symbol": symbol_upper,
+            "quantity": booked['quantity'],
+            "avg_price": booked['avg_price'],
+            **cash_result,
+            "message": f"Achat fusionné: {booked['old_quantity']} + {quantity} = {booked['quantity']} unités au PRU de {round(booked['avg_price'], 2)}€.{cash_msg}"
+        }
+    return {
+        "id": booked['position_id'],
+        "symbol": symbol_upper,
+        "quantity": quantity,
+        "avg_price": price,
+        "name": ticker_info['name'],
+        **cash_result,
+        "message": f"Nouvelle position créée: {quantity} unités de {symbol_upper} à {price}€.{cash_msg}"
+    }
+
+@api_router.post("/positions/batch")
+async def add_positions_batch(trades: List[PositionCreate], user_id: str):
+    """
+    Book many buys and sells in one request (e.g. a rebalance). Symbols are validated
+    with one metadata lookup, legs are netted per position and written in bulk; each
+    leg gets its own result (booked or rejected with the reason)
+    """
+    if not trades:
+        raise HTTPException(status_code=400, detail="Aucune opération à enregistrer")
+    
+    metadata = await symbol_metadata.get_many([t.symbol.upper() for t in trades])
+    portfolio_ids = {}
+    legs, leg_indexes, results = [], [], []
+    for index, trade in enumerate(trades):
+        symbol = trade.symbol.upper()
+        side = "sell" if trade.transaction_type == "sell" else "buy"
+        error = None
+        if symbol not in metadata:
+            error = f"Symbole {trade.symbol} non trouvé"
+        elif trade.quantity <= 0 or trade.avg_price < 0:
+            error = "Quantité ou prix invalide"
         else:
-            # Partial sell - update quantity (PRU stays the same)
-            await db.positions.update_one(
-                {"id": existing_position['id']},
-                {
-                    "$set": {
-                        "quantity": new_quantity,
-                        "updated_at": datetime.utcnow()
-                    }
-                }
-            )
-            return {
-                "id": existing_position['id'],
-                "symbol": symbol_upper,
-                "quantity": new_quantity,
-                "avg_price": existing_position['avg_price'],
-                "sale_total": round(sale_total, 2),
-                "new_cash_balance": round(new_balance, 2) if link_to_cash else None,
-                "currency": cash_currency if link_to_cash else None,
-                "message": f"Vente partielle: {quantity} unités vendues à {price}€. Reste {new_quantity} unités.{cash_msg}"
-            }
-    else:
-        # BUY TRANSACTION
-        buy_total = quantity * price
-        
-        # Update cash balance if linked (buying subtracts money)
-        new_balance = None
-        cash_msg = ""
-        if link_to_cash:
-            account = await db.cash_accounts.find_one({"user_id": user_id, "portfolio_id": portfolio_id, "currency": cash_currency})
-            current_balance = account['balance'] if account else 0.0
-            new_balance = current_balance - buy_total
-            
-            if account:
-                await db.cash_accounts.update_one(
-                    {"user_id": user_id, "portfolio_id": portfolio_id, "currency": cash_currency},
-                    {"$set": {"balance": new_balance, "updated_at": datetime.utcnow()}}
-                )
-            else:
-                await db.cash_accounts.insert_one({
-                    "id": str(uuid.uuid4()),
-                    "user_id": user_id,
-                    "portfolio_id": portfolio_id,
-                    "currency": cash_currency,
-                    "balance": new_balance,
-                    "created_at": datetime.utcnow(),
-                    "updated_at": datetime.utcnow()
-                })
-            
-            # Create automatic cash transaction for the purchase
-            cash_transaction = CashTransaction(
-                user_id=user_id,
-                type="withdrawal",
-                amount=buy_total,
-                description=f"Achat {quantity} x {symbol_upper} à {price}€",
-                date=transaction_date
-            )
-            cash_tx_dict = cash_transaction.dict()
-            cash_tx_dict['currency'] = cash_currency
-            cash_tx_dict['portfolio_id'] = portfolio_id
-            await db.cash_transactions.insert_one(cash_tx_dict)
-            cash_msg = f" -{round(buy_total, 2)} {cash_currency} déduits du solde cash."
+            if trade.portfolio_id not in portfolio_ids:
+                portfolio_ids[trade.portfolio_id] = await portfolio_resolver.resolve(user_id, trade.portfolio_id)
+            if portfolio_ids[trade.portfolio_id] is None:
+                error = "Portefeuille non trouvé"
+        if error:
+            results.append({"index": index, "symbol": symbol, "side": side, "status": "rejected", "error": error})
+            continue
         
-        if existing_position:
-            # Merge with existing position
-            old_quantity = existing_position['quantity']
-            old_price = existing_position['avg_price']
-            
-            total_quantity = old_quantity + quantity
-            weighted_avg_price = ((old_quantity * old_price) + (quantity * price)) / total_quantity
-            
-            await db.positions.update_one(
-                {"id": existing_position['id']},
-                {
-                    "$set": {
-                        "quantity": total_quantity,
-                        "avg_price": round(weighted_avg_price, 4),
-                        "updated_at": datetime.utcnow()
-                    }
-                }
-            )
-            
-            # Create buy transaction with portfolio_id
-            transaction = Transaction(
-                user_id=user_id,
-                symbol=symbol_upper,
-                type="buy",
-                quantity=quantity,
-                price=price,
-                total=buy_total,
-                date=transaction_date
-            )
-            transaction_dict = transaction.dict()
-            transaction_dict['portfolio_id'] = portfolio_id
-            await db.transactions.insert_one(transaction_dict)
-            
-            return {
-                "id": existing_position['id'],
-                "symbol": symbol_upper,
-                "quantity": total_quantity,
-                "avg_price": round(weighted_avg_price, 4),
-                "new_cash_balance": round(new_balance, 2) if link_to_cash else None,
-                "currency": cash_currency if link_to_cash else None,
-                "message": f"Achat fusionné: {old_quantity} + {quantity} = {total_quantity} unités au PRU de {round(weighted_avg_price, 2)}€.{cash_msg}"
-            }
-        else:
-            # Create new position
-            position = Position(
-                user_id=user_id,
-                portfolio_id=portfolio_id,
-                symbol=symbol_upper,
-                name=ticker_info['name'],
-                type=position_data.type,
-                quantity=quantity,
-                avg_price=price,
-                purchase_date=transaction_date
-            )
-            
-            await db.positions.insert_one(position.dict())
-            
-            # Create buy transaction with portfolio_id
-            transaction = Transaction(
-                user_id=user_id,
-                symbol=symbol_upper,
-                type="buy",
-                quantity=quantity,
-                price=price,
-                total=buy_total,
-                date=transaction_date
-            )
-            transaction_dict = transaction.dict()
-            transaction_dict['portfolio_id'] = portfolio_id
-            await db.transactions.insert_one(transaction_dict)
-            
-            return {
-                "id": position.id,
-                "symbol": symbol_upper,
-                "quantity": quantity,
-                "avg_price": price,
-                "name": ticker_info['name'],
-                "new_cash_balance": round(new_balance, 2) if link_to_cash else None,
-                "currency": cash_currency if link_to_cash else None,
-                "message": f"Nouvelle position créée: {quantity} unités de {symbol_upper} à {price}€.{cash_msg}"
-            }
+        legs.append({
+            "user_id": user_id,
+            "portfolio_id": portfolio_ids[trade.portfolio_id],
+            "symbol": symbol,
+            "name": metadata[symbol]['name'],
+            "type": trade.type,
+            "side": side,
+            "quantity": trade.quantity,
+            "price": trade.avg_price,
+            "date": trade.purchase_date or datetime.utcnow(),
+            "link_to_cash": trade.link_to_cash,
+            "cash_currency": trade.cash_currency or "EUR"
+        })
+        leg_indexes.append(index)
+    
+    positions, cash_balances = [], []
+    if legs:
+        try:
+            booked = await trade_booking.book_batch(legs)
+        except TradeConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        for result in booked['results']:
+            results.append({**result, "index": leg_indexes[result['index']]})
+        positions, cash_balances = booked['positions'], booked['cash_balances']
+        event_bus.watch(user_id, [leg['symbol'] for leg in legs])
+        snapshot_service.invalidate(user_id)
+    
+    results.sort(key=lambda r: r['index'])
+    booked_count = sum(1 for r in results if r['status'] == 'booked')
+    return {
+        "booked": booked_count,
+        "rejected": len(results) - booked_count,
+        "results": results,
+        "positions": positions,
+        "cash_balances": cash_balances,
+        "message": f"{booked_count} opération(s) enregistrée(s) sur {len(results)}"
+    }
 
 @api_router.delete("/positions/{position_id}")
 async def delete_position(position_id: str, user_id: str):
     result = await db.positions.delete_one({"id": position_id, "user_id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Position not found")
+    snapshot_service.invalidate(user_id)
     return {"message": "Position deleted successfully"}
 
 # Merge duplicate positions utility endpoint
 @api_router.post("/positions/merge-duplicates")
 async def merge_duplicate_positions(user_id: str):
     """Merge all duplicate positions (same symbol) into single positions with weighted average price"""
-    positions = await db.positions.find({"user_id": user_id}).to_list(1000)
-    
-    if not positions:
-        return {"message": "Aucune position trouvée", "merged": 0}
-    
-    # Group positions by (portfolio_id, symbol)
-    position_groups = {}
-    for pos in positions:
-        key = (pos.get('portfolio_id', 'default'), pos['symbol'])
-        if key not in position_groups:
-            position_groups[key] = []
-        position_groups[key].append(pos)
-    
+    # Group by (portfolio_id, symbol) in MongoDB; only groups with duplicates come back.
+    # Positions are sorted in insertion order so the oldest one is kept.
+    pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$sort": {"_id": 1}},
+        {"$group": {
+            "_id": {"portfolio_id": {"$ifNull": ["$portfolio_id", "default"]}, "symbol": "$symbol"},
+            "keep_id": {"$first": "$id"},
+            "ids": {"$push": "$id"},
+            "count": {"$sum": 1},
+            "quantity": {"$sum": "$quantity"},
+            "cost": {"$sum": {"$multiply": ["$quantity", "$avg_price"]}},
+            "first_avg_price": {"$first": "$avg_price"},
+            "purchase_date": {"$min": "$purchase_date"}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    
+    operations = []
     merged_count = 0
+    now = datetime.utcnow()
+    async for group in db.positions.aggregate(pipeline, allowDiskUse=True):
+        total_quantity = group['quantity']
+        weighted_avg = group['cost'] / total_quantity if total_quantity else group['first_avg_price']
+        update = {
+            "quantity": total_quantity,
+            "avg_price": round(weighted_avg, 4),
+            "updated_at": now
+        }
+        if group.get('purchase_date'):
+            # The merged position is held since its oldest lot
+            update["purchase_date"] = group['purchase_date']
+        operations.append(UpdateOne({"id": group['keep_id']}, {"$set": update}))
+        operations.append(DeleteMany({"id": {"$in": [i for i in group['ids'] if i != group['keep_id']]}}))
+        merged_count += group['count'] - 1
     
-    for key, group in position_groups.items():
-        if len(group) > 1:
-            # Multiple positions for same symbol - merge them
-            total_quantity = sum(p['quantity'] for p in group)
-            weighted_avg = sum(p['quantity'] * p['avg_price'] for p in group) / total_quantity
-            
-            # Keep the first position and update it
-            main_position = group[0]
-            await db.positions.update_one(
-                {"id": main_position['id']},
-                {
-                    "$set": {
-                        "quantity": total_quantity,
-                        "avg_price": round(weighted_avg, 4),
-                        "updated_at": datetime.utcnow()
-                    }
-                }
-            )
-            
-            # Delete the other duplicate positions
-            for pos in group[1:]:
-                await db.positions.delete_one({"id": pos['id']})
-                merged_count += 1
+    if not operations:
+        return {"message": "Aucune position en doublon", "merged": 0}
     
+    # One ordered round-trip: each kept position is updated before its duplicates are removed
+    await db.positions.bulk_write(operations, ordered=True)
+    
+    snapshot_service.invalidate(user_id)
     return {
         "message": f"{merged_count} positions en doublon fusionnées",
         "merged": merged_count
@@ -489,285 +414,210 @@ async def merge_duplicate_positions(user_id: str):
 # Portfolio Summary
 @api_router.get("/portfolio/summary")
 async def get_portfolio_summary(user_id: str, portfolio_id: Optional[str] = None):
-    # Build query based on portfolio_id
-    query = {"user_id": user_id}
-    if portfolio_id:
-        query["portfolio_id"] = portfolio_id
-    
-    # Only get current positions (quantity > 0)
-    query["quantity"] = {"$gt": 0}
-    
-    # Get positions
-    positions = await db.positions.find(query).to_list(1000)
-    
-    # Get user settings for RFR and benchmark
-    user_settings = await db.user_settings.find_one({"user_id": user_id})
-    risk_free_rate = user_settings.get('risk_free_rate', 3.0) if user_settings else 3.0
-    benchmark_index = user_settings.get('benchmark_index', '^GSPC') if user_settings else '^GSPC'
-    
-    if not positions:
-        # Still need to check for cash even if no positions
-        cash_query = {"user_id": user_id}
-        if portfolio_id:
-            cash_query["portfolio_id"] = portfolio_id
-        cash_accounts = await db.cash_accounts.find(cash_query).to_list(100)
-        
-        # Convert all cash to EUR
-        total_cash_eur = 0.0
-        cash_details = []
-        for acc in cash_accounts:
-            currency = acc.get('currency', 'EUR')
-            balance = acc.get('balance', 0)
-            if balance != 0:
-                balance_in_eur = yf_service.convert_to_eur(balance, currency)
-                total_cash_eur += balance_in_eur
-                cash_details.append({
-                    'currency': currency,
-                    'balance': balance,
-                    'balance_eur': round(balance_in_eur, 2)
-                })
-        
-        # Get capital contributions
-        capital_query = {"user_id": user_id}
-        if portfolio_id:
-            capital_query["portfolio_id"] = portfolio_id
-        contributions = await db.capital_contributions.find(capital_query).to_list(1000)
-        total_deposits = sum(c['amount'] for c in contributions if c['type'] == 'deposit')
-        total_withdrawals = sum(c['amount'] for c in contributions if c['type'] == 'withdrawal')
-        net_capital = total_deposits - total_withdrawals
-        
-        capital_gain_loss = total_cash_eur - net_capital if net_capital > 0 else 0
-        capital_performance_percent = (capital_gain_loss / net_capital * 100) if net_capital > 0 else 0
-        
-        return {
-            "total_value": round(total_cash_eur, 2),
-            "positions_value": 0,
-            "cash_value": round(total_cash_eur, 2),
-            "cash_details": cash_details,
-            "total_invested": 0,
-            "total_gain_loss": 0,
-            "gain_loss_percent": 0,
-            "daily_change": 0,
-            "daily_change_percent": 0,
-            "volatility": {'historical': 0, 'realized': 0},
-            "beta": 1.0,
-            "sharpe_ratio": 0,
-            "risk_free_rate": risk_free_rate,
-            "benchmark_index": benchmark_index,
-            "holding_period_days": 0,
-            "first_purchase_date": None,
-            "net_capital": round(net_capital, 2),
-            "capital_gain_loss": round(capital_gain_loss, 2),
-            "capital_performance_percent": round(capital_performance_percent, 2),
-            "portfolio_id": portfolio_id
-        }
-    
-    # Calculate portfolio metrics
-    total_value = 0
-    total_invested = 0
-    enriched_positions = []
-    earliest_purchase_date = None
-    
-    for pos in positions:
-        current_price = yf_service.get_current_price(pos['symbol'])
-        if current_price is None:
-            current_price = pos['avg_price']
-        
-        position_value = pos['quantity'] * current_price
-        position_invested = pos['quantity'] * pos['avg_price']
-        
-        total_value += position_value
-        total_invested += position_invested
-        
-        # Track earliest purchase date
-        purchase_date = pos.get('purchase_date')
-        if purchase_date:
-            if earliest_purchase_date is None or purchase_date < earliest_purchase_date:
-                earliest_purchase_date = purchase_date
-        
-        enriched_positions.append({
-            'symbol': pos['symbol'],
-            'total_value': position_value,
-            'invested': position_invested,
-            'quantity': pos['quantity'],
-            'purchase_date': pos.get('purchase_date')
-        })
-    
-    total_gain_loss = total_value - total_invested
-    gain_loss_percent = (total_gain_loss / total_invested * 100) if total_invested > 0 else 0
-    
-    # Calculate volatility (historical and realized)
-    volatility = analytics_service.calculate_portfolio_volatility(enriched_positions)
-    realized_volatility = analytics_service.calculate_realized_volatility(enriched_positions)
-    volatility['realized'] = realized_volatility
-    
-    # Calculate beta using user's benchmark
-    beta = analytics_service.calculate_portfolio_beta(enriched_positions, market_index=benchmark_index)
-    
-    # Calculate Sharpe ratio with user's RFR
-    sharpe_ratio = analytics_service.calculate_sharpe_ratio_custom(enriched_positions, risk_free_rate)
-    
-    # Calculate daily change
-    daily_change = 0
-    daily_change_percent = 0
-    for pos in positions:
-        change = yf_service.get_daily_change(pos['symbol'])
-        if change:
-            position_value = pos['quantity'] * (change.get('current_price', pos['avg_price']))
-            weight = position_value / total_value if total_value > 0 else 0
-            daily_change += pos['quantity'] * change.get('price_change', 0)
-            daily_change_percent += weight * change.get('change_percent', 0)
-    
-    # Calculate holding period
-    holding_period_days = 0
-    if earliest_purchase_date:
-        if hasattr(earliest_purchase_date, 'replace'):
-            earliest_purchase_date = earliest_purchase_date.replace(tzinfo=None)
-        holding_period_days = (datetime.utcnow() - earliest_purchase_date).days
-    
-    # Get capital contributions for this specific portfolio
-    capital_query = {"user_id": user_id}
-    if portfolio_id:
-        capital_query["portfolio_id"] = portfolio_id
-    
-    contributions = await db.capital_contributions.find(capital_query).to_list(1000)
-    total_deposits = sum(c['amount'] for c in contributions if c['type'] == 'deposit')
-    total_withdrawals = sum(c['amount'] for c in contributions if c['type'] == 'withdrawal')
-    net_capital = total_deposits - total_withdrawals
-    
-    # Get cash accounts for this portfolio and convert all to EUR
-    cash_query = {"user_id": user_id}
-    if portfolio_id:
-        cash_query["portfolio_id"] = portfolio_id
-    
-    cash_accounts = await db.cash_accounts.find(cash_query).to_list(100)
-    
-    # Convert all cash to EUR for accurate total
-    total_cash_eur = 0.0
-    cash_details = []
-    for acc in cash_accounts:
-        currency = acc.get('currency', 'EUR')
-        balance = acc.get('balance', 0)
-        if balance != 0:
-            balance_in_eur = yf_service.convert_to_eur(balance, currency)
-            total_cash_eur += balance_in_eur
-            cash_details.append({
-                'currency': currency,
-                'balance': balance,
-                'balance_eur': round(balance_in_eur, 2)
-            })
-    
-    # Total value includes positions + cash (all in EUR)
-    total_value_with_cash = total_value + total_cash_eur
-    
-    # Calculate performance based on capital contributions (using total value with cash)
-    capital_gain_loss = total_value_with_cash - net_capital if net_capital > 0 else 0
-    capital_performance_percent = (capital_gain_loss / net_capital * 100) if net_capital > 0 else 0
-    
+    snapshot = await snapshot_service.get(user_id, portfolio_id)
+    # Since-inception TWR/MWR are cached apart from the snapshot (they replay the ledger)
+    return {**snapshot.summary, **await snapshot_service.returns(snapshot)}
+
+@api_router.get("/dashboard")
+async def get_dashboard(user_id: str, portfolio_id: Optional[str] = None, refresh: bool = False):
+    """Summary, positions and recommendations of a portfolio in one round-trip"""
+    snapshot = await snapshot_service.get(user_id, portfolio_id, refresh=refresh)
     return {
-        "total_value": round(total_value_with_cash, 2),
-        "positions_value": round(total_value, 2),
-        "cash_value": round(total_cash_eur, 2),
-        "cash_details": cash_details,
-        "total_invested": round(total_invested, 2),
-        "total_gain_loss": round(total_gain_loss, 2),
-        "gain_loss_percent": round(gain_loss_percent, 2),
-        "daily_change": round(daily_change, 2),
-        "daily_change_percent": round(daily_change_percent, 2),
-        "volatility": volatility,
-        "beta": beta,
-        "sharpe_ratio": sharpe_ratio,
-        "risk_free_rate": risk_free_rate,
-        "benchmark_index": benchmark_index,
-        "holding_period_days": holding_period_days,
-        "first_purchase_date": earliest_purchase_date.isoformat() if earliest_purchase_date else None,
-        "net_capital": round(net_capital, 2),
-        "capital_gain_loss": round(capital_gain_loss, 2),
-        "capital_performance_percent": round(capital_performance_percent, 2),
-        "portfolio_id": portfolio_id
+        "summary": snapshot.summary,
+        "positions": snapshot.positions,
+        "recommendations": analytics_service.generate_recommendations(snapshot.positions, snapshot.summary),
+        "computed_at": snapshot.computed_at.isoformat()
     }
 
 # Analytics
 @api_router.get("/analytics/correlation")
-async def get_correlation_matrix(user_id: str):
+async def get_correlation_matrix(user_id: str, format: str = 'pairs'):
+    """
+    Correlation between current positions
+    format: 'pairs' (list of symbol pairs) or 'matrix' (symbols list + flat row-major matrix)
+    """
     # Only get positions with quantity > 0 (current positions, not sold ones)
     positions = await db.positions.find({
         "user_id": user_id,
         "quantity": {"$gt": 0}
     }).to_list(1000)
     
-    if len(positions) < 2:
+    symbols = list(dict.fromkeys(pos['symbol'] for pos in positions))
+    
+    if format == 'matrix':
+        if len(symbols) < 2:
+            return {'symbols': [], 'matrix': []}
+        return await market_data.run(risk_engine.correlation_matrix, symbols)
+    
+    if len(symbols) < 2:
         return []
     
-    symbols = [pos['symbol'] for pos in positions]
-    correlations = analytics_service.calculate_correlation_matrix(symbols)
+    correlations = await market_data.run(analytics_service.calculate_correlation_matrix, symbols)
     
     return correlations
 
 @api_router.get("/analytics/recommendations")
 async def get_recommendations(user_id: str):
-    # Get positions
-    positions_data = await get_positions(user_id)
+    # Positions and summary come from the same snapshot
+    snapshot = await snapshot_service.get(user_id)
     
-    # Get portfolio summary
-    summary_data = await get_portfolio_summary(user_id)
-    
-    # Generate recommendations (summary_data is already a dict)
     recommendations = analytics_service.generate_recommendations(
-        positions_data,
-        summary_data
+        snapshot.positions,
+        snapshot.summary
     )
     
     return recommendations
 
 # Transactions
 @api_router.get("/transactions")
-async def get_transactions(user_id: str):
-    transactions = await db.transactions.find({"user_id": user_id}).sort("date", -1).to_list(1000)
-    
-    # Clean transactions to remove MongoDB _id and convert datetime
-    clean_transactions = []
-    for txn in transactions:
-        clean_txn = {k: v for k, v in txn.items() if k != '_id'}
-        # Convert datetime objects to ISO strings
-        if 'date' in clean_txn:
-            clean_txn['date'] = clean_txn['date'].isoformat()
-        clean_transactions.append(clean_txn)
-    
-    return clean_transactions
+async def get_transactions(user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None, stream: bool = False):
+    """Transaction history, newest first (paginate with limit/cursor, or stream as NDJSON)"""
+    return await paginated_history(db.transactions, {"user_id": user_id}, "date",
+                                   limit=limit, cursor=cursor, stream=stream)
 
 # Market data
 @api_router.get("/market/quote/{symbol}")
 async def get_market_quote(symbol: str):
-    quote = yf_service.get_ticker_info(symbol)
-    if not quote:
+    symbol = symbol.upper()
+    metadata, quotes = await asyncio.gather(symbol_metadata.get(symbol), quote_board.get_quotes([symbol]))
+    if not metadata:
         raise HTTPException(status_code=404, detail=f"Symbol {symbol} not found")
-    return quote
+    quote = quotes.get(symbol)
+    if not quote:
+        # No recent bar on the board: fall back to the live ticker info
+        return await market_data.get_ticker_info(symbol) or {**metadata, 'price': 0}
+    return {
+        'symbol': symbol,
+        'name': metadata['name'],
+        'price': quote['current_price'],
+        'change': quote['price_change'],
+        'change_percent': quote['change_percent'],
+        'currency': metadata.get('currency'),
+        'sector': metadata.get('sector'),
+        'quote_type': metadata.get('quote_type'),
+        'timestamp': quote['timestamp'],
+        'stale': quote['stale']
+    }
+
+@api_router.get("/market/quotes")
+async def get_market_quotes(symbols: str):
+    """
+    Live quotes from the in-memory quote board (comma-separated symbols).
+    Each quote has its timestamp, age_seconds and a stale flag.
+    """
+    return await quote_board.get_quotes([s.strip().upper() for s in symbols.split(',') if s.strip()])
+
+@api_router.get("/admin/cache")
+async def get_cache_stats():
+    """Hit/miss counters and memory usage of the shared history and metadata caches, quote board and event stream status"""
+    return {"history": history_cache.stats(), "quotes": quote_board.stats(),
+            "symbol_metadata": symbol_metadata.stats(), "events": event_bus.stats(),
+            "portfolios": portfolio_resolver.stats()}
+
+@api_router.get("/events")
+async def stream_events(user_id: str, request: Request):
+    """
+    Server-Sent Events of the user: 'quotes' (board updates of held or alerted symbols)
+    and 'alert' (triggered alerts), pushed as they happen
+    """
+    held, watched = await asyncio.gather(
+        db.positions.distinct("symbol", {"user_id": user_id, "quantity": {"$gt": 0}}),
+        db.alerts.distinct("symbol", {"user_id": user_id, "is_active": True})
+    )
+    subscription = event_bus.subscribe(user_id, set(held) | set(watched))
+    return StreamingResponse(
+        event_bus.stream(subscription, is_disconnected=request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/admin/indexes")
+async def get_index_report():
+    """Index usage statistics ($indexStats) for every indexed collection"""
+    return await index_usage_report(db)
 
 @api_router.get("/market/search")
 async def search_market(q: str):
-    results = yf_service.search_ticker(q)
+    results = await market_data.search_ticker(q)
     return results
 
 # Performance endpoints
+async def load_performance_history(positions: List[dict], period: str, per_position: bool = False) -> dict:
+    """
+    Load daily bars of positions for a performance period from the local price store,
+    each symbol over the exact range planned for it: from the period start for the
+    portfolio curve, from max(period start, purchase date) for position curves only
+    """
+    if per_position:
+        windows = history_planner.position_windows(positions, period)
+    else:
+        windows = history_planner.portfolio_windows(positions, period)
+    return await price_history_store.get_ranges(windows)
+
+async def load_ledger_holdings(user_id: str, positions: List[dict], portfolio_id: Optional[str] = None):
+    """
+    Holdings and trade flows per day replayed from the transaction ledger and reconciled
+    with the current positions, plus the positions closed since (needed for their prices)
+    """
+    ledger = await ledger_engine.get_ledger(user_id, portfolio_id)
+    holdings, flows = ledger_engine.reconcile(ledger.holdings, positions, ledger.flows)
+    return holdings, flows, positions + ledger_engine.closed_positions(holdings, positions)
+
+async def load_portfolio_returns(user_id: str, portfolio_id: Optional[str], positions: List[dict]) -> dict:
+    """Since-inception time-weighted and money-weighted returns of positions, from the replayed ledger"""
+    perf_positions = [{
+        'symbol': pos['symbol'],
+        'quantity': pos['quantity'],
+        'avg_price': pos['avg_price'],
+        'purchase_date': pos.get('purchase_date', datetime.utcnow())
+    } for pos in positions]
+    holdings, flows, curve_positions = await load_ledger_holdings(user_id, perf_positions, portfolio_id)
+    history = await load_performance_history(curve_positions, 'all')
+    perf_data = await market_data.run(
+        performance_service.calculate_portfolio_performance,
+        curve_positions,
+        period='all',
+        history=history,
+        columnar=True,
+        holdings=holdings,
+        flows=flows
+    )
+    return {
+        'twr_percent': perf_data.get('twr_percent', 0),
+        'mwr_percent': perf_data.get('mwr_percent'),
+        'mwr_annualized_percent': perf_data.get('mwr_annualized_percent')
+    }
+
 @api_router.get("/analytics/performance")
-async def get_performance(user_id: str, period: str = 'all', symbol: Optional[str] = None):
+async def get_performance(user_id: str, period: str = 'all', symbol: Optional[str] = None, format: str = 'points'):
     """
     Get performance data for portfolio or specific position
     period: 'all', 'ytd', '1m', '3m', '6m', '1y'
+    format: 'points' (one {date, value, change_percent} per day) or 'columnar'
+    (dates, values and change_percent arrays)
     """
+    columnar = format == 'columnar'
     if symbol:
         # Get position data
         position = await db.positions.find_one({"user_id": user_id, "symbol": symbol})
         if not position:
             raise HTTPException(status_code=404, detail="Position not found")
         
-        perf_data = performance_service.calculate_position_performance(
+        purchase_date = position.get('purchase_date', datetime.utcnow())
+        history = await load_performance_history(
+            [{'symbol': position['symbol'], 'purchase_date': purchase_date}], period, per_position=True
+        )
+        hist_data = history.get(position['symbol'])
+        
+        perf_data = await market_data.run(
+            performance_service.calculate_position_performance,
             symbol=position['symbol'],
             quantity=position['quantity'],
             purchase_price=position['avg_price'],
-            purchase_date=position.get('purchase_date', datetime.utcnow()),
-            period=period
+            purchase_date=purchase_date,
+            period=period,
+            hist_data=hist_data,
+            columnar=columnar
         )
         
         return {
@@ -786,15 +636,14 @@ async def get_performance(user_id: str, period: str = 'all', symbol: Optional[st
             return {
                 'symbol': None,
                 'period': period,
-                'data': [],
-                'total_return': 0,
-                'total_return_percent': 0
+                **empty_performance(columnar)
             }
         
         # Enrich positions with current prices
+        current_prices = await quote_board.get_prices([pos['symbol'] for pos in positions])
         enriched_positions = []
         for pos in positions:
-            current_price = yf_service.get_current_price(pos['symbol'])
+            current_price = current_prices.get(pos['symbol'])
             if current_price:
                 enriched_positions.append({
                     'symbol': pos['symbol'],
@@ -803,9 +652,16 @@ async def get_performance(user_id: str, period: str = 'all', symbol: Optional[st
                     'purchase_date': pos.get('purchase_date', datetime.utcnow())
                 })
         
-        perf_data = performance_service.calculate_portfolio_performance(
-            enriched_positions,
-            period=period
+        holdings, flows, curve_positions = await load_ledger_holdings(user_id, enriched_positions)
+        history = await load_performance_history(curve_positions, period)
+        perf_data = await market_data.run(
+            performance_service.calculate_portfolio_performance,
+            curve_positions,
+            period=period,
+            history=history,
+            columnar=columnar,
+            holdings=holdings,
+            flows=flows
         )
         
         return {
@@ -814,9 +670,62 @@ async def get_performance(user_id: str, period: str = 'all', symbol: Optional[st
             **perf_data
         }
 
+@api_router.get("/analytics/performance/batch")
+async def get_batch_performance(
+    user_id: str,
+    period: str = 'all',
+    portfolio_id: Optional[str] = None,
+    symbols: Optional[str] = None,
+    format: str = 'points'
+):
+    """
+    Portfolio performance and the performance of every position in one response
+    period: 'all', 'ytd', '1m', '3m', '6m', '1y'
+    symbols: optional comma-separated list restricting the position curves
+    format: 'points' or 'columnar' (see /analytics/performance)
+    """
+    query = {"user_id": user_id, "quantity": {"$gt": 0}}
+    if portfolio_id:
+        query["portfolio_id"] = portfolio_id
+    positions = await db.positions.find(query).to_list(1000)
+
+    perf_positions = [{
+        'symbol': pos['symbol'],
+        'quantity': pos['quantity'],
+        'avg_price': pos['avg_price'],
+        'purchase_date': pos.get('purchase_date', datetime.utcnow())
+    } for pos in positions]
+    symbol_filter = [s.strip().upper() for s in symbols.split(',') if s.strip()] if symbols else None
+
+    # One history load and one price matrix for the portfolio curve and all position curves
+    holdings, flows, curve_positions = await load_ledger_holdings(user_id, perf_positions, portfolio_id)
+    history = await load_performance_history(curve_positions, period)
+    perf_data = await market_data.run(
+        performance_service.calculate_batch_performance,
+        curve_positions,
+        period=period,
+        history=history,
+        symbols=symbol_filter,
+        columnar=format == 'columnar',
+        holdings=holdings,
+        flows=flows
+    )
+
+    return {
+        'period': period,
+        'portfolio': {'symbol': None, 'period': period, **perf_data['portfolio']},
+        'positions': [{'period': period, **p} for p in perf_data['positions']]
+    }
+
 @api_router.get("/analytics/compare-index")
-async def compare_with_index(user_id: str, period: str = 'ytd', index: str = '^GSPC'):
-    """Compare portfolio performance with market index"""
+async def compare_with_index(user_id: str, period: str = 'ytd', index: str = '^GSPC', format: str = 'points'):
+    """
+    Compare portfolio performance with market index
+    format: 'points' (one {date, portfolio_percent, index_percent} per day) or 'columnar'
+    (dates, portfolio_percent and index_percent arrays)
+    """
+    columnar = format == 'columnar'
+    empty = {'dates': [], 'portfolio_percent': [], 'index_percent': []} if columnar else {'data': []}
     # Get portfolio performance - only current positions
     positions = await db.positions.find({
         "user_id": user_id,
@@ -824,7 +733,7 @@ async def compare_with_index(user_id: str, period: str = 'ytd', index: str = '^G
     }).to_list(1000)
     
     if not positions:
-        return {'data': []}
+        return empty
     
     enriched_positions = []
     for pos in positions:
@@ -835,8 +744,17 @@ async def compare_with_index(user_id: str, period: str = 'ytd', index: str = '^G
             'purchase_date': pos.get('purchase_date', datetime.utcnow())
         })
     
-    perf_data = performance_service.calculate_portfolio_performance(enriched_positions, period=period)
-    comparison = performance_service.compare_with_index(perf_data['data'], index)
+    holdings, _, curve_positions = await load_ledger_holdings(user_id, enriched_positions)
+    history = await load_performance_history(curve_positions, period)
+    # Columnar portfolio series: only its dates and change percentages are needed here
+    perf_data = await market_data.run(performance_service.calculate_portfolio_performance, curve_positions,
+                                      period=period, history=history, columnar=True, holdings=holdings)
+    if not perf_data['dates']:
+        return empty
+    
+    index_history = await price_history_store.get_history(index, datetime.strptime(perf_data['dates'][0], '%Y-%m-%d'))
+    comparison = await market_data.run(performance_service.compare_with_index, perf_data, index,
+                                       index_history=index_history, columnar=columnar)
     
     return comparison
 
@@ -854,9 +772,10 @@ async def get_sector_distribution(user_id: str):
         return []
     
     # Enrich with current prices
+    current_prices = await quote_board.get_prices([pos['symbol'] for pos in positions])
     enriched_positions = []
     for pos in positions:
-        current_price = yf_service.get_current_price(pos['symbol'])
+        current_price = current_prices.get(pos['symbol'])
         if current_price:
             total_value = pos['quantity'] * current_price
             enriched_positions.append({
@@ -865,14 +784,19 @@ async def get_sector_distribution(user_id: str):
                 'total_value': total_value
             })
     
-    distribution = sector_service.calculate_sector_distribution(enriched_positions)
+    # Sectors come from the persisted symbol metadata: a pure in-memory group-by
+    metadata = await symbol_metadata.get_many(
+        [pos['symbol'] for pos in enriched_positions if pos['type'] not in ('crypto', 'etf')]
+    )
+    distribution = sector_service.calculate_sector_distribution(enriched_positions, metadata)
     return distribution
 
 # Dividends endpoints
 @api_router.get("/dividends")
-async def get_dividends(user_id: str):
-    dividends = await db.dividends.find({"user_id": user_id}).sort("date", -1).to_list(1000)
-    return dividends
+async def get_dividends(user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None, stream: bool = False):
+    """Dividend history, newest first (paginate with limit/cursor, or stream as NDJSON)"""
+    return await paginated_history(db.dividends, {"user_id": user_id}, "date",
+                                   limit=limit, cursor=cursor, stream=stream)
 
 @api_router.post("/dividends")
 async def add_dividend(dividend_data: DividendCreate, user_id: str):
@@ -902,20 +826,10 @@ async def delete_dividend(dividend_id: str, user_id: str):
 
 # Alerts endpoints
 @api_router.get("/alerts")
-async def get_alerts(user_id: str):
-    alerts = await db.alerts.find({"user_id": user_id}).sort("created_at", -1).to_list(1000)
-    
-    # Clean MongoDB _id and convert dates
-    clean_alerts = []
-    for alert in alerts:
-        clean_alert = {k: v for k, v in alert.items() if k != '_id'}
-        if 'created_at' in clean_alert and hasattr(clean_alert['created_at'], 'isoformat'):
-            clean_alert['created_at'] = clean_alert['created_at'].isoformat()
-        if 'triggered_at' in clean_alert and clean_alert['triggered_at'] and hasattr(clean_alert['triggered_at'], 'isoformat'):
-            clean_alert['triggered_at'] = clean_alert['triggered_at'].isoformat()
-        clean_alerts.append(clean_alert)
-    
-    return clean_alerts
+async def get_alerts(user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None, stream: bool = False):
+    """Alerts, newest first (paginate with limit/cursor, or stream as NDJSON)"""
+    return await paginated_history(db.alerts, {"user_id": user_id}, "created_at",
+                                   limit=limit, cursor=cursor, stream=stream)
 
 @api_router.get("/alerts/triggered")
 async def get_triggered_alerts(user_id: str):
@@ -939,65 +853,41 @@ async def get_triggered_alerts(user_id: str):
 
 @api_router.get("/alerts/check")
 async def check_alerts(user_id: str):
-    """Check all active alerts and trigger them if conditions are met"""
-    alerts = await db.alerts.find({
-        "user_id": user_id,
-        "is_active": True,
-        "is_triggered": False
-    }).to_list(1000)
-    
-    triggered_alerts = []
-    
-    for alert in alerts:
-        symbol = alert['symbol']
-        current_price = yf_service.get_current_price(symbol)
-        
-        if current_price is None:
-            continue
-        
-        should_trigger = False
-        
-        if alert['alert_type'] == 'price_above' and current_price >= alert['target_value']:
-            should_trigger = True
-        elif alert['alert_type'] == 'price_below' and current_price <= alert['target_value']:
-            should_trigger = True
-        
-        if should_trigger:
-            # Update alert as triggered
-            await db.alerts.update_one(
-                {"id": alert['id']},
-                {
-                    "$set": {
-                        "is_triggered": True,
-                        "triggered_at": datetime.utcnow(),
-                        "triggered_price": current_price
-                    }
-                }
-            )
-            triggered_alerts.append({
-                "id": alert['id'],
-                "symbol": symbol,
-                "alert_type": alert['alert_type'],
-                "target_value": alert['target_value'],
-                "current_price": current_price,
-                "notes": alert.get('notes')
-            })
-    
+    """Evaluate the user's armed alerts now (all alerts are also evaluated on every quote board refresh)"""
+    checked = alert_engine.count(user_id)
+    triggered = await alert_engine.evaluate_now(user_id)
+
+    triggered_alerts = [
+        {
+            "id": alert['id'],
+            "symbol": alert['symbol'],
+            "alert_type": alert['alert_type'],
+            "target_value": alert['target_value'],
+            "current_price": alert['current_price'],
+            "current_value": alert['current_value'],
+            "notes": alert.get('notes')
+        }
+        for alert in triggered if alert['user_id'] == user_id
+    ]
+
     return {
-        "checked": len(alerts),
+        "checked": checked,
         "triggered": len(triggered_alerts),
         "alerts": triggered_alerts
     }
 
 @api_router.post("/alerts")
 async def create_alert(alert_data: AlertCreate, user_id: str):
+    if alert_data.alert_type not in ALERT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Type d'alerte inconnu: {alert_data.alert_type}")
     # Validate symbol
-    ticker_info = yf_service.get_ticker_info(alert_data.symbol)
+    ticker_info, current_price = await market_data.gather([
+        symbol_metadata.get(alert_data.symbol.upper()),
+        market_data.get_current_price(alert_data.symbol)
+    ])
     if not ticker_info:
         raise HTTPException(status_code=404, detail=f"Symbole {alert_data.symbol} non trouvé")
     
-    current_price = yf_service.get_current_price(alert_data.symbol)
-    
     alert = Alert(
         user_id=user_id,
         symbol=alert_data.symbol.upper(),
@@ -1007,10 +897,13 @@ async def create_alert(alert_data: AlertCreate, user_id: str):
     )
     
     await db.alerts.insert_one(alert.dict())
+    await alert_engine.add(alert.dict())
+    event_bus.watch(user_id, [alert.symbol])
     
     return {
         **alert.dict(),
         "current_price": current_price,
+        "current_volatility": alert_engine.volatility.get(alert.symbol),
         "symbol_name": ticker_info['name']
     }
 
@@ -1035,12 +928,16 @@ async def reactivate_alert(alert_id: str, user_id: str):
                 "is_triggered": False,
                 "is_acknowledged": False,
                 "triggered_at": None,
-                "triggered_price": None
+                "triggered_price": None,
+                "triggered_value": None
             }
         }
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Alerte non trouvée")
+    alert = await db.alerts.find_one({"id": alert_id}, {"_id": 0})
+    if alert:
+        await alert_engine.add(alert)
     return {"message": "Alerte réactivée"}
 
 @api_router.put("/alerts/{alert_id}")
@@ -1051,6 +948,11 @@ async def update_alert(alert_id: str, user_id: str, is_active: bool):
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Alerte non trouvée")
+    alert = await db.alerts.find_one({"id": alert_id}, {"_id": 0})
+    if alert:
+        await alert_engine.add(alert)
+    else:
+        alert_engine.remove(alert_id)
     return {"message": "Alerte mise à jour"}
 
 @api_router.delete("/alerts/{alert_id}")
@@ -1058,6 +960,7 @@ async def delete_alert(alert_id: str, user_id: str):
     result = await db.alerts.delete_one({"id": alert_id, "user_id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Alerte non trouvée")
+    alert_engine.remove(alert_id)
     return {"message": "Alerte supprimée"}
 
 # Goals endpoints
@@ -1196,62 +1099,68 @@ async def create_or_update_budget(budget_data: BudgetCreate, user_id: str):
 # CSV Import endpoint
 @api_router.post("/import/csv")
 async def import_csv(user_id: str, positions: List[dict]):
-    """Import positions from CSV data"""
-    imported_count = 0
-    errors = []
-    
-    # Get or create default portfolio
-    default_portfolio = await db.portfolios.find_one({"user_id": user_id, "is_default": True})
-    if not default_portfolio:
-        first_portfolio = await db.portfolios.find_one({"user_id": user_id})
-        if first_portfolio:
-            portfolio_id = first_portfolio['id']
-        else:
-            new_portfolio = Portfolio(
-                user_id=user_id,
-                name="Portefeuille Principal",
-                description="Mon portefeuille par défaut",
-                is_default=True
-            )
-            await db.portfolios.insert_one(new_portfolio.dict())
-            portfolio_id = new_portfolio.id
-    else:
-        portfolio_id = default_portfolio['id']
-    
-    for pos_data in positions:
-        try:
-            symbol = pos_data.get('symbol', '').upper()
-            if not symbol:
-                continue
-            
-            # Try to get ticker info (validate symbol)
-            ticker_info = yf_service.get_ticker_info(symbol)
-            name = ticker_info['name'] if ticker_info else symbol
-            
-            # Create position
-            position = Position(
-                user_id=user_id,
-                portfolio_id=portfolio_id,
-                symbol=symbol,
-                name=name,
-                type=pos_data.get('type', 'stock'),
-                quantity=float(pos_data.get('quantity', 0)),
-                avg_price=float(pos_data.get('avg_price', 0)),
-                purchase_date=datetime.fromisoformat(pos_data.get('purchase_date', datetime.utcnow().isoformat()))
-            )
-            
-            await db.positions.insert_one(position.dict())
-            imported_count += 1
-            
-        except Exception as e:
-            errors.append(f"Erreur pour {pos_data.get('symbol', 'inconnu')}: {str(e)}")
+    """Import positions from CSV data (already parsed rows; use /import/csv/upload for files)"""
+    portfolio_id = await resolve_portfolio_id(user_id)
+    imported_count, errors = await csv_import.import_rows(user_id, portfolio_id, positions)
     
+    snapshot_service.invalidate(user_id)
     return {
         "imported": imported_count,
-        "errors": errors,
+        "errors": [f"Erreur pour {e['symbol'] or 'inconnu'} (ligne {e['row']}): {e['error']}" for e in errors],
         "message": f"{imported_count} positions importées avec succès"
     }
 
+async def run_import_job(job: dict, path: str):
+    await csv_import.run_job(job, path)
+    snapshot_service.invalidate(job['user_id'])
+
+@api_router.post("/import/csv/upload", status_code=202)
+async def upload_csv(
+    user_id: str,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    portfolio_id: Optional[str] = None,
+    encoding: Optional[str] = None
+):
+    """
+    Import positions from a CSV file (columns symbol, quantity, avg_price, purchase_date, type;
+    ',' or ';' separated; UTF-8 or Windows-1252 detected unless encoding is given).
+    Runs in the background: follow it with /import/jobs/{job_id}
+    """
+    if encoding:
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            raise HTTPException(status_code=400, detail=f"Encodage inconnu: {encoding}")
+    portfolio_id = await resolve_portfolio_id(user_id, portfolio_id)
+
+    # Spool the upload to disk chunk by chunk; the job parses it incrementally
+    spool = tempfile.NamedTemporaryFile(delete=False, suffix='.csv')
+    try:
+        with spool:
+            while True:
+                data = await file.read(1024 * 1024)
+                if not data:
+                    break
+                spool.write(data)
+        await file.close()
+        job = await csv_import.create_job(user_id, portfolio_id, file.filename, encoding)
+    except Exception:
+        # The background job owns the file only once it is scheduled
+        os.remove(spool.name)
+        raise
+
+    background_tasks.add_task(run_import_job, job, spool.name)
+    return {"job_id": job['id'], "status": job['status'], "message": "Import démarré"}
+
+@api_router.get("/import/jobs/{job_id}")
+async def get_import_job(job_id: str, user_id: str):
+    """Progress and per-row error report of a CSV import job"""
+    job = await csv_import.get_job(job_id, user_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import non trouvé")
+    return job
+
 # Portfolio Management endpoints (Multi-portfolio)
 @api_router.get("/portfolios")
 async def get_portfolios(user_id: str):
@@ -1267,6 +1176,7 @@ async def get_portfolios(user_id: str):
             is_default=True
         )
         await db.portfolios.insert_one(default_portfolio.dict())
+        portfolio_resolver.invalidate(user_id)
         portfolios = [default_portfolio.dict()]
     
     # Clean MongoDB _id
@@ -1290,6 +1200,7 @@ async def create_portfolio(portfolio_data: PortfolioCreate, user_id: str):
     )
     
     await db.portfolios.insert_one(portfolio.dict())
+    portfolio_resolver.invalidate(user_id)
     
     return {
         "id": portfolio.id,
@@ -1307,6 +1218,7 @@ async def update_portfolio(portfolio_id: str, portfolio_data: PortfolioCreate, u
         {"id": portfolio_id, "user_id": user_id},
         {"$set": {"name": portfolio_data.name, "description": portfolio_data.description}}
     )
+    portfolio_resolver.invalidate(user_id)
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Portefeuille non trouvé")
     return {"message": "Portefeuille mis à jour avec succès"}
@@ -1332,9 +1244,11 @@ async def delete_portfolio(portfolio_id: str, user_id: str):
     
     # Delete the portfolio
     result = await db.portfolios.delete_one({"id": portfolio_id, "user_id": user_id})
+    portfolio_resolver.invalidate(user_id)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Portefeuille non trouvé")
     
+    snapshot_service.invalidate(user_id)
     return {"message": "Portefeuille supprimé avec succès"}
 
 # User Settings endpoints
@@ -1382,6 +1296,7 @@ async def update_user_settings(settings_data: UserSettingsUpdate, user_id: str):
         )
         await db.user_settings.insert_one(new_settings.dict())
     
+    snapshot_service.invalidate(user_id)
     return {
         "message": "Paramètres mis à jour", 
         "risk_free_rate": settings_data.risk_free_rate,
@@ -1389,42 +1304,52 @@ async def update_user_settings(settings_data: UserSettingsUpdate, user_id: str):
     }
 
 # Capital Contributions (Versements) endpoints - Now portfolio-specific
+def clean_contribution(c: dict) -> dict:
+    return {
+        "id": c.get("id"),
+        "type": c.get("type"),
+        "amount": c.get("amount"),
+        "description": c.get("description", ""),
+        "date": c.get("date").isoformat() if hasattr(c.get("date"), 'isoformat') else c.get("date"),
+        "portfolio_id": c.get("portfolio_id")
+    }
+
 @api_router.get("/capital")
-async def get_capital_summary(user_id: str, portfolio_id: Optional[str] = None):
-    """Get total capital contributions (deposits - withdrawals) for a specific portfolio"""
+async def get_capital_summary(user_id: str, portfolio_id: Optional[str] = None,
+                              limit: Optional[int] = None, cursor: Optional[str] = None, stream: bool = False):
+    """
+    Get total capital contributions (deposits - withdrawals) for a specific portfolio.
+    Contributions can be paginated with limit/cursor, or streamed alone as NDJSON.
+    """
     # Build query - portfolio_id is required for accurate data
     query = {"user_id": user_id}
     if portfolio_id:
         query["portfolio_id"] = portfolio_id
     else:
         # Get default portfolio if not specified
-        default_portfolio = await db.portfolios.find_one({"user_id": user_id, "is_default": True})
-        if default_portfolio:
-            query["portfolio_id"] = default_portfolio['id']
+        default_portfolio_id = await portfolio_resolver.default_id(user_id, create=False)
+        if default_portfolio_id:
+            query["portfolio_id"] = default_portfolio_id
     
-    contributions = await db.capital_contributions.find(query).sort("date", -1).to_list(1000)
+    contributions = await paginated_history(db.capital_contributions, query, "date", clean=clean_contribution,
+                                            limit=limit, cursor=cursor, stream=stream)
+    if stream:
+        return contributions
     
-    total_deposits = sum(c['amount'] for c in contributions if c['type'] == 'deposit')
-    total_withdrawals = sum(c['amount'] for c in contributions if c['type'] == 'withdrawal')
+    total_deposits, total_withdrawals = await get_capital_totals(db, query)
     net_capital = total_deposits - total_withdrawals
     
-    # Clean MongoDB _id from contributions
-    clean_contributions = [{
-        "id": c.get("id"),
-        "type": c.get("type"),
-        "amount": c.get("amount"),
-        "description": c.get("description", ""),
-        "date": c.get("date").isoformat() if hasattr(c.get("date"), 'isoformat') else c.get("date"),
-        "portfolio_id": c.get("portfolio_id")
-    } for c in contributions]
-    
-    return {
+    response = {
         "total_deposits": round(total_deposits, 2),
         "total_withdrawals": round(total_withdrawals, 2),
         "net_capital": round(net_capital, 2),
-        "contributions": clean_contributions,
+        "contributions": contributions,
         "portfolio_id": query.get("portfolio_id")
     }
+    if limit:
+        response["contributions"] = contributions["items"]
+        response["next_cursor"] = contributions["next_cursor"]
+    return response
 
 @api_router.post("/capital")
 async def add_capital_contribution(user_id: str, type: str, amount: float, portfolio_id: Optional[str] = None, description: str = ""):
@@ -1437,13 +1362,7 @@ async def add_capital_contribution(user_id: str, type: str, amount: float, portf
     
     # Get portfolio_id if not provided
     if not portfolio_id:
-        default_portfolio = await db.portfolios.find_one({"user_id": user_id, "is_default": True})
-        if default_portfolio:
-            portfolio_id = default_portfolio['id']
-        else:
-            first_portfolio = await db.portfolios.find_one({"user_id": user_id})
-            if first_portfolio:
-                portfolio_id = first_portfolio['id']
+        portfolio_id = await portfolio_resolver.default_id(user_id)
     
     contribution = {
         "id": str(uuid.uuid4()),
@@ -1459,11 +1378,10 @@ async def add_capital_contribution(user_id: str, type: str, amount: float, portf
     await db.capital_contributions.insert_one(contribution)
     
     # Recalculate totals for this portfolio
-    contributions = await db.capital_contributions.find({"user_id": user_id, "portfolio_id": portfolio_id}).to_list(1000)
-    total_deposits = sum(c['amount'] for c in contributions if c['type'] == 'deposit')
-    total_withdrawals = sum(c['amount'] for c in contributions if c['type'] == 'withdrawal')
+    total_deposits, total_withdrawals = await get_capital_totals(db, {"user_id": user_id, "portfolio_id": portfolio_id})
     net_capital = total_deposits - total_withdrawals
     
+    snapshot_service.invalidate(user_id)
     return {
         "message": "Versement ajouté" if type == "deposit" else "Retrait ajouté",
         "id": contribution["id"],
@@ -1477,6 +1395,7 @@ async def delete_capital_contribution(contribution_id: str, user_id: str):
     result = await db.capital_contributions.delete_one({"id": contribution_id, "user_id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Contribution non trouvée")
+    snapshot_service.invalidate(user_id)
     return {"message": "Contribution supprimée"}
 
 # Cash Management endpoints - Multi-currency accounts (Now portfolio-specific)
@@ -1489,9 +1408,9 @@ async def get_cash_accounts(user_id: str, portfolio_id: Optional[str] = None):
         query["portfolio_id"] = portfolio_id
     else:
         # Get default portfolio if not specified
-        default_portfolio = await db.portfolios.find_one({"user_id": user_id, "is_default": True})
-        if default_portfolio:
-            query["portfolio_id"] = default_portfolio['id']
+        default_portfolio_id = await portfolio_resolver.default_id(user_id, create=False)
+        if default_portfolio_id:
+            query["portfolio_id"] = default_portfolio_id
     
     accounts = await db.cash_accounts.find(query).to_list(100)
     
@@ -1523,13 +1442,7 @@ async def create_cash_account(user_id: str, currency: str = "EUR", portfolio_id:
     """Create a new cash account for a specific currency and portfolio"""
     # Get portfolio_id if not provided
     if not portfolio_id:
-        default_portfolio = await db.portfolios.find_one({"user_id": user_id, "is_default": True})
-        if default_portfolio:
-            portfolio_id = default_portfolio['id']
-        else:
-            first_portfolio = await db.portfolios.find_one({"user_id": user_id})
-            if first_portfolio:
-                portfolio_id = first_portfolio['id']
+        portfolio_id = await portfolio_resolver.default_id(user_id)
     
     # Check if account already exists for this currency and portfolio
     existing = await db.cash_accounts.find_one({"user_id": user_id, "portfolio_id": portfolio_id, "currency": currency})
@@ -1546,6 +1459,7 @@ async def create_cash_account(user_id: str, currency: str = "EUR", portfolio_id:
         "updated_at": datetime.utcnow()
     }
     await db.cash_accounts.insert_one(new_account)
+    snapshot_service.invalidate(user_id)
     return {"message": "Compte créé", "id": new_account["id"], "currency": currency, "portfolio_id": portfolio_id}
 
 @api_router.put("/cash-accounts/{currency}")
@@ -1553,9 +1467,7 @@ async def update_cash_account(currency: str, user_id: str, amount: float, operat
     """Update cash account balance. Operation: 'set', 'add', 'subtract'"""
     # Get portfolio_id if not provided
     if not portfolio_id:
-        default_portfolio = await db.portfolios.find_one({"user_id": user_id, "is_default": True})
-        if default_portfolio:
-            portfolio_id = default_portfolio['id']
+        portfolio_id = await portfolio_resolver.default_id(user_id)
     
     account = await db.cash_accounts.find_one({"user_id": user_id, "portfolio_id": portfolio_id, "currency": currency})
     
@@ -1588,6 +1500,7 @@ async def update_cash_account(currency: str, user_id: str, amount: float, operat
         {"$set": {"balance": new_balance, "updated_at": datetime.utcnow()}}
     )
     
+    snapshot_service.invalidate(user_id)
     return {"message": "Solde mis à jour", "currency": currency, "balance": new_balance, "portfolio_id": portfolio_id}
 
 @api_router.delete("/cash-accounts/{currency}")
@@ -1595,13 +1508,12 @@ async def delete_cash_account(currency: str, user_id: str, portfolio_id: Optiona
     """Delete a cash account"""
     # Get portfolio_id if not provided
     if not portfolio_id:
-        default_portfolio = await db.portfolios.find_one({"user_id": user_id, "is_default": True})
-        if default_portfolio:
-            portfolio_id = default_portfolio['id']
+        portfolio_id = await portfolio_resolver.default_id(user_id, create=False)
     
     result = await db.cash_accounts.delete_one({"user_id": user_id, "portfolio_id": portfolio_id, "currency": currency})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Compte non trouvé")
+    snapshot_service.invalidate(user_id)
     return {"message": "Compte supprimé"}
 
 # Legacy Cash endpoints (keeping for backward compatibility)
@@ -1621,20 +1533,10 @@ async def get_cash_balance(user_id: str):
     }
 
 @api_router.get("/cash/transactions")
-async def get_cash_transactions(user_id: str):
-    """Get cash transaction history"""
-    transactions = await db.cash_transactions.find({"user_id": user_id}).sort("date", -1).to_list(1000)
-    
-    clean_transactions = []
-    for t in transactions:
-        clean_t = {k: v for k, v in t.items() if k != '_id'}
-        if 'date' in clean_t and hasattr(clean_t['date'], 'isoformat'):
-            clean_t['date'] = clean_t['date'].isoformat()
-        if 'created_at' in clean_t and hasattr(clean_t['created_at'], 'isoformat'):
-            clean_t['created_at'] = clean_t['created_at'].isoformat()
-        clean_transactions.append(clean_t)
-    
-    return clean_transactions
+async def get_cash_transactions(user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None, stream: bool = False):
+    """Get cash transaction history (paginate with limit/cursor, or stream as NDJSON)"""
+    return await paginated_history(db.cash_transactions, {"user_id": user_id}, "date",
+                                   limit=limit, cursor=cursor, stream=stream)
 
 @api_router.post("/cash/transaction")
 async def add_cash_transaction(transaction_data: CashTransactionCreate, user_id: str):
@@ -1728,10 +1630,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def init_db_indexes():
+    await ensure_indexes(db)
+
+@app.on_event("startup")
+async def start_quote_board():
+    await alert_engine.load()
+    quote_board.subscribe(alert_engine.on_quotes)
+    quote_board.subscribe(event_bus.on_quotes)
+    alert_engine.subscribe(event_bus.on_alerts)
+    quote_board.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
 
+@app.on_event("shutdown")
+async def shutdown_market_data():
+    await quote_board.stop()
+    market_data.shutdown()
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime
+
+from utils.csv_import import CsvImportPipeline
+from utils.trade_booking import TradeBookingService
+
+
+class RecordingCollection:
+    """Collection stand-in recording the bulk writes and inserts it receives"""
+
+    def __init__(self):
+        self.bulk_writes = []
+        self.inserted = []
+
+    async def bulk_write(self, operations, ordered=True, session=None):
+        self.bulk_writes.append(operations)
+
+    async def insert_many(self, documents, session=None, **kwargs):
+        self.inserted.extend(documents)
+
+
+class RecordingDatabase:
+    def __init__(self):
+        self.positions = RecordingCollection()
+        self.transactions = RecordingCollection()
+
+
+class StaticMetadata:
+    """SymbolMetadataStore stand-in knowing a fixed set of symbols"""
+
+    def __init__(self, names):
+        self.names = names
+
+    async def get_many(self, symbols):
+        return {s: {'symbol': s, 'name': self.names[s]} for s in symbols if s in self.names}
+
+
+def make_pipeline():
+    db = RecordingDatabase()
+    booking = TradeBookingService(client=None, db=db)
+    # Standalone server: no transactions
+    booking._transactions_supported = False
+    return db, CsvImportPipeline(db, StaticMetadata({'AAPL': 'Apple Inc.', 'MSFT': 'Microsoft'}), booking)
+
+
+def test_import_nets_rows_of_the_same_symbol_into_one_upsert():
+    db, pipeline = make_pipeline()
+    rows = [
+        {'symbol': 'AAPL', 'quantity': '10', 'avg_price': '100', 'purchase_date': '01/02/2024'},
+        {'symbol': 'MSFT', 'quantity': '1', 'avg_price': '300'},
+        {'symbol': 'aapl', 'quantity': '30', 'avg_price': '120', 'purchase_date': '2023-06-15'},
+        {'symbol': 'NOPE', 'quantity': '1', 'avg_price': '1'},
+    ]
+
+    imported, errors = asyncio.run(pipeline.import_rows('user-1', 'portfolio-1', rows))
+
+    assert imported == 3
+    assert [(e['row'], e['symbol']) for e in errors] == [(4, 'NOPE')]
+
+    [operations] = db.positions.bulk_writes
+    by_symbol = {op._filter['symbol']: op for op in operations}
+    assert sorted(by_symbol) == ['AAPL', 'MSFT']
+    aapl = by_symbol['AAPL']
+    assert aapl._upsert
+    assert aapl._filter == {'user_id': 'user-1', 'portfolio_id': 'portfolio-1', 'symbol': 'AAPL'}
+    update = aapl._doc[0]['$set']
+    # One buy of the netted lots, added to whatever the portfolio already holds
+    assert update['quantity'] == {'$add': [{'$ifNull': ['$quantity', 0]}, 40.0]}
+    assert update['purchase_date'] == {'$ifNull': ['$purchase_date', datetime(2023, 6, 15)]}
+    weighted_cost = update['avg_price']['$cond'][1]['$round'][0]['$divide'][0]['$add'][1]
+    assert weighted_cost == 10 * 100 + 30 * 120
+
+    # Every row keeps its own ledger entry
+    assert sorted((t['symbol'], t['quantity']) for t in db.transactions.inserted) == [
+        ('AAPL', 10.0), ('AAPL', 30.0), ('MSFT', 1.0)
+    ]
+    assert {t['portfolio_id'] for t in db.transactions.inserted} == {'portfolio-1'}
@@ -0,0 +1,22 @@
+import asyncio
+
+from utils.keyed_locks import KeyedLocks
+
+
+def test_locks_are_dropped_once_released():
+    locks = KeyedLocks()
+    order = []
+
+    async def worker(name):
+        async with locks.hold('AAPL'):
+            order.append(f'{name} in')
+            await asyncio.sleep(0)
+            order.append(f'{name} out')
+
+    async def run():
+        await asyncio.gather(worker('a'), worker('b'))
+        return len(locks)
+
+    assert asyncio.run(run()) == 0
+    # The second task waited for the first one: no interleaving
+    assert order == ['a in', 'a out', 'b in', 'b out']
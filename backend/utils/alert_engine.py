@@ -0,0 +1,144 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+from .alert_manager import AlertManager, ALERT_TYPES, VOLATILITY_ALERT_TYPES
+from .rolling_volatility import RollingVolatilityTracker
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two full reloads of the alert index from the database
+# (picks up alerts written by other server processes)
+ALERT_INDEX_RELOAD_INTERVAL = int(os.environ.get('ALERT_INDEX_RELOAD_INTERVAL', '300'))
+
+
+class AlertEngine:
+    """
+    Server-side evaluation of every active alert, across all users.
+
+    Active, untriggered alerts live in an AlertManager index (sorted thresholds per
+    symbol and alert type). On each quote board tick, the rolling volatility of the
+    symbols watched by volatility alerts is updated from the new quotes, the index is
+    evaluated in batch (one price and one volatility per symbol, however many alerts
+    watch it) and all triggers are written with a single bulk_write.
+    """
+
+    def __init__(self, db, quote_board, price_history, reload_interval: int = ALERT_INDEX_RELOAD_INTERVAL):
+        self.db = db
+        self.quote_board = quote_board
+        self.reload_interval = reload_interval
+        self.manager = AlertManager()
+        self.volatility = RollingVolatilityTracker(price_history)
+        self._lock = asyncio.Lock()
+        self._listeners: List[Callable[[List[Dict]], Awaitable]] = []
+        # Adds and removals made while load() reads the database, replayed on the new index
+        self._pending: Optional[List[Tuple[str, object]]] = None
+        self.loaded_at: Optional[datetime] = None
+
+    def subscribe(self, listener: Callable[[List[Dict]], Awaitable]):
+        """Register a coroutine called with the alerts triggered by each evaluation"""
+        self._listeners.append(listener)
+
+    async def load(self):
+        """(Re)build the index from every active, untriggered alert"""
+        self._pending = []
+        try:
+            alerts = await self.db.alerts.find(
+                {"is_active": True, "is_triggered": False, "alert_type": {"$in": list(ALERT_TYPES)}},
+                {"_id": 0, "id": 1, "user_id": 1, "symbol": 1, "alert_type": 1, "target_value": 1, "notes": 1}
+            ).to_list(None)
+            manager = AlertManager(alerts)
+
+            # History reads (possibly from Yahoo Finance) happen before taking the lock
+            seeded = await self.volatility.fetch(manager.symbols(VOLATILITY_ALERT_TYPES))
+            async with self._lock:
+                self.volatility.install(seeded)
+                for action, payload in self._pending:
+                    if action == 'add':
+                        manager.add(payload)
+                    else:
+                        manager.remove(payload)
+                self.manager = manager
+                self.volatility.retain(manager.symbols(VOLATILITY_ALERT_TYPES))
+                self.loaded_at = datetime.utcnow()
+        finally:
+            self._pending = None
+        logger.info(f"Alert index loaded: {manager.count()} alerts on {len(manager.symbols())} symbols")
+
+    async def add(self, alert: Dict):
+        """Index a new or reactivated alert"""
+        seeded = {}
+        if alert.get('alert_type') in VOLATILITY_ALERT_TYPES:
+            seeded = await self.volatility.fetch([alert['symbol']])
+        async with self._lock:
+            self.volatility.install(seeded)
+            self.manager.add(alert)
+            if self._pending is not None:
+                self._pending.append(('add', alert))
+
+    def remove(self, alert_id: str):
+        """Drop a deleted or deactivated alert from the index"""
+        # Synchronous, so it cannot interleave with a swap of the index
+        self.manager.remove(alert_id)
+        if self._pending is not None:
+            self._pending.append(('remove', alert_id))
+
+    def count(self, user_id: Optional[str] = None) -> int:
+        return self.manager.count(user_id)
+
+    async def on_quotes(self, quotes: Dict[str, Dict]):
+        """Quote board listener: evaluate the alerts of the refreshed symbols"""
+        if self.loaded_at is None or (datetime.utcnow() - self.loaded_at).total_seconds() >= self.reload_interval:
+            await self.load()
+        await self.evaluate(quotes)
+
+    async def evaluate_now(self, user_id: Optional[str] = None) -> List[Dict]:
+        """Evaluate the indexed alerts on the symbols watched by user_id (all symbols if None) against the current quotes"""
+        if self.loaded_at is None:
+            await self.load()
+        symbols = self.manager.symbols(user_id=user_id)
+        if not symbols:
+            return []
+        return await self.evaluate(await self.quote_board.get_quotes(symbols))
+
+    async def evaluate(self, quotes: Dict[str, Dict]) -> List[Dict]:
+        """Trigger every alert crossed by quotes ({symbol: quote}); returns the triggered alerts"""
+        volatility_symbols = set(self.manager.symbols(VOLATILITY_ALERT_TYPES))
+        volatility_quotes = {symbol: quote for symbol, quote in quotes.items() if symbol in volatility_symbols}
+        # Symbols that missed bars are reseeded from history before taking the lock
+        reseeded = await self.volatility.fetch(self.volatility.stale(volatility_quotes), force=True)
+
+        async with self._lock:
+            self.volatility.install(reseeded)
+            volatilities = self.volatility.update(volatility_quotes)
+            triggered = self.manager.evaluate(
+                {symbol: quote['current_price'] for symbol, quote in quotes.items()},
+                volatilities
+            )
+            if not triggered:
+                return []
+
+            now = datetime.utcnow()
+            operations = [
+                UpdateOne(
+                    {"id": alert['id'], "is_active": True, "is_triggered": False},
+                    {"$set": {
+                        "is_triggered": True,
+                        "triggered_at": now,
+                        "triggered_price": alert['current_price'],
+                        "triggered_value": alert['current_value']
+                    }}
+                )
+                for alert in triggered
+            ]
+            await self.db.alerts.bulk_write(operations, ordered=False)
+            logger.info(f"Triggered {len(triggered)} alerts")
+
+        for listener in self._listeners:
+            try:
+                await listener(triggered)
+            except Exception as e:
+                logger.error(f"Alert listener failed: {str(e)}")
+        return triggered
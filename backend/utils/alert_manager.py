@@ -1,60 +1,125 @@
 import logging
-from typing import List, Dict
-from datetime import datetime
+from bisect import bisect_left, bisect_right, insort
+from typing import List, Dict, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+PRICE_ALERT_TYPES = ('price_above', 'price_below')
+VOLATILITY_ALERT_TYPES = ('volatility_high',)
+ALERT_TYPES = PRICE_ALERT_TYPES + VOLATILITY_ALERT_TYPES
+
+
+class ThresholdBook:
+    """Thresholds of one symbol and alert type, kept sorted as (target_value, alert_id)"""
+
+    def __init__(self):
+        self.entries: List[Tuple[float, str]] = []
+
+    def add(self, target_value: float, alert_id: str):
+        insort(self.entries, (target_value, alert_id))
+
+    def remove(self, target_value: float, alert_id: str):
+        i = bisect_left(self.entries, (target_value, alert_id))
+        if i < len(self.entries) and self.entries[i] == (target_value, alert_id):
+            del self.entries[i]
+
+    def pop_at_or_below(self, value: float) -> List[Tuple[float, str]]:
+        """Remove and return every threshold <= value"""
+        # Alert ids are uuid strings: '\uffff' sorts after all of them
+        i = bisect_right(self.entries, (value, '\uffff'))
+        crossed, self.entries = self.entries[:i], self.entries[i:]
+        return crossed
+
+    def pop_at_or_above(self, value: float) -> List[Tuple[float, str]]:
+        """Remove and return every threshold >= value"""
+        i = bisect_left(self.entries, (value, ''))
+        crossed, self.entries = self.entries[i:], self.entries[:i]
+        return crossed
+
+    def __len__(self):
+        return len(self.entries)
+
+
 class AlertManager:
-    """Service for managing price and volatility alerts"""
-    
-    @staticmethod
-    def check_price_alerts(current_price: float, alerts: List[Dict]) -> List[Dict]:
-        """Check if any price alerts should be triggered"""
-        triggered = []
-        
-        for alert in alerts:
-            if not alert.get('is_active', True) or alert.get('is_triggered', False):
+    """
+    In-memory index of armed price and volatility alerts, evaluated in batch.
+
+    Alerts are kept in one sorted ThresholdBook per (symbol, alert type); evaluating a
+    batch of prices and volatilities bisects each book once per symbol and removes the
+    crossed alerts from the index.
+    """
+
+    def __init__(self, alerts: Optional[List[Dict]] = None):
+        self._books: Dict[Tuple[str, str], ThresholdBook] = {}
+        self._alerts: Dict[str, Dict] = {}
+        for alert in alerts or []:
+            self.add(alert)
+
+    def add(self, alert: Dict):
+        """Index an active, untriggered alert (replacing its previous version)"""
+        if alert.get('alert_type') not in ALERT_TYPES:
+            return
+        self.remove(alert['id'])
+        if not alert.get('is_active', True) or alert.get('is_triggered', False):
+            return
+        self._alerts[alert['id']] = alert
+        self._books.setdefault((alert['symbol'], alert['alert_type']), ThresholdBook()).add(alert['target_value'], alert['id'])
+
+    def remove(self, alert_id: str):
+        alert = self._alerts.pop(alert_id, None)
+        if alert is None:
+            return
+        book = self._books.get((alert['symbol'], alert['alert_type']))
+        if book is not None:
+            book.remove(alert['target_value'], alert_id)
+
+    def symbols(self, alert_types: Tuple[str, ...] = ALERT_TYPES, user_id: Optional[str] = None) -> List[str]:
+        """Symbols watched by at least one indexed alert of alert_types (of user_id if given)"""
+        if user_id is not None:
+            return sorted({a['symbol'] for a in self._alerts.values() if a['user_id'] == user_id and a['alert_type'] in alert_types})
+        return sorted({symbol for (symbol, alert_type), book in self._books.items() if alert_type in alert_types and len(book)})
+
+    def count(self, user_id: Optional[str] = None) -> int:
+        if user_id is None:
+            return len(self._alerts)
+        return sum(1 for alert in self._alerts.values() if alert['user_id'] == user_id)
+
+    def evaluate(self, prices: Dict[str, float], volatilities: Optional[Dict[str, float]] = None) -> List[Dict]:
+        """
+        Alerts crossed by prices and annualized volatilities (%), one value per symbol.
+        Triggered alerts are removed from the index and returned with the value that
+        crossed their threshold
+        """
+        crossed = []
+        for symbol, price in prices.items():
+            if price is None:
                 continue
-            
-            alert_type = alert['alert_type']
-            target_value = alert['target_value']
-            
-            should_trigger = False
-            
-            if alert_type == 'price_above' and current_price >= target_value:
-                should_trigger = True
-            elif alert_type == 'price_below' and current_price <= target_value:
-                should_trigger = True
-            
-            if should_trigger:
-                triggered.append({
-                    'alert_id': alert['id'],
-                    'symbol': alert['symbol'],
-                    'type': alert_type,
-                    'target': target_value,
-                    'current': current_price,
-                    'message': f"{alert['symbol']} has reached {current_price} (target: {target_value})"
-                })
-        
-        return triggered
-    
-    @staticmethod
-    def check_volatility_alerts(volatility: float, alerts: List[Dict]) -> List[Dict]:
-        """Check if any volatility alerts should be triggered"""
+            above = self._books.get((symbol, 'price_above'))
+            if above:
+                crossed.extend((alert_id, price) for _, alert_id in above.pop_at_or_below(price))
+            below = self._books.get((symbol, 'price_below'))
+            if below:
+                crossed.extend((alert_id, price) for _, alert_id in below.pop_at_or_above(price))
+        for symbol, volatility in (volatilities or {}).items():
+            book = self._books.get((symbol, 'volatility_high'))
+            if book and volatility is not None:
+                crossed.extend((alert_id, volatility) for _, alert_id in book.pop_at_or_below(volatility))
+
         triggered = []
-        
-        for alert in alerts:
-            if not alert.get('is_active', True) or alert.get('is_triggered', False):
+        for alert_id, value in crossed:
+            alert = self._alerts.pop(alert_id, None)
+            if alert is None:
                 continue
-            
-            if alert['alert_type'] == 'volatility_high' and volatility >= alert['target_value']:
-                triggered.append({
-                    'alert_id': alert['id'],
-                    'symbol': alert['symbol'],
-                    'type': 'volatility_high',
-                    'target': alert['target_value'],
-                    'current': volatility,
-                    'message': f"{alert['symbol']} volatility is {volatility}% (threshold: {alert['target_value']}%)"
-                })
-        
+            triggered.append({
+                **alert,
+                'current_price': prices.get(alert['symbol']),
+                'current_value': value,
+                'message': self._message(alert, value)
+            })
         return triggered
+
+    @staticmethod
+    def _message(alert: Dict, value: float) -> str:
+        if alert['alert_type'] == 'volatility_high':
+            return f"{alert['symbol']} volatility is {value}% (threshold: {alert['target_value']}%)"
+        return f"{alert['symbol']} has reached {value} (target: {alert['target_value']})"
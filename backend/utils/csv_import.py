@@ -0,0 +1,275 @@
+import os
+import io
+import csv
+import uuid
+import codecs
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rows parsed, validated and written per batch
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', '500'))
+# Row errors kept in a job's report (the failed counter keeps counting past it)
+IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', '1000'))
+
+# Accepted CSV headers per field (lowercased), covering common broker exports
+FIELD_ALIASES = {
+    'symbol': ('symbol', 'ticker', 'symbole'),
+    'quantity': ('quantity', 'qty', 'quantite', 'quantité'),
+    'avg_price': ('avg_price', 'price', 'prix', 'pru'),
+    'purchase_date': ('purchase_date', 'date', "date d'achat"),
+    'type': ('type',),
+}
+DATE_FORMATS = ('%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y')
+# Encoding assumed when a file is not valid UTF-8 (Excel and most French broker exports on Windows)
+FALLBACK_ENCODING = 'cp1252'
+# Bytes read to detect the encoding of a file
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+
+def _number(value) -> float:
+    """Float from a CSV cell, accepting decimal commas and thousands spaces (1 234,5)"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return float(str(value).replace('\xa0', '').replace(' ', '').replace(',', '.'))
+
+
+def _date(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    value = str(value).strip()
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    raise ValueError(f"date invalide: {value}")
+
+
+def normalize_row(raw: Dict) -> Dict:
+    """Row with canonical field names (see FIELD_ALIASES), values stripped"""
+    lowered = {str(k).strip().lower(): v.strip() if isinstance(v, str) else v for k, v in raw.items() if k is not None}
+    row = {}
+    for field, aliases in FIELD_ALIASES.items():
+        for alias in aliases:
+            if lowered.get(alias) not in (None, ''):
+                row[field] = lowered[alias]
+                break
+    return row
+
+
+def detect_encoding(sample: bytes) -> str:
+    """UTF-8 (with or without BOM) if sample decodes as such, else FALLBACK_ENCODING"""
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # final=False: the sample may end in the middle of a multi-byte character
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+
+
+def iter_csv_chunks(
+    stream: io.BufferedIOBase,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+    encoding: Optional[str] = None
+) -> Iterator[List[Tuple[int, Dict]]]:
+    """
+    Parse a CSV file incrementally into chunks of (line number, normalized row).
+    The encoding is detected from the start of the (seekable) stream unless given, and
+    the delimiter (',' or ';') is sniffed from the header line. Lines that do not decode
+    yield a row holding only an '_error' key instead of failing the whole file
+    """
+    if encoding is None:
+        encoding = detect_encoding(stream.read(ENCODING_SAMPLE_SIZE))
+        stream.seek(0)
+
+    bad_lines = set()
+
+    def lines():
+        for line_number, raw_line in enumerate(stream, start=1):
+            try:
+                yield raw_line.decode(encoding)
+            except UnicodeDecodeError:
+                bad_lines.add(line_number)
+                yield raw_line.decode(encoding, errors='replace')
+
+    text = lines()
+    header = next(text, '').lstrip('\ufeff')
+    delimiter = ';' if header.count(';') > header.count(',') else ','
+    fieldnames = next(csv.reader([header], delimiter=delimiter), [])
+    reader = csv.reader(text, delimiter=delimiter)
+
+    chunk = []
+    # Line 1 is the header; a quoted field may span several lines
+    last_line = 1
+    for values in reader:
+        first_line, last_line = last_line + 1, reader.line_num + 1
+        if not values:
+            continue
+        if any(first_line <= n <= last_line for n in bad_lines):
+            row = {'_error': f"encodage invalide (fichier lu en {encoding})"}
+        else:
+            row = normalize_row(dict(zip(fieldnames, values)))
+        chunk.append((first_line, row))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class CsvImportPipeline:
+    """
+    Position import in chunks.
+
+    Each chunk of rows is validated locally, its new symbols are resolved in one
+    SymbolMetadataStore.get_many call (symbols already seen in the import are not
+    looked up again), and valid rows are booked as buys with
+    TradeBookingService.book_buys: lots of the same symbol are netted and added to the
+    position already held, with one buy transaction per row. Uploaded files run as
+    background jobs tracked in `db.import_jobs` (progress counters and a per-row error
+    report).
+    """
+
+    def __init__(self, db, symbol_metadata, trade_booking, chunk_size: int = IMPORT_CHUNK_SIZE):
+        self.db = db
+        self.symbol_metadata = symbol_metadata
+        self.trade_booking = trade_booking
+        self.chunk_size = chunk_size
+
+    async def create_job(self, user_id: str, portfolio_id: str, filename: Optional[str], encoding: Optional[str] = None) -> Dict:
+        """encoding: of the uploaded file, detected when the job runs if None"""
+        job = {
+            'id': str(uuid.uuid4()),
+            'user_id': user_id,
+            'portfolio_id': portfolio_id,
+            'filename': filename,
+            'encoding': encoding,
+            'status': 'pending',
+            'rows_read': 0,
+            'imported': 0,
+            'failed': 0,
+            'errors': [],
+            'created_at': datetime.utcnow(),
+            'finished_at': None
+        }
+        await self.db.import_jobs.insert_one(dict(job))
+        return job
+
+    async def get_job(self, job_id: str, user_id: str) -> Optional[Dict]:
+        return await self.db.import_jobs.find_one({"id": job_id, "user_id": user_id}, {"_id": 0})
+
+    async def run_job(self, job: Dict, path: str):
+        """Import the CSV file at path for job, then delete the file"""
+        await self.db.import_jobs.update_one({"id": job['id']}, {"$set": {"status": "running"}})
+        known = {}
+        try:
+            with open(path, 'rb') as stream:
+                for chunk in iter_csv_chunks(stream, self.chunk_size, job.get('encoding')):
+                    imported, errors = await self.import_chunk(job['user_id'], job['portfolio_id'], chunk, known)
+                    await self.db.import_jobs.update_one(
+                        {"id": job['id']},
+                        {
+                            "$inc": {"rows_read": len(chunk), "imported": imported, "failed": len(errors)},
+                            "$push": {"errors": {"$each": errors, "$slice": IMPORT_MAX_ERRORS}}
+                        }
+                    )
+            await self.db.import_jobs.update_one(
+                {"id": job['id']},
+                {"$set": {"status": "completed", "finished_at": datetime.utcnow()}}
+            )
+        except Exception as e:
+            logger.error(f"Import job {job['id']} failed: {str(e)}")
+            await self.db.import_jobs.update_one(
+                {"id": job['id']},
+                {"$set": {"status": "failed", "error": str(e), "finished_at": datetime.utcnow()}}
+            )
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def import_rows(self, user_id: str, portfolio_id: str, rows: Iterable[Dict]) -> Tuple[int, List[Dict]]:
+        """Import already parsed rows (JSON body), chunk by chunk; returns (imported, errors)"""
+        imported, errors, known = 0, [], {}
+        chunk = []
+        for index, raw in enumerate(rows, start=1):
+            chunk.append((index, normalize_row(raw)))
+            if len(chunk) >= self.chunk_size:
+                count, chunk_errors = await self.import_chunk(user_id, portfolio_id, chunk, known)
+                imported, errors, chunk = imported + count, errors + chunk_errors, []
+        if chunk:
+            count, chunk_errors = await self.import_chunk(user_id, portfolio_id, chunk, known)
+            imported, errors = imported + count, errors + chunk_errors
+        return imported, errors
+
+    async def import_chunk(
+        self,
+        user_id: str,
+        portfolio_id: str,
+        chunk: List[Tuple[int, Dict]],
+        known: Dict[str, Optional[Dict]]
+    ) -> Tuple[int, List[Dict]]:
+        """
+        Validate and write one chunk of (row number, normalized row).
+        known: metadata of the symbols already resolved during this import (None if unknown)
+        """
+        errors = []
+        parsed = []
+        for row_number, row in chunk:
+            symbol = str(row.get('symbol', '')).upper()
+            try:
+                if row.get('_error'):
+                    raise ValueError(row['_error'])
+                if not symbol:
+                    raise ValueError("symbole manquant")
+                quantity = _number(row.get('quantity', 0))
+                avg_price = _number(row.get('avg_price', 0))
+                if quantity <= 0:
+                    raise ValueError("quantité invalide")
+                if avg_price < 0:
+                    raise ValueError("prix invalide")
+                purchase_date = _date(row['purchase_date']) if row.get('purchase_date') else datetime.utcnow()
+                parsed.append((row_number, symbol, quantity, avg_price, purchase_date, row.get('type') or 'stock'))
+            except (ValueError, TypeError) as e:
+                errors.append({'row': row_number, 'symbol': symbol or None, 'error': str(e)})
+
+        new_symbols = list({p[1] for p in parsed} - set(known))
+        if new_symbols:
+            metadata = await self.symbol_metadata.get_many(new_symbols)
+            for symbol in new_symbols:
+                known[symbol] = metadata.get(symbol)
+
+        trades = []
+        for row_number, symbol, quantity, avg_price, purchase_date, asset_type in parsed:
+            if known.get(symbol) is None:
+                errors.append({'row': row_number, 'symbol': symbol, 'error': f"Symbole {symbol} non trouvé"})
+                continue
+            trades.append({
+                'user_id': user_id,
+                'portfolio_id': portfolio_id,
+                'symbol': symbol,
+                'name': known[symbol]['name'],
+                'type': asset_type,
+                'side': 'buy',
+                'quantity': quantity,
+                'price': avg_price,
+                'date': purchase_date,
+                'link_to_cash': False,
+                'cash_currency': None
+            })
+
+        await self.trade_booking.book_buys(trades)
+        # Let other requests run between chunks
+        await asyncio.sleep(0)
+        return len(trades), errors
@@ -0,0 +1,186 @@
+import logging
+from typing import Dict, List, Optional
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# create_index errors raised when an index on the same keys exists with other options
+INDEX_CONFLICT_CODES = (85, 86)  # IndexOptionsConflict, IndexKeySpecsConflict
+
+# Indexes per collection, matching the query shapes used in server.py.
+# History collections end with id so keyset pagination (date desc, id desc) is index-only.
+# Each entry is (keys, options) as passed to create_index.
+INDEX_SPECS: Dict[str, List] = {
+    'users': [
+        ([("email", ASCENDING)], {'unique': True}),
+        ([("id", ASCENDING)], {'unique': True}),
+    ],
+    'portfolios': [
+        ([("id", ASCENDING)], {'unique': True}),
+        ([("user_id", ASCENDING), ("is_default", ASCENDING)], {}),
+        # At most one default portfolio per user (see PortfolioResolver)
+        ([("user_id", ASCENDING)], {'unique': True, 'partialFilterExpression': {'is_default': True},
+                                    'name': 'user_id_unique_default'}),
+    ],
+    'positions': [
+        ([("id", ASCENDING)], {'unique': True}),
+        # One position per symbol and portfolio: concurrent first buys upsert the same document
+        # (existing duplicates must be merged first, see /positions/merge-duplicates)
+        ([("user_id", ASCENDING), ("portfolio_id", ASCENDING), ("symbol", ASCENDING)], {'unique': True}),
+        ([("user_id", ASCENDING), ("portfolio_id", ASCENDING), ("quantity", ASCENDING)], {}),
+        ([("user_id", ASCENDING), ("quantity", ASCENDING)], {}),
+        ([("user_id", ASCENDING), ("symbol", ASCENDING)], {}),
+    ],
+    'transactions': [
+        ([("id", ASCENDING)], {'unique': True}),
+        ([("user_id", ASCENDING), ("date", DESCENDING), ("id", DESCENDING)], {}),
+        ([("user_id", ASCENDING), ("portfolio_id", ASCENDING), ("date", DESCENDING), ("id", DESCENDING)], {}),
+    ],
+    'alerts': [
+        ([("id", ASCENDING)], {'unique': True}),
+        ([("user_id", ASCENDING), ("is_active", ASCENDING), ("is_triggered", ASCENDING)], {}),
+        ([("user_id", ASCENDING), ("is_triggered", ASCENDING), ("is_acknowledged", ASCENDING)], {}),
+        ([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        # Alert engine: all armed alerts across users, grouped by symbol
+        ([("is_active", ASCENDING), ("is_triggered", ASCENDING), ("symbol", ASCENDING)], {}),
+    ],
+    'cash_accounts': [
+        ([("id", ASCENDING)], {'unique': True}),
+        # One account per currency and portfolio (concurrent cash movements upsert the same account)
+        ([("user_id", ASCENDING), ("portfolio_id", ASCENDING), ("currency", ASCENDING)], {'unique': True}),
+    ],
+    'cash_transactions': [
+        ([("id", ASCENDING)], {'unique': True}),
+        ([("user_id", ASCENDING), ("date", DESCENDING), ("id", DESCENDING)], {}),
+    ],
+    'cash_balances': [
+        ([("user_id", ASCENDING)], {}),
+    ],
+    'capital_contributions': [
+        ([("id", ASCENDING)], {'unique': True}),
+        ([("user_id", ASCENDING), ("portfolio_id", ASCENDING), ("date", DESCENDING), ("id", DESCENDING)], {}),
+    ],
+    'dividends': [
+        ([("id", ASCENDING)], {'unique': True}),
+        ([("user_id", ASCENDING), ("date", DESCENDING), ("id", DESCENDING)], {}),
+    ],
+    'goals': [
+        ([("id", ASCENDING)], {'unique': True}),
+        ([("user_id", ASCENDING)], {}),
+    ],
+    'notes': [
+        ([("id", ASCENDING)], {'unique': True}),
+        ([("position_id", ASCENDING), ("user_id", ASCENDING)], {}),
+    ],
+    'position_notes': [
+        ([("position_id", ASCENDING), ("user_id", ASCENDING)], {'unique': True}),
+    ],
+    'budgets': [
+        ([("user_id", ASCENDING)], {}),
+    ],
+    'user_settings': [
+        ([("user_id", ASCENDING)], {}),
+    ],
+    'price_history': [
+        ([("symbol", ASCENDING), ("date", ASCENDING)], {'unique': True}),
+    ],
+    'price_history_meta': [
+        ([("symbol", ASCENDING)], {'unique': True}),
+    ],
+    'symbol_metadata': [
+        ([("symbol", ASCENDING)], {'unique': True}),
+    ],
+    'import_jobs': [
+        ([("id", ASCENDING)], {'unique': True}),
+        ([("user_id", ASCENDING), ("created_at", DESCENDING)], {}),
+    ],
+}
+
+
+async def ensure_indexes(db) -> Dict[str, List[str]]:
+    """
+    Create every index of INDEX_SPECS. Safe to run on each startup: existing indexes
+    are left untouched, an index made unique in INDEX_SPECS is converted in place
+    (see _convert_to_unique), and a failing index (e.g. a unique index over existing
+    duplicates) is logged without preventing the others from being created.
+    Returns the index names per collection.
+    """
+    created = {}
+    for collection_name, specs in INDEX_SPECS.items():
+        collection = db[collection_name]
+        created[collection_name] = []
+        for keys, options in specs:
+            try:
+                name = await collection.create_index(keys, **options)
+                created[collection_name].append(name)
+            except OperationFailure as e:
+                if e.code in INDEX_CONFLICT_CODES:
+                    name = await _convert_to_unique(collection, keys, options)
+                    if name:
+                        created[collection_name].append(name)
+                    continue
+                logger.error(f"Could not create index {keys} on {collection_name}: {str(e)}")
+    logger.info(f"Ensured indexes on {len(created)} collections")
+    return created
+
+
+async def _convert_to_unique(collection, keys: List, options: Dict) -> Optional[str]:
+    """
+    Bring an existing index on keys in line with options without ever dropping it.
+    Only a non-unique index becoming unique can be converted in place (collMod,
+    MongoDB 6.0+): prepareUnique first rejects new duplicates, then the index is made
+    unique. Existing duplicates block the conversion; they are reported as errors on
+    every startup until merged (see /positions/merge-duplicates)
+    """
+    existing = await collection.index_information()
+    name = next((
+        name for name, info in existing.items()
+        if info['key'] == keys and info.get('partialFilterExpression') == options.get('partialFilterExpression')
+    ), None)
+    if name is None or not options.get('unique') or existing[name].get('unique'):
+        logger.error(f"Could not create index {keys} on {collection.name}: an index on these keys exists "
+                     f"with other options; drop it manually to apply {options}")
+        return None
+
+    database = collection.database
+    try:
+        await database.command({"collMod": collection.name, "index": {"name": name, "prepareUnique": True}})
+        await database.command({"collMod": collection.name, "index": {"name": name, "unique": True}})
+        logger.info(f"Index {name} on {collection.name} is now unique")
+        return name
+    except OperationFailure as e:
+        group_id = {field: f"${field}" for field, _ in keys}
+        duplicates = await collection.aggregate([
+            {"$group": {"_id": group_id, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$count": "keys"}
+        ], allowDiskUse=True).to_list(None)
+        duplicate_keys = duplicates[0]['keys'] if duplicates else 0
+        logger.error(
+            f"Index {name} on {collection.name} is NOT unique: {duplicate_keys} duplicated keys "
+            f"({str(e)}). New duplicates are rejected if the server supports prepareUnique; "
+            f"merge the existing ones and restart to enforce uniqueness"
+        )
+        return None
+
+
+async def index_usage_report(db) -> List[Dict]:
+    """Usage counters of every index ($indexStats) for the collections in INDEX_SPECS"""
+    report = []
+    for collection_name in INDEX_SPECS:
+        try:
+            stats = await db[collection_name].aggregate([{"$indexStats": {}}]).to_list(None)
+        except OperationFailure as e:
+            logger.error(f"Could not read index stats for {collection_name}: {str(e)}")
+            continue
+        for stat in stats:
+            accesses = stat.get('accesses', {})
+            report.append({
+                'collection': collection_name,
+                'name': stat.get('name'),
+                'key': dict(stat.get('key', {})),
+                'ops': accesses.get('ops', 0),
+                'since': accesses['since'].isoformat() if hasattr(accesses.get('since'), 'isoformat') else accesses.get('since')
+            })
+    return report
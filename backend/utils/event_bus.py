@@ -0,0 +1,140 @@
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Set
+
+logger = logging.getLogger(__name__)
+
+# Pending events per connection; the oldest are dropped when a client lags behind
+EVENT_QUEUE_SIZE = int(os.environ.get('EVENT_QUEUE_SIZE', '100'))
+# Seconds between two keep-alive comments on an idle event stream
+EVENT_HEARTBEAT_INTERVAL = int(os.environ.get('EVENT_HEARTBEAT_INTERVAL', '15'))
+
+
+class Subscription:
+    """One open event stream: a bounded queue of (event, data) and the symbols it watches"""
+
+    def __init__(self, user_id: str, symbols: Iterable[str], queue_size: int):
+        self.user_id = user_id
+        self.symbols: Set[str] = set(symbols)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+
+class EventBus:
+    """
+    In-process pub/sub fan-out of alert triggers and quote updates to open event streams.
+
+    The quote board and the alert engine publish once per refresh; the bus routes each
+    event to the subscriptions of the user concerned (alerts) or of the users watching
+    the symbol (quotes), through per-connection bounded queues. A slow client only
+    loses its own oldest events, it never blocks publishers.
+    """
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._by_user: Dict[str, Set[Subscription]] = {}
+        self._by_symbol: Dict[str, Set[Subscription]] = {}
+
+    def subscribe(self, user_id: str, symbols: Iterable[str]) -> Subscription:
+        subscription = Subscription(user_id, symbols, self.queue_size)
+        self._by_user.setdefault(user_id, set()).add(subscription)
+        for symbol in subscription.symbols:
+            self._by_symbol.setdefault(symbol, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._discard(self._by_user, subscription.user_id, subscription)
+        for symbol in subscription.symbols:
+            self._discard(self._by_symbol, symbol, subscription)
+
+    @staticmethod
+    def _discard(index: Dict[str, Set[Subscription]], key: str, subscription: Subscription):
+        subscriptions = index.get(key)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del index[key]
+
+    def watch(self, user_id: str, symbols: Iterable[str]):
+        """Add symbols to the open streams of user_id (e.g. after a new position or alert)"""
+        for subscription in self._by_user.get(user_id, ()):
+            for symbol in set(symbols) - subscription.symbols:
+                subscription.symbols.add(symbol)
+                self._by_symbol.setdefault(symbol, set()).add(subscription)
+
+    @staticmethod
+    def _put(subscription: Subscription, event: str, data):
+        if subscription.queue.full():
+            subscription.queue.get_nowait()
+            subscription.dropped += 1
+        subscription.queue.put_nowait((event, data))
+
+    def publish(self, user_id: str, event: str, data):
+        """Send an event to every open stream of user_id"""
+        for subscription in self._by_user.get(user_id, ()):
+            self._put(subscription, event, data)
+
+    async def on_quotes(self, quotes: Dict[str, Dict]):
+        """Quote board listener: each stream gets one event with the quotes of its symbols"""
+        batches: Dict[Subscription, Dict[str, Dict]] = {}
+        for symbol, quote in quotes.items():
+            for subscription in self._by_symbol.get(symbol, ()):
+                batches.setdefault(subscription, {})[symbol] = {
+                    **quote,
+                    'timestamp': quote['timestamp'].isoformat() if isinstance(quote.get('timestamp'), datetime) else quote.get('timestamp')
+                }
+        for subscription, batch in batches.items():
+            self._put(subscription, 'quotes', batch)
+
+    async def on_alerts(self, triggered: List[Dict]):
+        """Alert engine listener: push each triggered alert to its owner"""
+        now = datetime.utcnow().isoformat()
+        for alert in triggered:
+            self.publish(alert['user_id'], 'alert', {
+                'id': alert['id'],
+                'user_id': alert['user_id'],
+                'symbol': alert['symbol'],
+                'alert_type': alert['alert_type'],
+                'target_value': alert['target_value'],
+                'notes': alert.get('notes'),
+                'is_triggered': True,
+                'is_acknowledged': False,
+                'triggered_at': now,
+                'triggered_price': alert.get('current_price'),
+                'triggered_value': alert.get('current_value'),
+                'message': alert.get('message')
+            })
+
+    async def stream(
+        self,
+        subscription: Subscription,
+        heartbeat: int = EVENT_HEARTBEAT_INTERVAL,
+        is_disconnected=None
+    ) -> AsyncIterator[str]:
+        """Server-Sent Events of a subscription, with keep-alive comments; unsubscribes when the client leaves"""
+        try:
+            yield f"event: ready\ndata: {json.dumps({'symbols': sorted(subscription.symbols)})}\n\n"
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    if is_disconnected is not None and await is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self) -> Dict:
+        subscriptions = [s for user_subscriptions in self._by_user.values() for s in user_subscriptions]
+        return {
+            'connections': len(subscriptions),
+            'users': len(self._by_user),
+            'symbols': len(self._by_symbol),
+            'dropped_events': sum(s.dropped for s in subscriptions)
+        }
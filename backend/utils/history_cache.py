@@ -0,0 +1,149 @@
+import os
+import threading
+import logging
+import pandas as pd
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Time-to-live of a cached history while markets are open / closed (seconds)
+HISTORY_CACHE_TTL_MARKET = int(os.environ.get('HISTORY_CACHE_TTL_MARKET', '300'))
+HISTORY_CACHE_TTL_CLOSED = int(os.environ.get('HISTORY_CACHE_TTL_CLOSED', '3600'))
+# Memory cap for all cached histories (megabytes)
+HISTORY_CACHE_MAX_MB = int(os.environ.get('HISTORY_CACHE_MAX_MB', '256'))
+
+# Trading window covering Euronext open to NYSE close, in UTC
+MARKET_OPEN_UTC_HOUR = 7
+MARKET_CLOSE_UTC_HOUR = 21
+
+
+def is_market_hours(now: Optional[datetime] = None) -> bool:
+    """Whether European or US markets are likely open (weekdays, 07:00-21:00 UTC)"""
+    now = now or datetime.utcnow()
+    if now.weekday() >= 5:
+        return False
+    return MARKET_OPEN_UTC_HOUR <= now.hour < MARKET_CLOSE_UTC_HOUR
+
+
+class HistoryCache:
+    """
+    Process-wide LRU cache for OHLCV histories.
+
+    Keys are tuples such as (symbol, period) or (symbol, start, end). Entries expire
+    after a TTL that is shorter during market hours, and the least recently used
+    entries are evicted once the memory cap is reached. Safe to use from the
+    market-data thread pool: concurrent misses on the same key download only once.
+    """
+
+    def __init__(
+        self,
+        ttl_market: int = HISTORY_CACHE_TTL_MARKET,
+        ttl_closed: int = HISTORY_CACHE_TTL_CLOSED,
+        max_bytes: int = HISTORY_CACHE_MAX_MB * 1024 * 1024
+    ):
+        self.ttl_market = ttl_market
+        self.ttl_closed = ttl_closed
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _ttl(self) -> int:
+        return self.ttl_market if is_market_hours() else self.ttl_closed
+
+    def get(self, key: Hashable) -> Optional[pd.DataFrame]:
+        """Return a copy of the cached history, or None if absent or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires_at'] <= datetime.utcnow():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            # Callers mutate the index (tz_localize), never hand out the cached frame itself
+            return entry['data'].copy()
+
+    def set(self, key: Hashable, data: pd.DataFrame):
+        """Store a history and evict least recently used entries above the memory cap"""
+        size = int(data.memory_usage(deep=True).sum())
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                'data': data.copy(),
+                'size': size,
+                'expires_at': datetime.utcnow() + timedelta(seconds=self._ttl())
+            }
+            self._size_bytes += size
+            while self._size_bytes > self.max_bytes and len(self._entries) > 1:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], pd.DataFrame]) -> Optional[pd.DataFrame]:
+        """Return the cached history for key, calling loader() once on a miss"""
+        cached = self.get(key)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            return cached
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Another thread may have loaded it while we were waiting
+            cached = self.get(key)
+            if cached is not None:
+                with self._lock:
+                    self.hits += 1
+                return cached
+
+            with self._lock:
+                self.misses += 1
+            try:
+                data = loader()
+                if data is not None:
+                    self.set(key, data)
+                return data
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and memory usage"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'size_mb': round(self._size_bytes / (1024 * 1024), 2),
+                'max_mb': round(self.max_bytes / (1024 * 1024), 2),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups * 100, 2) if lookups else 0.0,
+                'ttl_seconds': self._ttl(),
+                'market_hours': is_market_hours()
+            }
+
+    def _remove(self, key: Hashable):
+        # Caller must hold self._lock
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size_bytes -= entry['size']
+
+
+# Shared by every service in the process
+history_cache = HistoryCache()
@@ -0,0 +1,103 @@
+import pandas as pd
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from .yahoo_finance import YahooFinanceService
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Calendar length of the rolling periods used by performance and risk endpoints
+PERIOD_DAYS = {
+    '1m': 30,
+    '3m': 90,
+    '6m': 180,
+    '1y': 365,
+    '2y': 730,
+    '5y': 1825,
+}
+
+
+def period_start_date(period: str, all_start_date: datetime, now: Optional[datetime] = None) -> datetime:
+    """
+    Start date of a period
+    period: 'all', 'ytd', '1m', '3m', '6m', '1y', '2y', '5y' ('all' starts at all_start_date)
+    """
+    now = now or datetime.now()
+    if period == 'ytd':
+        return datetime(now.year, 1, 1)
+    if period in PERIOD_DAYS:
+        return now - timedelta(days=PERIOD_DAYS[period])
+    return all_start_date
+
+
+def _naive(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is not None:
+        value = value.replace(tzinfo=None)
+    return value
+
+
+class HistoryWindowPlanner:
+    """
+    Turns a request (period + positions) into the exact date range needed per symbol.
+
+    Each planner method returns {symbol: start_date}; a symbol held several times gets
+    the earliest start. The plan is then served with one range fetch per symbol, either
+    from PriceHistoryStore.get_ranges or, in synchronous code, with fetch() below, instead
+    of downloading a fixed '1y'/'2y' period whatever the request covers.
+    """
+
+    def __init__(self):
+        self.yf_service = YahooFinanceService()
+
+    @staticmethod
+    def merge(*plans: Dict[str, datetime]) -> Dict[str, datetime]:
+        """Union of several plans, keeping the earliest start of each symbol"""
+        merged = {}
+        for plan in plans:
+            for symbol, start_date in plan.items():
+                if symbol not in merged or start_date < merged[symbol]:
+                    merged[symbol] = start_date
+        return merged
+
+    @staticmethod
+    def portfolio_windows(positions: List[Dict], period: str) -> Dict[str, datetime]:
+        """
+        Range of every symbol for a portfolio curve: all symbols from the period start
+        ('all' starts at the earliest purchase date)
+        """
+        if not positions:
+            return {}
+        earliest_purchase = min(_naive(p.get('purchase_date') or datetime.utcnow()) for p in positions)
+        start_date = period_start_date(period, earliest_purchase)
+        return {p['symbol']: start_date for p in positions}
+
+    @classmethod
+    def position_windows(cls, positions: List[Dict], period: str) -> Dict[str, datetime]:
+        """Range of each symbol for its own position curve: from max(period start, purchase date)"""
+        plans = []
+        for position in positions:
+            purchase_date = _naive(position.get('purchase_date') or datetime.utcnow())
+            start_date = max(period_start_date(period, purchase_date), purchase_date)
+            plans.append({position['symbol']: start_date})
+        return cls.merge(*plans)
+
+    @staticmethod
+    def lookback_windows(symbols: List[str], period: str = '1y') -> Dict[str, datetime]:
+        """Same rolling range for every symbol (risk metrics, correlations)"""
+        start_date = period_start_date(period, datetime.now() - timedelta(days=PERIOD_DAYS['1y']))
+        return {symbol: start_date for symbol in symbols}
+
+    def fetch(self, windows: Dict[str, datetime], end_date: Optional[datetime] = None) -> Dict[str, pd.DataFrame]:
+        """Daily bars of each planned symbol: one range request per symbol (served from the history cache)"""
+        # yfinance treats `end` as exclusive: include today's bar by default
+        end_date = end_date or datetime.now() + timedelta(days=1)
+        history = {}
+        for symbol, start_date in windows.items():
+            hist_data = self.yf_service.get_historical_data_by_dates(symbol, start_date=start_date, end_date=end_date)
+            if hist_data is None or hist_data.empty:
+                logger.warning(f"No historical data for {symbol} since {start_date:%Y-%m-%d}")
+                continue
+            history[symbol] = hist_data
+        return history
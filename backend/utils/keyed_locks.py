@@ -0,0 +1,30 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, List
+
+
+class KeyedLocks:
+    """
+    One asyncio.Lock per key (symbol, user...), created on first use and dropped as
+    soon as no task holds or waits for it, so the map stays as small as the work in
+    progress instead of growing with every key ever seen.
+    """
+
+    def __init__(self):
+        # key -> [lock, tasks holding or waiting for it]
+        self._entries: Dict[Hashable, List] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        entry = self._entries.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
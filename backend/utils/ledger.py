@@ -0,0 +1,232 @@
+import os
+import time
+import logging
+import pandas as pd
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from pymongo import ASCENDING
+from .keyed_locks import KeyedLocks
+
+logger = logging.getLogger(__name__)
+
+# (user, portfolio) ledgers kept replayed in memory, least recently used evicted first
+LEDGER_CACHE_SIZE = int(os.environ.get('LEDGER_CACHE_SIZE', '500'))
+# Seconds an unused replayed ledger is kept (the next read replays it in full)
+LEDGER_CACHE_TTL = int(os.environ.get('LEDGER_CACHE_TTL', '3600'))
+
+# Signed quantity of each transaction type
+TRANSACTION_SIGNS = {'buy': 1.0, 'sell': -1.0}
+
+# Quantities below this are treated as zero (float residue of partial sells)
+QUANTITY_EPSILON = 1e-9
+
+
+class HoldingsSnapshot:
+    """
+    Ledger replayed up to a given transaction: signed quantities, holdings and
+    net amount invested (buys +, sells -) on trade days
+    """
+
+    def __init__(self, deltas: pd.DataFrame, holdings: pd.DataFrame, flows: pd.DataFrame, last_id, count: int):
+        self.deltas = deltas
+        self.holdings = holdings
+        self.flows = flows
+        self.last_id = last_id
+        self.count = count
+
+
+class LedgerReplayEngine:
+    """
+    Replays `db.transactions` into a day x symbol holdings matrix.
+
+    Transactions are pivoted into signed daily quantities (buy +, sell -) and
+    cumulated with one cumsum over the date index. The replayed state is cached per
+    (user, portfolio); later calls only read transactions inserted since (by _id) and
+    re-cumulate from the earliest day they touch. A transaction count mismatch
+    (deletions, e.g. a deleted portfolio) triggers a full replay. The cache is an LRU
+    of max_entries ledgers, each dropped after ttl seconds without use.
+    """
+
+    def __init__(self, db, max_entries: int = LEDGER_CACHE_SIZE, ttl: int = LEDGER_CACHE_TTL):
+        self.db = db
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (snapshot, last use as time.monotonic())
+        self._snapshots: "OrderedDict[Tuple[str, Optional[str]], Tuple[HoldingsSnapshot, float]]" = OrderedDict()
+        self._locks = KeyedLocks()
+
+    def _cached(self, key: Tuple[str, Optional[str]]) -> Optional[HoldingsSnapshot]:
+        entry = self._snapshots.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] >= self.ttl:
+            del self._snapshots[key]
+            return None
+        return entry[0]
+
+    def _remember(self, key: Tuple[str, Optional[str]], snapshot: HoldingsSnapshot):
+        self._snapshots[key] = (snapshot, time.monotonic())
+        self._snapshots.move_to_end(key)
+        while len(self._snapshots) > self.max_entries:
+            self._snapshots.popitem(last=False)
+
+    async def get_holdings(self, user_id: str, portfolio_id: Optional[str] = None) -> pd.DataFrame:
+        """Quantity held per trade day (rows) and symbol (columns), from the ledger only"""
+        return (await self.get_ledger(user_id, portfolio_id)).holdings
+
+    async def get_ledger(self, user_id: str, portfolio_id: Optional[str] = None) -> HoldingsSnapshot:
+        """Replayed ledger (holdings and trade flows per trade day and symbol)"""
+        key = (user_id, portfolio_id)
+        query = {"user_id": user_id}
+        if portfolio_id:
+            query["portfolio_id"] = portfolio_id
+
+        async with self._locks.hold(key):
+            snapshot = self._cached(key)
+            total = await self.db.transactions.count_documents(query)
+
+            new_query = dict(query)
+            if snapshot is not None and snapshot.last_id is not None:
+                new_query["_id"] = {"$gt": snapshot.last_id}
+            transactions = await self.db.transactions.find(
+                new_query, {"symbol": 1, "type": 1, "quantity": 1, "price": 1, "total": 1, "date": 1}
+            ).sort("_id", ASCENDING).to_list(None)
+
+            if snapshot is not None and snapshot.count + len(transactions) != total:
+                # Transactions were deleted (or inserted out of _id order): start over
+                logger.info(f"Ledger of {user_id} changed, replaying all {total} transactions")
+                snapshot = None
+                transactions = await self.db.transactions.find(
+                    query, {"symbol": 1, "type": 1, "quantity": 1, "price": 1, "total": 1, "date": 1}
+                ).sort("_id", ASCENDING).to_list(None)
+
+            if snapshot is None or transactions:
+                snapshot = self._replay(snapshot, transactions)
+            self._remember(key, snapshot)
+            return snapshot
+
+    @staticmethod
+    def daily_deltas(transactions: List[Dict]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Signed quantity traded and net amount invested per day (rows) and symbol (columns)"""
+        if not transactions:
+            return pd.DataFrame(dtype=float), pd.DataFrame(dtype=float)
+        signs = [TRANSACTION_SIGNS.get(t.get('type'), 0.0) for t in transactions]
+        frame = pd.DataFrame({
+            'date': pd.to_datetime([t['date'] for t in transactions], utc=True).tz_convert(None).normalize(),
+            'symbol': [t['symbol'] for t in transactions],
+            'quantity': [sign * t.get('quantity', 0) for sign, t in zip(signs, transactions)],
+            'amount': [
+                sign * t.get('total', t.get('quantity', 0) * t.get('price', 0))
+                for sign, t in zip(signs, transactions)
+            ]
+        })
+        pivot = frame.pivot_table(index='date', columns='symbol', values=['quantity', 'amount'], aggfunc='sum', fill_value=0.0)
+        return pivot['quantity'], pivot['amount']
+
+    def _replay(self, snapshot: Optional[HoldingsSnapshot], transactions: List[Dict]) -> HoldingsSnapshot:
+        new_deltas, new_flows = self.daily_deltas(transactions)
+        last_id = transactions[-1]['_id'] if transactions else (snapshot.last_id if snapshot else None)
+        count = (snapshot.count if snapshot else 0) + len(transactions)
+
+        if snapshot is None or snapshot.deltas.empty:
+            return HoldingsSnapshot(new_deltas, new_deltas.cumsum(), new_flows, last_id, count)
+
+        deltas = snapshot.deltas.add(new_deltas, fill_value=0.0).fillna(0.0).sort_index()
+        flows = snapshot.flows.add(new_flows, fill_value=0.0).fillna(0.0).sort_index()
+
+        # Holdings before the earliest new trade are unchanged; only the tail is re-cumulated
+        first_changed = new_deltas.index.min()
+        kept = snapshot.holdings.reindex(columns=deltas.columns, fill_value=0.0)
+        kept = kept[kept.index < first_changed]
+        tail = deltas[deltas.index >= first_changed].cumsum()
+        if not kept.empty:
+            tail = tail + kept.iloc[-1]
+        return HoldingsSnapshot(deltas, pd.concat([kept, tail]), flows, last_id, count)
+
+    @staticmethod
+    def reconcile(
+        holdings: pd.DataFrame,
+        positions: List[Dict],
+        flows: Optional[pd.DataFrame] = None
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Make the replayed holdings end on the current positions.
+        Positions opened before the ledger existed, imported, or deleted without a sell
+        leave a gap between the ledger and positions; it is booked at the symbol's
+        opening date (the position purchase date, else its first trade), so legacy
+        positions get an opening lot and deleted ones disappear from the history.
+        The gap is valued at the position's average price (opening lots) or at the
+        ledger's average buy price (removals) in the returned flows.
+        """
+        if flows is None:
+            flows = pd.DataFrame(0.0, index=holdings.index, columns=holdings.columns)
+
+        current = {}
+        cost = {}
+        opening = {}
+        for position in positions:
+            symbol = position['symbol']
+            current[symbol] = current.get(symbol, 0.0) + position['quantity']
+            cost[symbol] = cost.get(symbol, 0.0) + position['quantity'] * position.get('avg_price', 0.0)
+            purchase_date = pd.Timestamp(position.get('purchase_date') or datetime.utcnow())
+            if purchase_date.tzinfo is not None:
+                purchase_date = purchase_date.tz_convert(None)
+            purchase_date = purchase_date.normalize()
+            opening[symbol] = min(opening.get(symbol, purchase_date), purchase_date)
+
+        deltas = holdings.diff()
+        if not holdings.empty:
+            deltas.iloc[0] = holdings.iloc[0]
+
+        final = holdings.iloc[-1] if not holdings.empty else pd.Series(dtype=float)
+        adjustments = []
+        for symbol in set(current) | set(final.index):
+            gap = current.get(symbol, 0.0) - final.get(symbol, 0.0)
+            if abs(gap) <= QUANTITY_EPSILON:
+                continue
+            if gap > 0:
+                price = cost[symbol] / current[symbol] if current.get(symbol) else 0.0
+            else:
+                bought = deltas[symbol].clip(lower=0.0).sum()
+                price = flows[symbol].clip(lower=0.0).sum() / bought if symbol in flows and bought > 0 else 0.0
+            if symbol in opening:
+                date = opening[symbol]
+            else:
+                date = holdings.index[(holdings[symbol] != 0).to_numpy().argmax()]
+            adjustments.append({'date': date, 'symbol': symbol, 'quantity': gap, 'amount': gap * price})
+
+        if not adjustments:
+            return holdings, flows
+
+        opening_lots = pd.DataFrame(adjustments).pivot_table(
+            index='date', columns='symbol', values=['quantity', 'amount'], aggfunc='sum', fill_value=0.0
+        )
+        if holdings.empty:
+            return opening_lots['quantity'].sort_index().cumsum().clip(lower=0.0), opening_lots['amount'].sort_index()
+        deltas = deltas.add(opening_lots['quantity'], fill_value=0.0).fillna(0.0).sort_index()
+        flows = flows.add(opening_lots['amount'], fill_value=0.0).fillna(0.0).sort_index()
+        return deltas.cumsum().clip(lower=0.0), flows
+
+    @staticmethod
+    def closed_positions(holdings: pd.DataFrame, positions: List[Dict]) -> List[Dict]:
+        """Symbols held in the past but not anymore, with the first day they were held"""
+        held_now = {p['symbol'] for p in positions}
+        closed = []
+        for symbol in holdings.columns:
+            column = holdings[symbol]
+            if symbol in held_now or not (column > QUANTITY_EPSILON).any():
+                continue
+            closed.append({
+                'symbol': symbol,
+                'quantity': 0.0,
+                'purchase_date': column.index[(column > QUANTITY_EPSILON).to_numpy().argmax()].to_pydatetime()
+            })
+        return closed
+
+    @staticmethod
+    def align(holdings: pd.DataFrame, dates: pd.DatetimeIndex) -> pd.DataFrame:
+        """Holdings on arbitrary dates: last trade day's quantities carried forward, 0 before the first trade"""
+        if holdings.empty:
+            return pd.DataFrame(0.0, index=dates, columns=holdings.columns)
+        return holdings.reindex(holdings.index.union(dates)).ffill().reindex(dates).fillna(0.0)
@@ -0,0 +1,82 @@
+import asyncio
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from .yahoo_finance import YahooFinanceService
+
+logger = logging.getLogger(__name__)
+
+# Size of the thread pool running blocking yfinance calls
+MARKET_DATA_MAX_WORKERS = int(os.environ.get('MARKET_DATA_MAX_WORKERS', '8'))
+# Maximum number of market-data calls in flight at once (queued callers wait on the event loop)
+MARKET_DATA_CONCURRENCY = int(os.environ.get('MARKET_DATA_CONCURRENCY', str(MARKET_DATA_MAX_WORKERS)))
+# Threads reserved for quotes, FX rates and symbol lookups, so heavy history and
+# performance jobs never hold up prices (also their concurrency limit)
+MARKET_DATA_QUOTE_WORKERS = int(os.environ.get('MARKET_DATA_QUOTE_WORKERS', '4'))
+
+
+class AsyncMarketDataService:
+    """
+    Async facade over YahooFinanceService.
+
+    yfinance is synchronous: calling it from an `async def` handler blocks the event loop
+    for every other request. This service runs those calls on bounded thread pools so
+    cheap endpoints keep responding while market data is being fetched: run() (history
+    downloads, analytics, performance) and the latency-sensitive quote, FX and lookup
+    calls each have their own pool and concurrency limit.
+    """
+
+    def __init__(self, max_workers: int = MARKET_DATA_MAX_WORKERS, max_concurrency: int = MARKET_DATA_CONCURRENCY,
+                 quote_workers: int = MARKET_DATA_QUOTE_WORKERS):
+        self.yf_service = YahooFinanceService()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='market-data')
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._quote_executor = ThreadPoolExecutor(max_workers=quote_workers, thread_name_prefix='market-quotes')
+        self._quote_semaphore = asyncio.Semaphore(quote_workers)
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Run any blocking function (yfinance, analytics, performance...) on the market-data pool"""
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def _run_quote(self, func: Callable, *args, **kwargs) -> Any:
+        """Run a quick, latency-sensitive call on the quote pool"""
+        async with self._quote_semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._quote_executor, partial(func, *args, **kwargs))
+
+    async def gather(self, calls: List[Awaitable]) -> List[Any]:
+        """Await several market-data calls concurrently, keeping their order"""
+        return list(await asyncio.gather(*calls))
+
+    async def get_current_price(self, symbol: str) -> Optional[float]:
+        return await self._run_quote(self.yf_service.get_current_price, symbol)
+
+    async def get_current_prices(self, symbols: List[str]) -> Dict[str, float]:
+        return await self._run_quote(self.yf_service.get_current_prices, symbols)
+
+    async def get_daily_changes(self, symbols: List[str]) -> Dict[str, Dict]:
+        return await self._run_quote(self.yf_service.get_daily_changes, symbols)
+
+    async def get_ticker_info(self, symbol: str) -> Optional[Dict]:
+        return await self._run_quote(self.yf_service.get_ticker_info, symbol)
+
+    async def get_symbol_metadata(self, symbol: str) -> Optional[Dict]:
+        return await self._run_quote(self.yf_service.get_symbol_metadata, symbol)
+
+    async def search_ticker(self, query: str) -> List[Dict]:
+        return await self._run_quote(self.yf_service.search_ticker, query)
+
+    async def get_exchange_rates(self, from_currencies: List[str], to_currency: str = 'EUR') -> Dict[str, float]:
+        return await self._run_quote(self.yf_service.get_exchange_rates, from_currencies, to_currency)
+
+    async def convert_to_eur(self, amount: float, from_currency: str) -> float:
+        return await self._run_quote(self.yf_service.convert_to_eur, amount, from_currency)
+
+    def shutdown(self):
+        """Stop accepting work; running fetches are left to finish in the background"""
+        self._executor.shutdown(wait=False)
+        self._quote_executor.shutdown(wait=False)
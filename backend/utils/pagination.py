@@ -0,0 +1,95 @@
+import json
+import base64
+import logging
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+from pymongo import DESCENDING
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for a single page, whatever the client asks for
+PAGE_MAX_LIMIT = 500
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(sort_value: Any, doc_id: str) -> str:
+    """Opaque cursor pointing after a document, from its sort value and id"""
+    if isinstance(sort_value, datetime):
+        payload = {'t': 'dt', 'v': sort_value.isoformat(), 'id': doc_id}
+    else:
+        payload = {'t': 'raw', 'v': sort_value, 'id': doc_id}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        value = datetime.fromisoformat(payload['v']) if payload['t'] == 'dt' else payload['v']
+        return value, payload['id']
+    except Exception as e:
+        raise InvalidCursorError(f"Invalid cursor: {str(e)}")
+
+
+def keyset_query(query: Dict, sort_field: str, cursor: Optional[str]) -> Dict:
+    """
+    Restrict query to documents after the cursor, for a (sort_field desc, id desc) order.
+    Ties on sort_field are broken by id so no document is skipped or repeated.
+    """
+    if not cursor:
+        return query
+    value, doc_id = decode_cursor(cursor)
+    return {
+        **query,
+        '$or': [
+            {sort_field: {'$lt': value}},
+            {sort_field: value, 'id': {'$lt': doc_id}}
+        ]
+    }
+
+
+def sorted_cursor(collection, query: Dict, sort_field: str, cursor: Optional[str] = None, limit: Optional[int] = None):
+    """Motor cursor over query in (sort_field desc, id desc) order, starting after cursor"""
+    motor_cursor = collection.find(keyset_query(query, sort_field, cursor)).sort(
+        [(sort_field, DESCENDING), ('id', DESCENDING)]
+    )
+    if limit:
+        motor_cursor = motor_cursor.limit(limit)
+    return motor_cursor
+
+
+async def fetch_page(
+    collection,
+    query: Dict,
+    sort_field: str,
+    clean: Callable[[Dict], Dict],
+    limit: int,
+    cursor: Optional[str] = None
+) -> Dict:
+    """One page of documents: {'items': [...], 'next_cursor': str or None}"""
+    limit = max(1, min(limit, PAGE_MAX_LIMIT))
+    # Read one extra document to know whether another page exists
+    docs = await sorted_cursor(collection, query, sort_field, cursor, limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor(last.get(sort_field), last.get('id'))
+
+    return {'items': [clean(doc) for doc in docs], 'next_cursor': next_cursor}
+
+
+async def stream_ndjson(
+    collection,
+    query: Dict,
+    sort_field: str,
+    clean: Callable[[Dict], Dict],
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+) -> AsyncIterator[str]:
+    """Yield documents as NDJSON lines as the Motor cursor returns them"""
+    async for doc in sorted_cursor(collection, query, sort_field, cursor, limit):
+        yield json.dumps(clean(doc), default=str) + '\n'
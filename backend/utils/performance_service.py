@@ -1,138 +1,241 @@
 import pandas as pd
 import numpy as np
-from typing import List, Dict, Optional
-from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Tuple, Union
+from datetime import datetime
 from .yahoo_finance import YahooFinanceService
+from .history_window import HistoryWindowPlanner, period_start_date
+from .ledger import LedgerReplayEngine
+from .returns import period_returns
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+def empty_performance(columnar: bool = False) -> Dict:
+    """Performance result without any data point, in the requested format"""
+    if columnar:
+        return {'dates': [], 'values': [], 'change_percent': [], 'total_return': 0, 'total_return_percent': 0}
+    return {'data': [], 'total_return': 0, 'total_return_percent': 0}
+
+
 class PerformanceService:
     """Service for calculating portfolio and position performance"""
     
     def __init__(self):
         self.yf_service = YahooFinanceService()
+        self.planner = HistoryWindowPlanner()
+    
+    @staticmethod
+    def get_period_start_date(period: str, all_start_date: datetime) -> datetime:
+        """
+        Start date of a performance period
+        period: 'all', 'ytd', '1m', '3m', '6m', '1y' ('all' starts at all_start_date)
+        """
+        return period_start_date(period, all_start_date)
+    
+    def build_price_matrix(
+        self,
+        windows: Dict[str, datetime],
+        history: Optional[Dict[str, pd.DataFrame]] = None
+    ) -> pd.DataFrame:
+        """
+        Daily closes of all planned symbols on a common (union) date index, one column per symbol.
+        windows: start date per symbol, from HistoryWindowPlanner
+        history: optional preloaded daily bars per symbol (e.g. from PriceHistoryStore);
+        symbols missing from it are downloaded from Yahoo Finance for their planned range only
+        """
+        history = dict(history or {})
+        missing = {symbol: start for symbol, start in windows.items() if symbol not in history}
+        if missing:
+            history.update(self.planner.fetch(missing))
+        
+        closes = {}
+        for symbol in windows:
+            hist_data = history.get(symbol)
+            if hist_data is None or hist_data.empty:
+                logger.warning(f"No historical data for {symbol}, skipping")
+                continue
+            
+            # Make dates timezone naive for comparison, one bar per calendar day
+            series = hist_data['Close'].copy()
+            if series.index.tz is not None:
+                series.index = series.index.tz_localize(None)
+            series.index = series.index.normalize()
+            closes[symbol] = series[~series.index.duplicated(keep='last')]
+        
+        if not closes:
+            return pd.DataFrame()
+        return pd.DataFrame(closes).sort_index()
+    
+    @staticmethod
+    def _build_series(values: pd.Series, initial_value: float, columnar: bool = False) -> Dict:
+        """
+        Performance of a value series against initial_value, with its total return.
+        Dates, values and change percentages are computed as whole columns; the default
+        format zips them into one dict per day, the columnar format returns the arrays as is:
+        {'dates': [...], 'values': [...], 'change_percent': [...], 'total_return', 'total_return_percent'}
+        """
+        if values.empty:
+            return empty_performance(columnar)
+        
+        raw_values = values.to_numpy(dtype=float)
+        dates = values.index.strftime('%Y-%m-%d').tolist()
+        rounded_values = np.round(raw_values, 2)
+        if initial_value > 0:
+            change_percent = np.round((raw_values - initial_value) / initial_value * 100, 2)
+        else:
+            change_percent = np.zeros(len(raw_values))
+        
+        final_value = raw_values[-1]
+        total_return = final_value - initial_value
+        total_return_percent = ((final_value - initial_value) / initial_value * 100) if initial_value > 0 else 0
+        summary = {
+            'total_return': round(float(total_return), 2),
+            'total_return_percent': round(float(total_return_percent), 2)
+        }
+        
+        if columnar:
+            return {
+                'dates': dates,
+                'values': rounded_values.tolist(),
+                'change_percent': change_percent.tolist(),
+                **summary
+            }
+        return {
+            'data': [
+                {'date': date, 'value': value, 'change_percent': change}
+                for date, value, change in zip(dates, rounded_values.tolist(), change_percent.tolist())
+            ],
+            **summary
+        }
+    
+    def _portfolio_curve(
+        self,
+        prices: pd.DataFrame,
+        positions: List[Dict],
+        period: str,
+        holdings: Optional[pd.DataFrame] = None
+    ) -> Tuple[pd.Series, float]:
+        """
+        Portfolio value per day from an aligned price matrix, with its initial value.
+        holdings: quantity held per day and symbol (LedgerReplayEngine); without it,
+        today's quantities are applied to the whole period
+        """
+        if prices.empty or not positions:
+            return pd.Series(dtype=float), 0
+        
+        # Determine date range ('all' uses the earliest purchase date)
+        purchase_dates = [p.get('purchase_date', datetime.now()) for p in positions]
+        start_date = self.get_period_start_date(period, min(purchase_dates))
+        prices = prices[prices.index >= start_date]
+        
+        if holdings is not None:
+            symbols = [s for s in holdings.columns if s in prices]
+        else:
+            # Quantities per symbol (a symbol may be held in several portfolios)
+            quantities = {}
+            for position in positions:
+                if position['symbol'] in prices:
+                    quantities[position['symbol']] = quantities.get(position['symbol'], 0) + position['quantity']
+            symbols = list(quantities)
+        if not symbols:
+            return pd.Series(dtype=float), 0
+        
+        # Symbols without data in the period are skipped
+        df = prices[symbols].dropna(axis=1, how='all')
+        
+        # Forward-fill missing values (handles crypto vs stock trading days mismatch)
+        # This ensures that if BTC has data for Saturday but AAPL doesn't,
+        # AAPL's Friday close value is carried forward to Saturday
+        df = df.ffill()
+        
+        # Also backward-fill for the first few days if some positions started later
+        df = df.bfill()
+        
+        # Drop any remaining rows with NaN (edge cases)
+        df = df.dropna()
+        
+        if df.empty:
+            return pd.Series(dtype=float), 0
+        
+        # Position values over time (price * quantity held that day)
+        if holdings is not None:
+            df = df * LedgerReplayEngine.align(holdings[df.columns], df.index)
+        else:
+            df = df * pd.Series(quantities)[df.columns]
+        
+        # Calculate total portfolio value per day, from the first day something is held
+        total_value = df.sum(axis=1)
+        held = total_value > 0
+        if not held.any():
+            return pd.Series(dtype=float), 0
+        total_value = total_value[held.idxmax():]
+        
+        return total_value, total_value.iloc[0]
+    
+    @staticmethod
+    def _with_returns(result: Dict, values: pd.Series, prices: pd.DataFrame, flows: Optional[pd.DataFrame]) -> Dict:
+        """Add TWR and MWR of the value curve, given the trade flows of the symbols it covers"""
+        if flows is None:
+            return result
+        covered = [symbol for symbol in flows.columns if symbol in prices]
+        return {**result, **period_returns(values, flows[covered].sum(axis=1))}
+    
+    def _position_curve(
+        self,
+        prices: pd.Series,
+        quantity: float,
+        purchase_price: float,
+        purchase_date: datetime,
+        period: str
+    ) -> Tuple[pd.Series, float]:
+        """Position value per day on the position's own trading days, with its purchase value"""
+        # Determine date range, using purchase date if it's more recent
+        start_date = self.get_period_start_date(period, purchase_date)
+        start_date = max(start_date, purchase_date)
+        
+        prices = prices.dropna()
+        prices = prices[prices.index >= start_date]
+        
+        return prices * quantity, purchase_price * quantity
     
     def calculate_portfolio_performance(
         self, 
         positions: List[Dict], 
-        period: str = 'all'
+        period: str = 'all',
+        history: Optional[Dict[str, pd.DataFrame]] = None,
+        columnar: bool = False,
+        holdings: Optional[pd.DataFrame] = None,
+        flows: Optional[pd.DataFrame] = None
     ) -> Dict:
         """
         Calculate portfolio performance over time
         period: 'all', 'ytd', '1m', '3m', '6m', '1y'
+        history: optional preloaded daily bars per symbol (e.g. from PriceHistoryStore);
+        symbols missing from it are downloaded from Yahoo Finance
+        columnar: return dates/values/change_percent arrays instead of one dict per day
+        holdings: replayed transaction ledger (LedgerReplayEngine) giving the quantity
+        held each day; positions must then include the symbols closed since
+        (LedgerReplayEngine.closed_positions) so their prices are loaded
+        flows: net amount invested per trade day and symbol (replayed ledger); adds the
+        period's time-weighted and money-weighted returns to the result
         
         IMPORTANT: This method handles mixed asset types (stocks, ETFs, crypto)
         with different trading schedules by using forward-fill alignment.
         """
         try:
             if not positions:
-                return {'data': [], 'total_return': 0, 'total_return_percent': 0}
-            
-            # Determine date range
-            end_date = datetime.now()
-            if period == 'ytd':
-                start_date = datetime(end_date.year, 1, 1)
-            elif period == '1m':
-                start_date = end_date - timedelta(days=30)
-            elif period == '3m':
-                start_date = end_date - timedelta(days=90)
-            elif period == '6m':
-                start_date = end_date - timedelta(days=180)
-            elif period == '1y':
-                start_date = end_date - timedelta(days=365)
-            else:  # 'all'
-                # Use earliest purchase date
-                purchase_dates = [p.get('purchase_date', datetime.now()) for p in positions]
-                start_date = min(purchase_dates) if purchase_dates else end_date - timedelta(days=365)
-            
-            # Collect historical data for all positions into separate series
-            position_series = {}
-            
-            for position in positions:
-                symbol = position['symbol']
-                hist_data = self.yf_service.get_historical_data(symbol, period='2y')
-                
-                if hist_data is None or hist_data.empty:
-                    logger.warning(f"No historical data for {symbol}, skipping")
-                    continue
-                
-                # Make dates timezone naive for comparison
-                if hist_data.index.tz is not None:
-                    hist_data.index = hist_data.index.tz_localize(None)
-                
-                # Filter by date range
-                hist_data = hist_data[hist_data.index >= start_date]
-                
-                if hist_data.empty:
-                    logger.warning(f"No data for {symbol} in the selected period")
-                    continue
-                
-                # Calculate position value over time (price * quantity)
-                quantity = position['quantity']
-                position_values = hist_data['Close'] * quantity
-                position_series[symbol] = position_values
+                return empty_performance(columnar)
             
-            if not position_series:
-                return {'data': [], 'total_return': 0, 'total_return_percent': 0}
-            
-            # Create a DataFrame with all position values
-            # This aligns all series to a common date index automatically
-            df = pd.DataFrame(position_series)
-            
-            # Sort by date
-            df = df.sort_index()
-            
-            # Forward-fill missing values (handles crypto vs stock trading days mismatch)
-            # This ensures that if BTC has data for Saturday but AAPL doesn't,
-            # AAPL's Friday close value is carried forward to Saturday
-            df = df.ffill()
-            
-            # Also backward-fill for the first few days if some positions started later
-            df = df.bfill()
-            
-            # Drop any remaining rows with NaN (edge cases)
-            df = df.dropna()
-            
-            if df.empty:
-                return {'data': [], 'total_return': 0, 'total_return_percent': 0}
-            
-            # Calculate total portfolio value per day
-            df['total_value'] = df.sum(axis=1)
-            
-            # Calculate performance metrics
-            initial_value = df['total_value'].iloc[0]
-            
-            if initial_value <= 0:
-                return {'data': [], 'total_return': 0, 'total_return_percent': 0}
-            
-            performance_data = []
-            for date, row in df.iterrows():
-                value = row['total_value']
-                change_percent = ((value - initial_value) / initial_value * 100)
-                
-                performance_data.append({
-                    'date': date.strftime('%Y-%m-%d'),
-                    'value': round(value, 2),
-                    'change_percent': round(change_percent, 2)
-                })
-            
-            # Calculate total return
-            final_value = df['total_value'].iloc[-1]
-            total_return = final_value - initial_value
-            total_return_percent = ((final_value - initial_value) / initial_value * 100)
-            
-            return {
-                'data': performance_data,
-                'total_return': round(total_return, 2),
-                'total_return_percent': round(total_return_percent, 2)
-            }
+            prices = self.build_price_matrix(self.planner.portfolio_windows(positions, period), history)
+            curve = self._portfolio_curve(prices, positions, period, holdings)
+            return self._with_returns(self._build_series(*curve, columnar=columnar), curve[0], prices, flows)
             
         except Exception as e:
             logger.error(f"Error calculating portfolio performance: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
-            return {'data': [], 'total_return': 0, 'total_return_percent': 0}
+            return empty_performance(columnar)
     
     def calculate_position_performance(
         self, 
@@ -140,96 +243,130 @@ class PerformanceService:
         quantity: float,
         purchase_price: float,
         purchase_date: datetime,
-        period: str = 'all'
+        period: str = 'all',
+        hist_data: Optional[pd.DataFrame] = None,
+        columnar: bool = False
     ) -> Dict:
-        """Calculate performance for a single position"""
+        """
+        Calculate performance for a single position
+        hist_data: optional preloaded daily bars (downloaded from Yahoo Finance if omitted)
+        columnar: return dates/values/change_percent arrays instead of one dict per day
+        """
         try:
-            # Determine date range
-            end_date = datetime.now()
-            if period == 'ytd':
-                start_date = datetime(end_date.year, 1, 1)
-            elif period == '1m':
-                start_date = end_date - timedelta(days=30)
-            elif period == '3m':
-                start_date = end_date - timedelta(days=90)
-            elif period == '6m':
-                start_date = end_date - timedelta(days=180)
-            elif period == '1y':
-                start_date = end_date - timedelta(days=365)
-            else:  # 'all'
-                start_date = purchase_date
-            
-            # Use purchase date if it's more recent
-            start_date = max(start_date, purchase_date)
-            
-            # Get historical data
-            hist_data = self.yf_service.get_historical_data(symbol, period='2y')
-            
-            if hist_data is None or hist_data.empty:
-                return {'data': [], 'total_return': 0, 'total_return_percent': 0}
+            history = {symbol: hist_data} if hist_data is not None else None
+            windows = self.planner.position_windows([{'symbol': symbol, 'purchase_date': purchase_date}], period)
+            prices = self.build_price_matrix(windows, history)
+            if prices.empty:
+                return empty_performance(columnar)
             
-            # Filter by date range - make dates timezone naive for comparison
-            hist_data.index = hist_data.index.tz_localize(None)
-            hist_data = hist_data[hist_data.index >= start_date]
+            curve = self._position_curve(prices[symbol], quantity, purchase_price, purchase_date, period)
+            return self._build_series(*curve, columnar=columnar)
             
-            # Calculate performance
-            performance_data = []
-            initial_value = purchase_price * quantity
+        except Exception as e:
+            logger.error(f"Error calculating position performance for {symbol}: {str(e)}")
+            return empty_performance(columnar)
+    
+    def calculate_batch_performance(
+        self,
+        positions: List[Dict],
+        period: str = 'all',
+        history: Optional[Dict[str, pd.DataFrame]] = None,
+        symbols: Optional[List[str]] = None,
+        columnar: bool = False,
+        holdings: Optional[pd.DataFrame] = None,
+        flows: Optional[pd.DataFrame] = None
+    ) -> Dict:
+        """
+        Portfolio curve and per-position curves from a single aligned price matrix
+        positions: dicts with 'symbol', 'quantity', 'avg_price' and 'purchase_date'
+        symbols: restrict the position curves to these symbols (the portfolio curve
+        always covers every position)
+        holdings, flows: replayed ledger for the portfolio curve (see calculate_portfolio_performance);
+        closed positions (quantity 0) only contribute to the portfolio curve
+        Returns {'portfolio': {...}, 'positions': [{'symbol': ..., 'data': [...], ...}]}
+        """
+        result = {'portfolio': empty_performance(columnar), 'positions': []}
+        try:
+            if not positions:
+                return result
+            
+            # The portfolio curve needs every symbol from the period start, which also
+            # covers each position curve (they start at max(period start, purchase date))
+            windows = self.planner.merge(
+                self.planner.portfolio_windows(positions, period),
+                self.planner.position_windows(positions, period)
+            )
+            prices = self.build_price_matrix(windows, history)
+            curve = self._portfolio_curve(prices, positions, period, holdings)
+            result['portfolio'] = self._with_returns(self._build_series(*curve, columnar=columnar), curve[0], prices, flows)
             
-            for date, row in hist_data.iterrows():
-                current_price = row['Close']
-                current_value = current_price * quantity
-                change_percent = ((current_value - initial_value) / initial_value * 100) if initial_value > 0 else 0
+            for position in positions:
+                symbol = position['symbol']
+                if position['quantity'] <= 0 or (symbols is not None and symbol not in symbols):
+                    continue
                 
-                performance_data.append({
-                    'date': date.strftime('%Y-%m-%d'),
-                    'value': round(current_value, 2),
-                    'change_percent': round(change_percent, 2)
-                })
-            
-            if performance_data:
-                final_value = performance_data[-1]['value']
-                total_return = final_value - initial_value
-                total_return_percent = ((final_value - initial_value) / initial_value * 100) if initial_value > 0 else 0
-            else:
-                total_return = 0
-                total_return_percent = 0
+                if symbol in prices:
+                    curve = self._position_curve(
+                        prices[symbol],
+                        quantity=position['quantity'],
+                        purchase_price=position['avg_price'],
+                        purchase_date=position['purchase_date'],
+                        period=period
+                    )
+                    perf_data = self._build_series(*curve, columnar=columnar)
+                else:
+                    perf_data = empty_performance(columnar)
+                
+                result['positions'].append({'symbol': symbol, **perf_data})
             
-            return {
-                'data': performance_data,
-                'total_return': round(total_return, 2),
-                'total_return_percent': round(total_return_percent, 2)
-            }
+            return result
             
         except Exception as e:
-            logger.error(f"Error calculating position performance for {symbol}: {str(e)}")
-            return {'data': [], 'total_return': 0, 'total_return_percent': 0}
+            logger.error(f"Error calculating batch performance: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+            return result
     
     def compare_with_index(
         self,
-        portfolio_performance: List[Dict],
-        index_symbol: str = '^GSPC'
+        portfolio_performance: Union[List[Dict], Dict],
+        index_symbol: str = '^GSPC',
+        index_history: Optional[pd.DataFrame] = None,
+        columnar: bool = False
     ) -> Dict:
         """
         Compare portfolio performance with market index.
+        portfolio_performance: performance points, or a columnar performance dict
+        columnar: return dates/portfolio_percent/index_percent arrays instead of one dict per day
         
         IMPORTANT: This method handles the case where portfolio may have data
         for days the index doesn't trade (e.g., crypto positions on weekends).
         We align on index trading days for accurate comparison.
         """
+        empty = {'dates': [], 'portfolio_percent': [], 'index_percent': []} if columnar else {'data': []}
         try:
-            if not portfolio_performance:
-                return {'data': []}
+            if isinstance(portfolio_performance, dict):
+                portfolio_dates = portfolio_performance.get('dates', [])
+                portfolio_changes = portfolio_performance.get('change_percent', [])
+            else:
+                portfolio_dates = [p['date'] for p in portfolio_performance]
+                portfolio_changes = [p['change_percent'] for p in portfolio_performance]
+            
+            if not portfolio_dates:
+                return empty
             
             # Get index data
-            start_date = datetime.strptime(portfolio_performance[0]['date'], '%Y-%m-%d')
-            end_date = datetime.strptime(portfolio_performance[-1]['date'], '%Y-%m-%d')
+            start_date = datetime.strptime(portfolio_dates[0], '%Y-%m-%d')
+            end_date = datetime.strptime(portfolio_dates[-1], '%Y-%m-%d')
             
-            hist_data = self.yf_service.get_historical_data(index_symbol, period='2y')
+            if index_history is not None:
+                hist_data = index_history.copy()
+            else:
+                hist_data = self.planner.fetch({index_symbol: start_date}).get(index_symbol)
             
             if hist_data is None or hist_data.empty:
                 logger.warning(f"No historical data for index {index_symbol}")
-                return {'data': []}
+                return empty
             
             # Filter by date range - make dates timezone naive for comparison
             if hist_data.index.tz is not None:
@@ -237,44 +374,46 @@ class PerformanceService:
             hist_data = hist_data[(hist_data.index >= start_date) & (hist_data.index <= end_date)]
             
             if hist_data.empty:
-                return {'data': []}
+                return empty
             
             # Normalize index to percentage change
-            initial_price = hist_data['Close'].iloc[0]
+            closes = hist_data['Close'].to_numpy(dtype=float)
+            initial_price = closes[0]
             if initial_price <= 0:
-                return {'data': []}
-            
-            # Create a lookup dict from portfolio performance
-            portfolio_lookup = {p['date']: p['change_percent'] for p in portfolio_performance}
-            
-            comparison_data = []
-            last_portfolio_percent = 0  # Track last known portfolio value for interpolation
-            
-            for date, row in hist_data.iterrows():
-                date_str = date.strftime('%Y-%m-%d')
-                price = row['Close']
-                index_change_percent = ((price - initial_price) / initial_price * 100)
-                
-                # Get portfolio performance for this date
-                # If the exact date doesn't exist (e.g., index trades but portfolio data missing),
-                # try to find the nearest previous date
-                if date_str in portfolio_lookup:
-                    portfolio_percent = portfolio_lookup[date_str]
-                    last_portfolio_percent = portfolio_percent
-                else:
-                    # Use last known portfolio percentage (forward-fill approach)
-                    portfolio_percent = last_portfolio_percent
-                
-                comparison_data.append({
-                    'date': date_str,
-                    'portfolio_percent': round(portfolio_percent, 2),
-                    'index_percent': round(index_change_percent, 2)
-                })
-            
-            return {'data': comparison_data}
+                return empty
+            
+            dates = hist_data.index.strftime('%Y-%m-%d')
+            index_percent = np.round((closes - initial_price) / initial_price * 100, 2)
+            
+            # Portfolio performance on index trading days. If the exact date doesn't exist
+            # (e.g., index trades but portfolio data missing), the last known portfolio
+            # percentage is carried forward (0 before the first match)
+            portfolio_percent = (
+                pd.Series(portfolio_changes, index=portfolio_dates, dtype=float)
+                .groupby(level=0).last()
+                .reindex(dates)
+                .ffill()
+                .fillna(0)
+                .round(2)
+                .to_numpy()
+            )
+            
+            dates = dates.tolist()
+            if columnar:
+                return {
+                    'dates': dates,
+                    'portfolio_percent': portfolio_percent.tolist(),
+                    'index_percent': index_percent.tolist()
+                }
+            return {
+                'data': [
+                    {'date': date, 'portfolio_percent': portfolio, 'index_percent': index}
+                    for date, portfolio, index in zip(dates, portfolio_percent.tolist(), index_percent.tolist())
+                ]
+            }
             
         except Exception as e:
             logger.error(f"Error comparing with index: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
-            return {'data': []}
+            return empty
@@ -1,8 +1,10 @@
 import pandas as pd
 import numpy as np
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
 from .yahoo_finance import YahooFinanceService
+from .risk_engine import RiskEngine
+from .history_window import HistoryWindowPlanner
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,6 +14,16 @@ class PortfolioAnalytics:
     
     def __init__(self):
         self.yf_service = YahooFinanceService()
+        self.planner = HistoryWindowPlanner()
+    
+    def _history(self, symbol: str, period: str = '1y') -> Optional[pd.DataFrame]:
+        """Daily bars of symbol over the exact date range of period"""
+        return self.planner.fetch(self.planner.lookback_windows([symbol], period)).get(symbol)
+    
+    def _market_closes(self, market_index: str, period: str = '1y') -> Optional[pd.Series]:
+        """Daily closes of the benchmark index over period"""
+        hist_data = self._history(market_index, period)
+        return hist_data['Close'] if hist_data is not None else None
     
     def calculate_portfolio_volatility(self, positions: List[Dict], period: str = '1y') -> Dict[str, float]:
         """Calculate portfolio volatility (historical annualized)"""
@@ -23,7 +35,7 @@ class PortfolioAnalytics:
             total_value = sum(p['total_value'] for p in positions)
             
             for position in positions:
-                hist_data = self.yf_service.get_historical_data(position['symbol'], period)
+                hist_data = self._history(position['symbol'], period)
                 if hist_data is not None and not hist_data.empty:
                     returns = self.yf_service.calculate_returns(hist_data['Close'])
                     weight = position['total_value'] / total_value
@@ -150,7 +162,7 @@ class PortfolioAnalytics:
         """Calculate portfolio beta"""
         try:
             # Get market data
-            market_data = self.yf_service.get_market_data(market_index, period)
+            market_data = self._market_closes(market_index, period)
             if market_data is None or market_data.empty:
                 logger.warning(f"No market data available for beta calculation (index: {market_index})")
                 return 1.0
@@ -167,7 +179,7 @@ class PortfolioAnalytics:
             total_value = sum(p['total_value'] for p in positions)
             
             for position in positions:
-                hist_data = self.yf_service.get_historical_data(position['symbol'], period)
+                hist_data = self._history(position['symbol'], period)
                 if hist_data is not None and not hist_data.empty:
                     # Make timezone naive
                     if hist_data.index.tz is not None:
@@ -201,7 +213,7 @@ class PortfolioAnalytics:
         """Calculate beta for a single position against the specified market index"""
         try:
             # Get market data using the user's benchmark
-            market_data = self.yf_service.get_market_data(market_index, period)
+            market_data = self._market_closes(market_index, period)
             if market_data is None or market_data.empty:
                 logger.warning(f"No market data for beta calculation of {symbol} against {market_index}")
                 return 1.0
@@ -213,7 +225,7 @@ class PortfolioAnalytics:
             market_returns = self.yf_service.calculate_returns(market_data)
             
             # Get position data
-            hist_data = self.yf_service.get_historical_data(symbol, period)
+            hist_data = self._history(symbol, period)
             if hist_data is None or hist_data.empty:
                 logger.warning(f"No historical data for {symbol}")
                 return 1.0
@@ -234,7 +246,7 @@ class PortfolioAnalytics:
     def calculate_position_volatility(self, symbol: str, period: str = '1y') -> float:
         """Calculate volatility for a single position"""
         try:
-            hist_data = self.yf_service.get_historical_data(symbol, period)
+            hist_data = self._history(symbol, period)
             if hist_data is None or hist_data.empty:
                 return 0.0
             
@@ -246,32 +258,25 @@ class PortfolioAnalytics:
             return 0.0
     
     def calculate_correlation_matrix(self, symbols: List[str], period: str = '1y') -> List[Dict]:
-        """Calculate correlation matrix between positions"""
+        """Calculate correlation matrix between positions as a list of pairs"""
         try:
-            correlations = []
-            returns_dict = {}
-            
-            # Get returns for all symbols
-            for symbol in symbols:
-                hist_data = self.yf_service.get_historical_data(symbol, period)
-                if hist_data is not None and not hist_data.empty:
-                    returns_dict[symbol] = self.yf_service.calculate_returns(hist_data['Close'])
-            
-            # Calculate pairwise correlations
-            symbols_with_data = list(returns_dict.keys())
-            for i, symbol1 in enumerate(symbols_with_data):
-                for symbol2 in symbols_with_data[i+1:]:
-                    corr = self.yf_service.calculate_correlation(
-                        returns_dict[symbol1],
-                        returns_dict[symbol2]
-                    )
-                    correlations.append({
-                        'symbol1': symbol1,
-                        'symbol2': symbol2,
-                        'correlation': round(corr, 2)
-                    })
-            
-            return correlations
+            dense = RiskEngine().correlation_matrix(symbols, period)
+            symbols_with_data = dense['symbols']
+            n = len(symbols_with_data)
+            if n < 2:
+                return []
+            
+            # Upper triangle of the dense matrix, without the diagonal
+            matrix = np.array(dense['matrix']).reshape(n, n)
+            rows, cols = np.triu_indices(n, k=1)
+            return [
+                {
+                    'symbol1': symbols_with_data[i],
+                    'symbol2': symbols_with_data[j],
+                    'correlation': float(corr)
+                }
+                for i, j, corr in zip(rows, cols, matrix[rows, cols])
+            ]
         except Exception as e:
             logger.error(f"Error calculating correlation matrix: {str(e)}")
             return []
@@ -285,7 +290,7 @@ class PortfolioAnalytics:
             total_value = sum(p['total_value'] for p in positions)
             
             for position in positions:
-                hist_data = self.yf_service.get_historical_data(position['symbol'], period)
+                hist_data = self._history(position['symbol'], period)
                 if hist_data is not None and not hist_data.empty:
                     returns = self.yf_service.calculate_returns(hist_data['Close'])
                     weight = position['total_value'] / total_value
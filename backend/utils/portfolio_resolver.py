@@ -0,0 +1,118 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+from models import Portfolio
+from .keyed_locks import KeyedLocks
+
+logger = logging.getLogger(__name__)
+
+# Seconds a user's portfolio ids stay cached (bounds staleness across server processes)
+PORTFOLIO_CACHE_TTL = int(os.environ.get('PORTFOLIO_CACHE_TTL', '300'))
+# Users kept in the in-process LRU
+PORTFOLIO_CACHE_SIZE = int(os.environ.get('PORTFOLIO_CACHE_SIZE', '10000'))
+
+
+class PortfolioResolver:
+    """
+    Portfolio targeted by a write when the request does not name one.
+
+    The default portfolio is the one flagged is_default (unique per user, enforced by a
+    partial unique index), else the oldest one; a user without portfolios gets a
+    default one created on first write. Each user's portfolio ids are loaded with a
+    single query and cached in process, so resolving and validating a portfolio costs
+    no round-trip until invalidate() is called after a portfolio is created, updated
+    or deleted.
+    """
+
+    def __init__(self, db, ttl: int = PORTFOLIO_CACHE_TTL, max_entries: int = PORTFOLIO_CACHE_SIZE):
+        self.collection = db.portfolios
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._user_locks = KeyedLocks()
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, user_id: str):
+        """Forget a user's portfolios (call after creating, updating or deleting one)"""
+        self._entries.pop(user_id, None)
+
+    def _cached(self, user_id: str) -> Optional[Dict]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry['loaded_at'] >= self.ttl:
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return entry
+
+    async def _load(self, user_id: str) -> Dict:
+        entry = self._cached(user_id)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        portfolios = await self.collection.find(
+            {"user_id": user_id}, {"_id": 0, "id": 1, "is_default": 1}
+        ).sort("created_at", ASCENDING).to_list(None)
+        default = next((p['id'] for p in portfolios if p.get('is_default')), None)
+        if default is None and portfolios:
+            default = portfolios[0]['id']
+        entry = {'default': default, 'ids': {p['id'] for p in portfolios}, 'loaded_at': time.monotonic()}
+
+        self._entries[user_id] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    async def default_id(self, user_id: str, create: bool = True) -> Optional[str]:
+        """Id of the user's default portfolio; created if the user has none (None if create is False)"""
+        entry = await self._load(user_id)
+        if entry['default'] or not create:
+            return entry['default']
+
+        async with self._user_locks.hold(user_id):
+            entry = await self._load(user_id)
+            if entry['default']:
+                return entry['default']
+            portfolio = Portfolio(
+                user_id=user_id,
+                name="Portefeuille Principal",
+                description="Mon portefeuille par défaut",
+                is_default=True
+            )
+            try:
+                await self.collection.insert_one(portfolio.dict())
+            except DuplicateKeyError:
+                # Another server process created it first
+                logger.info(f"Default portfolio of {user_id} created concurrently")
+            self.invalidate(user_id)
+            return (await self._load(user_id))['default']
+
+    async def resolve(self, user_id: str, portfolio_id: Optional[str] = None, create: bool = True) -> Optional[str]:
+        """
+        portfolio_id if it belongs to the user, else None; the default portfolio when
+        portfolio_id is not given
+        """
+        if not portfolio_id:
+            return await self.default_id(user_id, create)
+        entry = await self._load(user_id)
+        if portfolio_id not in entry['ids']:
+            # Possibly created by another server process since the ids were cached
+            self.invalidate(user_id)
+            entry = await self._load(user_id)
+        return portfolio_id if portfolio_id in entry['ids'] else None
+
+    def stats(self) -> Dict:
+        return {
+            'users': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'ttl_seconds': self.ttl
+        }
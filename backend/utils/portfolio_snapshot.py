@@ -0,0 +1,390 @@
+import os
+import asyncio
+import logging
+import time
+import itertools
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from .returns import capital_flows, money_weighted_return
+
+logger = logging.getLogger(__name__)
+
+# How long a computed snapshot is served before being rebuilt (seconds)
+SNAPSHOT_TTL = int(os.environ.get('SNAPSHOT_TTL', '60'))
+# (user, portfolio) snapshots kept in memory, least recently used evicted first
+SNAPSHOT_CACHE_SIZE = int(os.environ.get('SNAPSHOT_CACHE_SIZE', '1000'))
+# How long since-inception TWR/MWR are served before the ledger is replayed again (seconds)
+RETURNS_TTL = int(os.environ.get('RETURNS_TTL', '900'))
+
+
+async def get_capital_totals(db, query: Dict) -> Tuple[float, float]:
+    """Total deposits and withdrawals matching query, summed server-side"""
+    totals = await db.capital_contributions.aggregate([
+        {"$match": query},
+        {"$group": {"_id": "$type", "total": {"$sum": "$amount"}}}
+    ]).to_list(None)
+    by_type = {t['_id']: t['total'] for t in totals}
+    return by_type.get('deposit', 0), by_type.get('withdrawal', 0)
+
+
+class PortfolioSnapshot:
+    """Enriched positions, totals, risk metrics and cash of one (user, portfolio) at a point in time"""
+
+    def __init__(self, user_id: str, portfolio_id: Optional[str], positions: List[Dict], summary: Dict):
+        self.user_id = user_id
+        self.portfolio_id = portfolio_id
+        self.positions = positions
+        self.summary = summary
+        self.computed_at = datetime.utcnow()
+
+    def age_seconds(self) -> float:
+        return (datetime.utcnow() - self.computed_at).total_seconds()
+
+
+class PortfolioSnapshotService:
+    """
+    Builds PortfolioSnapshot objects in a single pass and memoizes them per
+    (user, portfolio) for SNAPSHOT_TTL seconds. /positions, /portfolio/summary,
+    /analytics/recommendations and /dashboard are views over the same snapshot,
+    so one page load fetches prices and computes risk metrics only once.
+    Write endpoints call invalidate() so users see their changes immediately; a
+    build that was already running when invalidate() was called is returned to its
+    caller but not memoized.
+    Since-inception TWR/MWR replay the whole ledger, so they are not part of the
+    snapshot: returns() computes them on demand and memoizes them under their own
+    key for RETURNS_TTL seconds, with the same invalidation.
+    """
+
+    def __init__(
+        self,
+        db,
+        market_data,
+        risk_engine,
+        analytics_service,
+        returns_loader: Optional[Callable[[str, Optional[str], List[Dict]], Awaitable[Dict]]] = None,
+        quote_board=None,
+        ttl: int = SNAPSHOT_TTL,
+        max_entries: int = SNAPSHOT_CACHE_SIZE,
+        returns_ttl: int = RETURNS_TTL
+    ):
+        self.db = db
+        self.market_data = market_data
+        self.risk_engine = risk_engine
+        self.analytics_service = analytics_service
+        # async (user_id, portfolio_id, positions) -> {'twr_percent', 'mwr_percent', 'mwr_annualized_percent'}
+        self.returns_loader = returns_loader
+        # Warm in-memory quotes (QuoteBoard); prices are downloaded on demand without it
+        self.quote_board = quote_board
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.returns_ttl = returns_ttl
+        self._snapshots: "OrderedDict[Tuple[str, Optional[str]], PortfolioSnapshot]" = OrderedDict()
+        # (user, portfolio) -> (returns, time.monotonic() when computed)
+        self._returns: "OrderedDict[Tuple[str, Optional[str]], Tuple[Dict, float]]" = OrderedDict()
+        # Snapshot builds lock (user, portfolio), returns computations (user, portfolio, 'returns')
+        self._locks: Dict[Tuple, asyncio.Lock] = {}
+        # Per-user generation, bumped by invalidate() (values from one counter, never reused)
+        self._generations: Dict[str, int] = {}
+        self._generation_counter = itertools.count(1)
+
+    async def get(self, user_id: str, portfolio_id: Optional[str] = None, refresh: bool = False) -> PortfolioSnapshot:
+        """Memoized snapshot; concurrent requests for the same key share one build"""
+        key = (user_id, portfolio_id)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is None or refresh or snapshot.age_seconds() >= self.ttl:
+                generation = self._generations.get(user_id, 0)
+                snapshot = await self._build(user_id, portfolio_id)
+                # A write invalidated the user while building: the snapshot may predate it
+                if self._generations.get(user_id, 0) == generation:
+                    self._snapshots[key] = snapshot
+            if key in self._snapshots:
+                self._snapshots.move_to_end(key)
+        self._prune()
+        return snapshot
+
+    async def returns(self, snapshot: PortfolioSnapshot) -> Dict:
+        """
+        Memoized since-inception TWR/MWR of a snapshot's positions, with the keys
+        of the summary ({} without a returns loader)
+        """
+        key = (snapshot.user_id, snapshot.portfolio_id)
+        lock = self._locks.setdefault(key + ('returns',), asyncio.Lock())
+        async with lock:
+            cached = self._returns.get(key)
+            if cached is None or time.monotonic() - cached[1] >= self.returns_ttl:
+                generation = self._generations.get(snapshot.user_id, 0)
+                returns = await self._position_returns(snapshot.user_id, snapshot.portfolio_id, snapshot.positions)
+                cached = (returns, time.monotonic())
+                if returns and self._generations.get(snapshot.user_id, 0) == generation:
+                    self._returns[key] = cached
+            if key in self._returns:
+                self._returns.move_to_end(key)
+        self._prune()
+        returns = cached[0]
+        return {
+            "twr_percent": returns.get('twr_percent', 0),
+            "mwr_percent": returns.get('mwr_percent'),
+            "mwr_annualized_percent": returns.get('mwr_annualized_percent')
+        }
+
+    def invalidate(self, user_id: str):
+        """Drop every memoized snapshot and returns of a user (all portfolios)"""
+        self._generations[user_id] = next(self._generation_counter)
+        for cache in (self._snapshots, self._returns):
+            for key in [k for k in cache if k[0] == user_id]:
+                cache.pop(key, None)
+        self._prune()
+
+    def _prune(self):
+        """Evict least recently used snapshots and returns past max_entries, then idle locks and generations"""
+        for cache in (self._snapshots, self._returns):
+            while len(cache) > self.max_entries:
+                cache.popitem(last=False)
+        idle = [
+            k for k, lock in self._locks.items()
+            if k[:2] not in self._snapshots and k[:2] not in self._returns and not lock.locked()
+        ]
+        for key in idle:
+            del self._locks[key]
+        # A generation is only compared by builds in progress, which hold a lock
+        locked_users = {k[0] for k in self._locks}
+        for user_id in [u for u in self._generations if u not in locked_users]:
+            del self._generations[user_id]
+
+    async def convert_cash_to_eur(self, cash_accounts: List[Dict]):
+        """Convert cash balances to EUR, refreshing every needed FX pair in a single request"""
+        non_empty = [acc for acc in cash_accounts if acc.get('balance', 0) != 0]
+        rates = await self.market_data.get_exchange_rates([acc.get('currency', 'EUR') for acc in non_empty], 'EUR')
+
+        total_cash_eur = 0.0
+        cash_details = []
+        for acc in non_empty:
+            currency = acc.get('currency', 'EUR')
+            balance = acc.get('balance', 0)
+            balance_in_eur = balance * rates.get(currency.upper(), 1.0)
+            total_cash_eur += balance_in_eur
+            cash_details.append({
+                'currency': currency,
+                'balance': balance,
+                'balance_eur': round(balance_in_eur, 2)
+            })
+        return total_cash_eur, cash_details
+
+    async def _build(self, user_id: str, portfolio_id: Optional[str]) -> PortfolioSnapshot:
+        scoped_query = {"user_id": user_id}
+        if portfolio_id:
+            scoped_query["portfolio_id"] = portfolio_id
+
+        # Only current positions (quantity > 0)
+        positions, user_settings, cash_accounts, (total_deposits, total_withdrawals), contributions = await asyncio.gather(
+            self.db.positions.find({**scoped_query, "quantity": {"$gt": 0}}).to_list(None),
+            self.db.user_settings.find_one({"user_id": user_id}),
+            self.db.cash_accounts.find(scoped_query).to_list(None),
+            get_capital_totals(self.db, scoped_query),
+            self.db.capital_contributions.find(scoped_query, {"_id": 0, "date": 1, "type": 1, "amount": 1}).to_list(None)
+        )
+
+        # Get user settings for RFR and benchmark
+        risk_free_rate = user_settings.get('risk_free_rate', 3.0) if user_settings else 3.0
+        benchmark_index = user_settings.get('benchmark_index', '^GSPC') if user_settings else '^GSPC'
+        net_capital = total_deposits - total_withdrawals
+
+        # Prices and daily changes (from the quote board when available) and FX rates, fetched together
+        daily_changes, (total_cash_eur, cash_details) = await asyncio.gather(
+            self._daily_changes([pos['symbol'] for pos in positions]),
+            self.convert_cash_to_eur(cash_accounts)
+        )
+        quotes_freshness = self._quotes_freshness(daily_changes)
+
+        if not positions:
+            capital_mwr = await self.market_data.run(self._capital_mwr, contributions, total_cash_eur)
+            capital_gain_loss = total_cash_eur - net_capital if net_capital > 0 else 0
+            capital_performance_percent = (capital_gain_loss / net_capital * 100) if net_capital > 0 else 0
+            summary = {
+                "total_value": round(total_cash_eur, 2),
+                "positions_value": 0,
+                "cash_value": round(total_cash_eur, 2),
+                "cash_details": cash_details,
+                "total_invested": 0,
+                "total_gain_loss": 0,
+                "gain_loss_percent": 0,
+                "daily_change": 0,
+                "daily_change_percent": 0,
+                "volatility": {'historical': 0, 'realized': 0},
+                "beta": 1.0,
+                "sharpe_ratio": 0,
+                "risk_free_rate": risk_free_rate,
+                "benchmark_index": benchmark_index,
+                "holding_period_days": 0,
+                "first_purchase_date": None,
+                "net_capital": round(net_capital, 2),
+                "capital_gain_loss": round(capital_gain_loss, 2),
+                "capital_performance_percent": round(capital_performance_percent, 2),
+                "capital_mwr_annualized_percent": capital_mwr,
+                **quotes_freshness,
+                "portfolio_id": portfolio_id
+            }
+            return PortfolioSnapshot(user_id, portfolio_id, [], summary)
+
+        # Calculate portfolio metrics
+        total_value = 0
+        total_invested = 0
+        risk_inputs = []
+        earliest_purchase_date = None
+
+        for pos in positions:
+            change = daily_changes.get(pos['symbol'])
+            current_price = change['current_price'] if change else pos['avg_price']
+
+            position_value = pos['quantity'] * current_price
+            position_invested = pos['quantity'] * pos['avg_price']
+            total_value += position_value
+            total_invested += position_invested
+
+            # Track earliest purchase date
+            purchase_date = pos.get('purchase_date')
+            if purchase_date:
+                if earliest_purchase_date is None or purchase_date < earliest_purchase_date:
+                    earliest_purchase_date = purchase_date
+
+            risk_inputs.append({
+                'symbol': pos['symbol'],
+                'total_value': position_value,
+                'invested': position_invested,
+                'quantity': pos['quantity'],
+                'purchase_date': pos.get('purchase_date')
+            })
+
+        # Historical volatility, betas, Sharpe ratio and covariance come from one returns
+        # matrix; realized volatility (since purchase) runs alongside
+        risk, realized_volatility = await asyncio.gather(
+            self.market_data.run(self.risk_engine.compute, risk_inputs, market_index=benchmark_index, risk_free_rate=risk_free_rate),
+            self.market_data.run(self.analytics_service.calculate_realized_volatility, risk_inputs)
+        )
+
+        enriched_positions = self._enrich_positions(positions, daily_changes, risk, total_value)
+
+        total_gain_loss = total_value - total_invested
+        gain_loss_percent = (total_gain_loss / total_invested * 100) if total_invested > 0 else 0
+
+        # Calculate daily change
+        daily_change = 0
+        daily_change_percent = 0
+        for pos in positions:
+            change = daily_changes.get(pos['symbol'])
+            if change:
+                position_value = pos['quantity'] * (change.get('current_price', pos['avg_price']))
+                weight = position_value / total_value if total_value > 0 else 0
+                daily_change += pos['quantity'] * change.get('price_change', 0)
+                daily_change_percent += weight * change.get('change_percent', 0)
+
+        # Calculate holding period
+        holding_period_days = 0
+        if earliest_purchase_date:
+            if hasattr(earliest_purchase_date, 'replace'):
+                earliest_purchase_date = earliest_purchase_date.replace(tzinfo=None)
+            holding_period_days = (datetime.utcnow() - earliest_purchase_date).days
+
+        # Total value includes positions + cash (all in EUR)
+        total_value_with_cash = total_value + total_cash_eur
+
+        # Calculate performance based on capital contributions (using total value with cash)
+        capital_gain_loss = total_value_with_cash - net_capital if net_capital > 0 else 0
+        capital_performance_percent = (capital_gain_loss / net_capital * 100) if net_capital > 0 else 0
+        capital_mwr = await self.market_data.run(self._capital_mwr, contributions, total_value_with_cash)
+
+        summary = {
+            "total_value": round(total_value_with_cash, 2),
+            "positions_value": round(total_value, 2),
+            "cash_value": round(total_cash_eur, 2),
+            "cash_details": cash_details,
+            "total_invested": round(total_invested, 2),
+            "total_gain_loss": round(total_gain_loss, 2),
+            "gain_loss_percent": round(gain_loss_percent, 2),
+            "daily_change": round(daily_change, 2),
+            "daily_change_percent": round(daily_change_percent, 2),
+            "volatility": {'historical': risk['volatility'], 'realized': realized_volatility},
+            "beta": risk['beta'],
+            "sharpe_ratio": risk['sharpe_ratio'],
+            "risk_free_rate": risk_free_rate,
+            "benchmark_index": benchmark_index,
+            "holding_period_days": holding_period_days,
+            "first_purchase_date": earliest_purchase_date.isoformat() if earliest_purchase_date else None,
+            "net_capital": round(net_capital, 2),
+            "capital_gain_loss": round(capital_gain_loss, 2),
+            "capital_performance_percent": round(capital_performance_percent, 2),
+            "capital_mwr_annualized_percent": capital_mwr,
+            **quotes_freshness,
+            "portfolio_id": portfolio_id
+        }
+        return PortfolioSnapshot(user_id, portfolio_id, enriched_positions, summary)
+
+    async def _daily_changes(self, symbols: List[str]) -> Dict[str, Dict]:
+        if self.quote_board is not None:
+            return await self.quote_board.get_quotes(symbols)
+        return await self.market_data.get_daily_changes(symbols)
+
+    @staticmethod
+    def _quotes_freshness(daily_changes: Dict[str, Dict]) -> Dict:
+        """Timestamp of the oldest quote used and whether any of them is stale"""
+        timestamps = [c['timestamp'] for c in daily_changes.values() if 'timestamp' in c]
+        return {
+            "quotes_as_of": min(timestamps) if timestamps else None,
+            "quotes_stale": any(c.get('stale', False) for c in daily_changes.values())
+        }
+
+    async def _position_returns(self, user_id: str, portfolio_id: Optional[str], positions: List[Dict]) -> Dict:
+        """Since-inception TWR and MWR of the positions, or {} without a returns loader"""
+        if self.returns_loader is None or not positions:
+            return {}
+        try:
+            return await self.returns_loader(user_id, portfolio_id, positions)
+        except Exception as e:
+            logger.error(f"Error calculating time/money-weighted returns for {user_id}: {str(e)}")
+            return {}
+
+    @staticmethod
+    def _capital_mwr(contributions: List[Dict], total_value: float) -> Optional[float]:
+        """Annualized money-weighted return of the capital contributions, valued at total_value today"""
+        if not contributions:
+            return None
+        return money_weighted_return(capital_flows(contributions), final_value=total_value, final_date=datetime.utcnow())
+
+    @staticmethod
+    def _enrich_positions(positions: List[Dict], daily_changes: Dict[str, Dict], risk: Dict, total_value: float) -> List[Dict]:
+        """Position documents with current market data, risk metrics and portfolio weight"""
+        now = datetime.utcnow().isoformat()
+        enriched_positions = []
+        for pos in positions:
+            change = daily_changes.get(pos['symbol'])
+            current_price = change['current_price'] if change else pos['avg_price']
+            position_risk = risk['positions'].get(pos['symbol'], {'beta': 1.0, 'volatility': 0.0})
+
+            position_value = pos['quantity'] * current_price
+            invested = pos['quantity'] * pos['avg_price']
+            gain_loss = position_value - invested
+            gain_loss_percent = (gain_loss / invested * 100) if invested > 0 else 0
+
+            # Create clean position dict without MongoDB _id, with datetime objects as ISO strings
+            clean_pos = {k: v for k, v in pos.items() if k != '_id'}
+            for field in ('created_at', 'updated_at', 'purchase_date'):
+                if field in clean_pos and hasattr(clean_pos[field], 'isoformat'):
+                    clean_pos[field] = clean_pos[field].isoformat()
+
+            enriched_positions.append({
+                **clean_pos,
+                'current_price': round(current_price, 2),
+                'total_value': round(position_value, 2),
+                'invested': round(invested, 2),
+                'gain_loss': round(gain_loss, 2),
+                'gain_loss_percent': round(gain_loss_percent, 2),
+                'weight': round(position_value / total_value * 100, 2) if total_value > 0 else 0,
+                'beta': position_risk['beta'],
+                'volatility': position_risk['volatility'],
+                'last_update': change.get('timestamp', now) if change else now,
+                'quote_stale': change.get('stale', False) if change else True
+            })
+        return enriched_positions
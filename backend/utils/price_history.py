@@ -0,0 +1,151 @@
+import os
+import asyncio
+import logging
+import pandas as pd
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from pymongo import ASCENDING, UpdateOne
+from .yahoo_finance import YahooFinanceService
+from .keyed_locks import KeyedLocks
+
+logger = logging.getLogger(__name__)
+
+# Minimum delay between two upstream top-ups of the same symbol (seconds)
+PRICE_HISTORY_TOP_UP_INTERVAL = int(os.environ.get('PRICE_HISTORY_TOP_UP_INTERVAL', '900'))
+# A download whose first bar comes this long after the requested start reveals the
+# symbol's first trading date (longer than any market closure)
+LISTING_GAP = timedelta(days=10)
+
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+class PriceHistoryStore:
+    """
+    Daily OHLCV bars persisted in the `price_history` collection (unique index on
+    symbol + date, see utils/db_indexes.py).
+
+    The first read of a symbol downloads the requested range once; later reads only
+    fetch the bars after the last stored date (and backfill if an older start is asked
+    for). Coverage per symbol is tracked in `price_history_meta`: covered_from only
+    moves back when a download returned bars (an empty answer may be a rate limit), and
+    first_trade_date, once seen, stops backfills before the symbol was listed. When
+    Yahoo Finance is unavailable, whatever is stored is served as is.
+    """
+
+    def __init__(self, db, market_data):
+        self.collection = db.price_history
+        self.meta = db.price_history_meta
+        self.market_data = market_data
+        self.yf_service = YahooFinanceService()
+        self._symbol_locks = KeyedLocks()
+
+    async def get_history(self, symbol: str, start_date: datetime, end_date: Optional[datetime] = None) -> pd.DataFrame:
+        """Daily bars for symbol between start_date and end_date (inclusive), indexed by date"""
+        start_date = self._to_day(start_date)
+        await self._sync(symbol, start_date)
+
+        date_filter = {"$gte": start_date}
+        if end_date is not None:
+            date_filter["$lte"] = end_date
+
+        cursor = self.collection.find(
+            {"symbol": symbol, "date": date_filter},
+            {"_id": 0, "symbol": 0}
+        ).sort("date", ASCENDING)
+        docs = await cursor.to_list(None)
+
+        if not docs:
+            return pd.DataFrame(columns=OHLCV_COLUMNS)
+
+        df = pd.DataFrame(docs).set_index("date")
+        df.index = pd.DatetimeIndex(df.index)
+        return df.rename(columns={c.lower(): c for c in OHLCV_COLUMNS})
+
+    async def get_histories(self, symbols: List[str], start_date: datetime) -> Dict[str, pd.DataFrame]:
+        """Daily bars of several symbols since start_date, fetched concurrently"""
+        unique_symbols = list(dict.fromkeys(symbols))
+        frames = await asyncio.gather(*[self.get_history(symbol, start_date) for symbol in unique_symbols])
+        return dict(zip(unique_symbols, frames))
+
+    async def get_ranges(self, windows: Dict[str, datetime]) -> Dict[str, pd.DataFrame]:
+        """Daily bars of each symbol since its own start date (a HistoryWindowPlanner plan), fetched concurrently"""
+        symbols = list(windows)
+        frames = await asyncio.gather(*[self.get_history(symbol, windows[symbol]) for symbol in symbols])
+        return dict(zip(symbols, frames))
+
+    async def _sync(self, symbol: str, start_date: datetime):
+        """Download only the bars missing from the store for [start_date, today]"""
+        async with self._symbol_locks.hold(symbol):
+            now = datetime.utcnow()
+            meta = await self.meta.find_one({"symbol": symbol})
+            synced_at = meta.get("synced_at") if meta else None
+            due = synced_at is None or (now - synced_at).total_seconds() >= PRICE_HISTORY_TOP_UP_INTERVAL
+
+            # Nothing stored yet (first read, or earlier downloads came back empty)
+            if meta is None or meta.get("covered_from") is None:
+                if due:
+                    await self._fetch_and_store(symbol, start_date, now, oldest=True)
+                return
+
+            # Backfill if an older range is requested than what we hold, unless it predates the listing
+            if start_date < meta["covered_from"] and meta.get("first_trade_date") is None:
+                await self._fetch_and_store(symbol, start_date, meta["covered_from"], oldest=True)
+
+            # Top up from the last stored bar (refetched, as today's bar may still be moving)
+            if due:
+                await self._fetch_and_store(symbol, meta.get("last_date") or start_date, now)
+
+    async def _fetch_and_store(self, symbol: str, start_date: datetime, end_date: datetime, oldest: bool = False):
+        """oldest: nothing is stored before start_date, so a late first bar is the listing date"""
+        # yfinance treats `end` as exclusive
+        hist_data = await self.market_data.run(
+            self.yf_service.get_historical_data_by_dates,
+            symbol,
+            start_date=start_date,
+            end_date=end_date + timedelta(days=1)
+        )
+        if hist_data is None:
+            logger.warning(f"Upstream unavailable for {symbol}, serving stored price history")
+            return
+
+        operations = []
+        first_date = last_date = None
+        if not hist_data.empty:
+            if hist_data.index.tz is not None:
+                hist_data.index = hist_data.index.tz_localize(None)
+            for date, row in zip(hist_data.index.normalize(), hist_data[OHLCV_COLUMNS].itertuples(index=False)):
+                if pd.isna(row.Close):
+                    continue
+                bar_date = date.to_pydatetime()
+                first_date = first_date or bar_date
+                last_date = bar_date
+                operations.append(UpdateOne(
+                    {"symbol": symbol, "date": bar_date},
+                    {"$set": {
+                        "open": float(row.Open),
+                        "high": float(row.High),
+                        "low": float(row.Low),
+                        "close": float(row.Close),
+                        "volume": float(row.Volume)
+                    }},
+                    upsert=True
+                ))
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+
+        meta_update = {"$set": {"synced_at": datetime.utcnow()}}
+        if operations:
+            # Bars came back, so [start_date, first bar) had no trading
+            meta_update["$min"] = {"covered_from": start_date}
+            meta_update["$max"] = {"last_date": last_date}
+            if oldest and first_date - start_date > LISTING_GAP:
+                meta_update["$min"]["first_trade_date"] = first_date
+        await self.meta.update_one({"symbol": symbol}, meta_update, upsert=True)
+
+    @staticmethod
+    def _to_day(value: datetime) -> datetime:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if value.tzinfo is not None:
+            value = value.replace(tzinfo=None)
+        return datetime(value.year, value.month, value.day)
@@ -0,0 +1,152 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two refreshes of the whole board
+QUOTE_BOARD_INTERVAL = int(os.environ.get('QUOTE_BOARD_INTERVAL', '60'))
+# Symbols per bulk download
+QUOTE_BOARD_BATCH_SIZE = int(os.environ.get('QUOTE_BOARD_BATCH_SIZE', '100'))
+# Quotes older than this are flagged as stale in responses (seconds)
+QUOTE_STALE_AFTER = int(os.environ.get('QUOTE_STALE_AFTER', str(3 * QUOTE_BOARD_INTERVAL)))
+
+
+class QuoteBoard:
+    """
+    Warm in-memory quotes for every symbol held in `db.positions` or watched by an
+    active alert in `db.alerts`.
+
+    A background task started with the app refreshes the board in bulk batches every
+    QUOTE_BOARD_INTERVAL seconds, so request handlers read prices from memory instead
+    of waiting on Yahoo Finance. Each quote carries its timestamp; reads add its age and
+    a `stale` flag. Symbols not on the board yet (e.g. a position just added) are
+    fetched once on demand; each full refresh re-reads the tracked symbols from the
+    database and drops quotes nobody holds or watches anymore.
+    """
+
+    def __init__(self, db, market_data, interval: int = QUOTE_BOARD_INTERVAL,
+                 batch_size: int = QUOTE_BOARD_BATCH_SIZE, stale_after: int = QUOTE_STALE_AFTER):
+        self.db = db
+        self.market_data = market_data
+        self.interval = interval
+        self.batch_size = batch_size
+        self.stale_after = stale_after
+        self._quotes: Dict[str, Dict] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[Dict[str, Dict]], Awaitable]] = []
+        self.last_refresh: Optional[datetime] = None
+
+    def subscribe(self, listener: Callable[[Dict[str, Dict]], Awaitable]):
+        """
+        Register a coroutine called with the freshly downloaded quotes after each background
+        refresh (on-demand fetches from request handlers do not notify)
+        """
+        self._listeners.append(listener)
+
+    def start(self):
+        """Start the background refresh loop (idempotent)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Quote board refresh failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def tracked_symbols(self) -> List[str]:
+        """Union of held symbols and symbols with an active alert"""
+        held, watched = await asyncio.gather(
+            self.db.positions.distinct("symbol", {"quantity": {"$gt": 0}}),
+            self.db.alerts.distinct("symbol", {"is_active": True})
+        )
+        return sorted(set(held) | set(watched))
+
+    async def refresh_all(self) -> Dict[str, Dict]:
+        """Refresh every tracked symbol and forget the others"""
+        symbols = await self.tracked_symbols()
+        updated = await self.refresh(symbols)
+        for symbol in set(self._quotes) - set(symbols):
+            del self._quotes[symbol]
+        self.last_refresh = datetime.utcnow()
+        if updated:
+            await self._notify(updated)
+        return updated
+
+    async def refresh(self, symbols: Iterable[str]) -> Dict[str, Dict]:
+        """Refresh the quotes of symbols in bulk batches"""
+        symbols = list(dict.fromkeys(symbols))
+        batches = [symbols[i:i + self.batch_size] for i in range(0, len(symbols), self.batch_size)]
+        results = await asyncio.gather(*[self.market_data.get_daily_changes(batch) for batch in batches])
+
+        now = datetime.utcnow()
+        updated = {}
+        for changes in results:
+            for symbol, change in changes.items():
+                updated[symbol] = {**change, 'timestamp': now}
+        self._quotes.update(updated)
+        if symbols and len(updated) < len(symbols):
+            logger.warning(f"Quote board: no quote for {len(symbols) - len(updated)} of {len(symbols)} symbols")
+        return updated
+
+    async def _notify(self, updated: Dict[str, Dict]):
+        for listener in self._listeners:
+            try:
+                await listener(updated)
+            except Exception as e:
+                logger.error(f"Quote board listener failed: {str(e)}")
+
+    def _view(self, quote: Dict, now: datetime) -> Dict:
+        age = (now - quote['timestamp']).total_seconds()
+        return {
+            **quote,
+            'timestamp': quote['timestamp'].isoformat(),
+            'age_seconds': round(age, 1),
+            'stale': age > self.stale_after
+        }
+
+    def get(self, symbol: str) -> Optional[Dict]:
+        """Quote of symbol from memory, or None if it is not on the board"""
+        quote = self._quotes.get(symbol)
+        return self._view(quote, datetime.utcnow()) if quote else None
+
+    async def get_quotes(self, symbols: Iterable[str]) -> Dict[str, Dict]:
+        """Quotes of symbols, from memory; symbols missing from the board are fetched now in one bulk request"""
+        symbols = [s for s in dict.fromkeys(symbols) if s]
+        missing = [s for s in symbols if s not in self._quotes]
+        if missing:
+            await self.refresh(missing)
+
+        now = datetime.utcnow()
+        return {s: self._view(self._quotes[s], now) for s in symbols if s in self._quotes}
+
+    async def get_prices(self, symbols: Iterable[str]) -> Dict[str, float]:
+        """Current price of each symbol, from memory"""
+        return {s: q['current_price'] for s, q in (await self.get_quotes(symbols)).items()}
+
+    def stats(self) -> Dict:
+        now = datetime.utcnow()
+        stale = sum(1 for q in self._quotes.values() if (now - q['timestamp']).total_seconds() > self.stale_after)
+        return {
+            'symbols': len(self._quotes),
+            'stale': stale,
+            'interval_seconds': self.interval,
+            'last_refresh': self.last_refresh.isoformat() if self.last_refresh else None,
+            'running': self._task is not None and not self._task.done()
+        }
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+DAYS_PER_YEAR = 365.0
+
+# Candidate annual rates scanned at once to bracket the IRR (-99% .. +10 000%)
+IRR_GRID = np.concatenate([np.linspace(-0.99, 1.0, 200), np.geomspace(1.05, 100.0, 60)])
+
+
+def align_flows(flows: pd.Series, dates: pd.DatetimeIndex) -> pd.Series:
+    """
+    Flows moved onto a date index: each flow is booked on the first date at or
+    after it (e.g. a Saturday buy on Monday); flows after the last date are dropped
+    """
+    if flows is None or flows.empty or dates.empty:
+        return pd.Series(0.0, index=dates)
+    flows = flows.groupby(pd.DatetimeIndex(flows.index).normalize()).sum()
+    flows = flows[flows.index <= dates[-1]]
+    positions = dates.searchsorted(flows.index)
+    return flows.groupby(dates[positions]).sum().reindex(dates, fill_value=0.0)
+
+
+def time_weighted_return(values: pd.Series, flows: Optional[pd.Series] = None) -> float:
+    """
+    Time-weighted return (%) of a daily value series: daily returns between flows,
+    chain-linked. flows: net amount invested per day (buys +, sells -), assumed to
+    happen at the start of the day, so r_t = V_t / (V_{t-1} + F_t) - 1
+    """
+    if values is None or len(values) < 2:
+        return 0.0
+    value = values.to_numpy(dtype=float)
+    flow = align_flows(flows, values.index).to_numpy(dtype=float) if flows is not None else np.zeros(len(value))
+
+    base = value[:-1] + flow[1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily = np.where(base > 0, value[1:] / base - 1, 0.0)
+    return round(float((np.prod(1 + daily) - 1) * 100), 2)
+
+
+def xirr(amounts: np.ndarray, years: np.ndarray, tol: float = 1e-10, max_iter: int = 100) -> Optional[float]:
+    """
+    Annual rate r with sum(amounts / (1 + r) ** years) = 0, or None if there is none.
+    The NPV of every candidate rate in IRR_GRID is evaluated in one matrix operation
+    to bracket the root nearest to 0%, which is then refined by safeguarded Newton steps.
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    years = np.asarray(years, dtype=float)
+    if len(amounts) < 2 or not (amounts > 0).any() or not (amounts < 0).any():
+        return None
+
+    def npv(rate):
+        return float(np.sum(amounts * np.exp(-years * np.log1p(rate))))
+
+    def npv_derivative(rate):
+        return float(np.sum(-years * amounts * np.exp(-(years + 1) * np.log1p(rate))))
+
+    grid_npv = (amounts[None, :] * np.exp(-years[None, :] * np.log1p(IRR_GRID)[:, None])).sum(axis=1)
+    brackets = np.nonzero(np.sign(grid_npv[:-1]) != np.sign(grid_npv[1:]))[0]
+    if len(brackets) == 0:
+        return None
+
+    # Several sign changes are possible with mixed flows: keep the root nearest to 0%
+    i = brackets[np.argmin(np.abs(IRR_GRID[brackets]))]
+    low, high = IRR_GRID[i], IRR_GRID[i + 1]
+    low_npv = grid_npv[i]
+    rate = (low + high) / 2
+
+    for _ in range(max_iter):
+        value = npv(rate)
+        if abs(value) < tol:
+            break
+        # Keep the root bracketed
+        if np.sign(value) == np.sign(low_npv):
+            low, low_npv = rate, value
+        else:
+            high = rate
+        derivative = npv_derivative(rate)
+        step = rate - value / derivative if derivative != 0 else None
+        # Fall back to bisection when Newton leaves the bracket
+        rate = step if step is not None and low < step < high else (low + high) / 2
+        if high - low < tol:
+            break
+    return rate
+
+
+def money_weighted_return(
+    flows: pd.Series,
+    final_value: float,
+    final_date: datetime,
+    initial_value: float = 0.0,
+    initial_date: Optional[datetime] = None,
+    annualized: bool = True
+) -> Optional[float]:
+    """
+    Money-weighted return (IRR, %) of an investment, per year or, with
+    annualized=False, over the whole span from the first flow to final_date.
+    flows: amounts invested per date (deposits/buys +, withdrawals/sells -)
+    initial_value: value already invested at initial_date (start of a period)
+    final_value: value held at final_date
+    None when the span is shorter than a day or no rate in IRR_GRID solves it
+    (e.g. a short period whose annualized rate exceeds +10 000%)
+    """
+    dates = list(flows.index) if flows is not None else []
+    amounts = list(-flows.to_numpy(dtype=float)) if flows is not None else []
+    if initial_value > 0 and initial_date is not None:
+        dates.insert(0, initial_date)
+        amounts.insert(0, -initial_value)
+    dates.append(final_date)
+    amounts.append(final_value)
+
+    dates = pd.DatetimeIndex(dates)
+    years = (dates - dates.min()).days.to_numpy(dtype=float) / DAYS_PER_YEAR
+    if years.max() <= 0:
+        return None
+    if not annualized:
+        years = years / years.max()
+
+    rate = xirr(np.array(amounts), years)
+    if rate is None or not np.isfinite(rate):
+        return None
+    return round(rate * 100, 2)
+
+
+def period_returns(values: pd.Series, flows: Optional[pd.Series] = None) -> Dict:
+    """
+    TWR and MWR of a value curve over its own date range.
+    flows: net amount invested per day; flows on the first day are part of the
+    starting value, later ones are external cash flows
+    mwr_percent is the money-weighted return over the period itself, defined for
+    periods under a year where mwr_annualized_percent may be None (see
+    money_weighted_return)
+    """
+    if values is None or values.empty:
+        return {'twr_percent': 0.0, 'mwr_percent': None, 'mwr_annualized_percent': None}
+
+    aligned = align_flows(flows, values.index) if flows is not None else pd.Series(0.0, index=values.index)
+    later_flows = aligned.iloc[1:]
+    later_flows = later_flows[later_flows != 0]
+    cash_flows = dict(
+        final_value=float(values.iloc[-1]),
+        final_date=values.index[-1],
+        initial_value=float(values.iloc[0]),
+        initial_date=values.index[0]
+    )
+    return {
+        'twr_percent': time_weighted_return(values, aligned),
+        'mwr_percent': money_weighted_return(later_flows, annualized=False, **cash_flows),
+        'mwr_annualized_percent': money_weighted_return(later_flows, **cash_flows)
+    }
+
+
+def capital_flows(contributions: List[Dict]) -> pd.Series:
+    """Capital contributions as amounts invested per date (deposits +, withdrawals -)"""
+    if not contributions:
+        return pd.Series(dtype=float)
+    dates = pd.to_datetime([c['date'] for c in contributions], utc=True).tz_convert(None)
+    amounts = [c['amount'] if c.get('type') == 'deposit' else -c['amount'] for c in contributions]
+    return pd.Series(amounts, index=dates, dtype=float).groupby(level=0).sum().sort_index()
@@ -0,0 +1,199 @@
+import pandas as pd
+import numpy as np
+from typing import List, Dict
+from .history_window import HistoryWindowPlanner
+import logging
+
+logger = logging.getLogger(__name__)
+
+TRADING_DAYS = 252
+
+
+class RiskEngine:
+    """
+    Portfolio risk metrics computed from a single date-aligned returns matrix.
+
+    The matrix (days x positions) is built once per request from the shared history
+    cache; per-position beta and volatility, portfolio volatility, beta and Sharpe,
+    and the covariance matrix are then derived with vectorized NumPy operations
+    instead of one pandas alignment per position and per metric.
+    """
+
+    def __init__(self):
+        self.planner = HistoryWindowPlanner()
+
+    def build_price_matrix(self, symbols: List[str], period: str = '1y') -> pd.DataFrame:
+        """Daily closes of all symbols on a common (union) date index, one column per symbol"""
+        history = self.planner.fetch(self.planner.lookback_windows(list(dict.fromkeys(symbols)), period))
+        closes = {}
+        for symbol, hist_data in history.items():
+            series = hist_data['Close']
+            # Make timezone naive and keep one bar per calendar day
+            if series.index.tz is not None:
+                series.index = series.index.tz_localize(None)
+            series.index = series.index.normalize()
+            closes[symbol] = series[~series.index.duplicated(keep='last')]
+
+        if not closes:
+            return pd.DataFrame()
+        return pd.DataFrame(closes).sort_index()
+
+    @staticmethod
+    def build_returns_matrix(prices: pd.DataFrame) -> pd.DataFrame:
+        """
+        Daily returns of each column on its own trading days.
+        Prices are forward-filled before differencing so a Monday stock return is taken
+        against Friday's close, then masked back to NaN on days the asset did not trade
+        (e.g. weekends for stocks held next to crypto).
+        """
+        if prices.empty:
+            return prices
+        returns = prices.ffill().pct_change(fill_method=None).where(prices.notna())
+        return returns.iloc[1:]
+
+    @staticmethod
+    def _masked_beta(returns: np.ndarray, market: np.ndarray) -> np.ndarray:
+        """Beta of every column against market, each over the days both have a return"""
+        mask = ~np.isnan(returns) & ~np.isnan(market)[:, None]
+        count = mask.sum(axis=0)
+        x = np.where(mask, returns, 0.0)
+        m = np.where(mask, market[:, None], 0.0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_x = x.sum(axis=0) / count
+            mean_m = m.sum(axis=0) / count
+            dx = np.where(mask, x - mean_x, 0.0)
+            dm = np.where(mask, m - mean_m, 0.0)
+            covariance = (dx * dm).sum(axis=0) / (count - 1)
+            market_variance = (dm * dm).sum(axis=0) / (count - 1)
+            beta = covariance / market_variance
+
+        # Same fallbacks as YahooFinanceService.calculate_beta
+        invalid = (count < 2) | (market_variance == 0) | ~np.isfinite(beta)
+        return np.where(invalid, 1.0, beta)
+
+    def correlation_matrix(self, symbols: List[str], period: str = '1y') -> Dict:
+        """
+        Correlation matrix of daily returns in a compact dense format:
+        {'symbols': [...], 'matrix': [...]} where matrix is the row-major flattened
+        n x n matrix. Pairs with fewer than 2 common days get a correlation of 0.
+        """
+        try:
+            prices = self.build_price_matrix(symbols, period)
+            if prices.empty:
+                return {'symbols': [], 'matrix': []}
+
+            returns = self.build_returns_matrix(prices)
+            correlation = returns.corr(min_periods=2).to_numpy(dtype=float)
+            correlation = np.nan_to_num(correlation, nan=0.0)
+            np.fill_diagonal(correlation, 1.0)
+
+            return {
+                'symbols': list(returns.columns),
+                'matrix': np.round(correlation, 2).ravel().tolist()
+            }
+        except Exception as e:
+            logger.error(f"Error calculating correlation matrix: {str(e)}")
+            return {'symbols': [], 'matrix': []}
+
+    def compute(
+        self,
+        positions: List[Dict],
+        market_index: str = '^GSPC',
+        risk_free_rate: float = 3.0,
+        period: str = '1y'
+    ) -> Dict:
+        """
+        Compute all risk metrics of a portfolio.
+        positions: dicts with 'symbol', 'total_value' and optionally 'invested'
+        Returns per-position beta/volatility, portfolio volatility, beta and Sharpe
+        ratio (same formula as PortfolioAnalytics.calculate_sharpe_ratio_custom),
+        and the annualized covariance matrix.
+        """
+        result = {
+            'positions': {},
+            'volatility': 0.0,
+            'beta': 1.0,
+            'sharpe_ratio': 0.0,
+            'covariance': {'symbols': [], 'matrix': []}
+        }
+        try:
+            if not positions:
+                return result
+
+            symbols = list(dict.fromkeys(p['symbol'] for p in positions))
+            prices = self.build_price_matrix(symbols + [market_index], period)
+            if prices.empty:
+                return result
+
+            returns = self.build_returns_matrix(prices)
+            market_returns = returns[market_index] if market_index in returns else None
+            held = [s for s in symbols if s in returns]
+            if not held:
+                return result
+
+            asset_returns = returns[held]
+            values = asset_returns.to_numpy(dtype=float)
+
+            # Per-position annualized volatility and beta
+            counts = (~np.isnan(values)).sum(axis=0)
+            with np.errstate(invalid='ignore'):
+                volatilities = np.nanstd(values, axis=0, ddof=1) * np.sqrt(TRADING_DAYS) * 100
+            volatilities = np.where((counts > 1) & np.isfinite(volatilities), volatilities, 0.0)
+
+            if market_returns is not None:
+                market = market_returns.to_numpy(dtype=float)
+                betas = self._masked_beta(values, market)
+            else:
+                logger.warning(f"No market data available for beta calculation (index: {market_index})")
+                market = None
+                betas = np.ones(len(held))
+
+            for symbol, beta, volatility in zip(held, betas, volatilities):
+                result['positions'][symbol] = {
+                    'beta': round(float(beta), 2),
+                    'volatility': round(float(volatility), 2)
+                }
+
+            # Portfolio returns: value-weighted sum, assets without a bar that day contribute 0
+            value_by_symbol = {}
+            invested_total = 0.0
+            for p in positions:
+                value_by_symbol[p['symbol']] = value_by_symbol.get(p['symbol'], 0.0) + p['total_value']
+                invested_total += p.get('invested', 0)
+            total_value = sum(value_by_symbol.values())
+            if total_value <= 0:
+                return result
+
+            weights = np.array([value_by_symbol[s] / total_value for s in held])
+            traded = ~np.isnan(values).all(axis=1)
+            portfolio_returns = np.nan_to_num(values) @ weights
+
+            if traded.sum() > 1:
+                portfolio_vol = float(np.std(portfolio_returns[traded], ddof=1) * np.sqrt(TRADING_DAYS) * 100)
+                result['volatility'] = round(portfolio_vol, 2)
+
+            # Portfolio beta on the benchmark's trading days
+            if market is not None:
+                market_days = ~np.isnan(market)
+                if market_days.sum() > 1:
+                    portfolio_beta = self._masked_beta(
+                        portfolio_returns[market_days][:, None],
+                        market[market_days]
+                    )[0]
+                    result['beta'] = round(float(portfolio_beta), 2)
+
+            # Sharpe = (Return - Risk Free Rate) / Volatility
+            if invested_total > 0 and result['volatility'] > 0:
+                portfolio_return = (total_value - invested_total) / invested_total * 100
+                result['sharpe_ratio'] = round((portfolio_return - risk_free_rate) / result['volatility'], 2)
+
+            covariance = asset_returns.cov() * TRADING_DAYS
+            result['covariance'] = {
+                'symbols': held,
+                'matrix': np.round(covariance.fillna(0.0).to_numpy(), 6).tolist()
+            }
+            return result
+        except Exception as e:
+            logger.error(f"Error computing portfolio risk metrics: {str(e)}")
+            return result
@@ -0,0 +1,183 @@
+import os
+import math
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+from .risk_engine import TRADING_DAYS
+
+logger = logging.getLogger(__name__)
+
+# Daily returns in the rolling window of volatility alerts (one trading month)
+ALERT_VOLATILITY_WINDOW = int(os.environ.get('ALERT_VOLATILITY_WINDOW', '21'))
+
+
+class RollingVariance:
+    """Sample variance of the last `window` values, updated in O(1) per value (Welford add/remove)"""
+
+    def __init__(self, window: int):
+        self.window = window
+        self.values = deque()
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def _add(self, value: float):
+        n = len(self.values)
+        delta = value - self.mean
+        self.mean += delta / n
+        self.m2 += delta * (value - self.mean)
+
+    def _remove(self, value: float):
+        n = len(self.values)
+        if n == 0:
+            self.mean, self.m2 = 0.0, 0.0
+            return
+        delta = value - self.mean
+        self.mean -= delta / n
+        self.m2 = max(self.m2 - delta * (value - self.mean), 0.0)
+
+    def push(self, value: float):
+        """Append a value, evicting the oldest one beyond the window"""
+        self.values.append(value)
+        self._add(value)
+        if len(self.values) > self.window:
+            self._remove(self.values.popleft())
+
+    def replace_last(self, value: float):
+        """Replace the most recent value (e.g. the return of a bar still trading)"""
+        if not self.values:
+            self.push(value)
+            return
+        self._remove(self.values.pop())
+        self.values.append(value)
+        self._add(value)
+
+    @property
+    def variance(self) -> Optional[float]:
+        return self.m2 / (len(self.values) - 1) if len(self.values) > 1 else None
+
+
+class SymbolVolatility:
+    """Rolling daily returns of one symbol up to the bar of `last_date`"""
+
+    def __init__(self, window: int, last_date: str, last_close: float, previous_close: float):
+        self.returns = RollingVariance(window)
+        self.last_date = last_date
+        self.last_close = last_close
+        self.previous_close = previous_close
+
+    @property
+    def annualized(self) -> Optional[float]:
+        """Annualized volatility in %"""
+        variance = self.returns.variance
+        if variance is None:
+            return None
+        return round(math.sqrt(variance * TRADING_DAYS) * 100, 2)
+
+
+class RollingVolatilityTracker:
+    """
+    Rolling volatility of watched symbols, fed by quote ticks.
+
+    Each symbol is seeded once from PriceHistoryStore with the last `window` daily
+    returns. Afterwards a tick of the bar already in the window replaces its return
+    (intraday moves), and a tick of a new bar pushes a return and evicts the oldest,
+    so no history is re-read. A tick whose previous close does not match the last
+    known close (missed bars) is skipped: stale() lists those symbols so the caller
+    can reseed them. Reading history (fetch) is separate from changing the tracked
+    state (install, update), so callers can do the slow part outside their locks.
+    """
+
+    def __init__(self, price_history, window: int = ALERT_VOLATILITY_WINDOW):
+        self.price_history = price_history
+        self.window = window
+        self._symbols: Dict[str, SymbolVolatility] = {}
+
+    async def seed(self, symbols: Iterable[str], force: bool = False):
+        """Load the rolling window of symbols not tracked yet (or of all symbols if force)"""
+        self.install(await self.fetch(symbols, force))
+
+    def install(self, states: Dict[str, SymbolVolatility]):
+        """Track the rolling windows returned by fetch()"""
+        self._symbols.update(states)
+
+    async def fetch(self, symbols: Iterable[str], force: bool = False) -> Dict[str, SymbolVolatility]:
+        """Rolling windows of symbols not tracked yet (or of all symbols if force), built from stored history"""
+        symbols = [s for s in dict.fromkeys(symbols) if force or s not in self._symbols]
+        states = {}
+        if not symbols:
+            return states
+        # Calendar days covering window + 1 trading days, with room for holidays
+        start_date = datetime.utcnow() - timedelta(days=int(self.window * 7 / 5) + 15)
+        frames = await asyncio.gather(
+            *[self.price_history.get_history(symbol, start_date) for symbol in symbols],
+            return_exceptions=True
+        )
+        for symbol, hist_data in zip(symbols, frames):
+            if isinstance(hist_data, Exception) or hist_data is None or len(hist_data) < 2:
+                logger.warning(f"Not enough history to track the volatility of {symbol}")
+                continue
+            closes = hist_data['Close'].dropna()
+            closes = closes[~closes.index.duplicated(keep='last')]
+            if len(closes) < 2:
+                continue
+            state = SymbolVolatility(
+                self.window,
+                last_date=closes.index[-1].strftime('%Y-%m-%d'),
+                last_close=float(closes.iloc[-1]),
+                previous_close=float(closes.iloc[-2])
+            )
+            for value in closes.pct_change().dropna().iloc[-self.window:]:
+                state.returns.push(float(value))
+            states[symbol] = state
+        return states
+
+    def stale(self, quotes: Dict[str, Dict]) -> List[str]:
+        """Tracked symbols whose quote starts a bar that does not follow the last known close (missed bars)"""
+        stale = []
+        for symbol, quote in quotes.items():
+            state = self._symbols.get(symbol)
+            if state is None or not quote.get('date') or quote['date'] <= state.last_date:
+                continue
+            if not math.isclose(quote['previous_price'], state.last_close, rel_tol=1e-4):
+                stale.append(symbol)
+        return stale
+
+    def update(self, quotes: Dict[str, Dict]) -> Dict[str, float]:
+        """
+        Apply quote ticks ({symbol: quote with date, current_price, previous_price}); returns
+        the volatility of each tracked symbol. Stale ticks (see stale()) are skipped
+        """
+        for symbol, quote in quotes.items():
+            state = self._symbols.get(symbol)
+            if state is None or not quote.get('date'):
+                continue
+            if quote['date'] == state.last_date:
+                if state.previous_close > 0:
+                    state.returns.replace_last(quote['current_price'] / state.previous_close - 1)
+                state.last_close = quote['current_price']
+            elif quote['date'] > state.last_date:
+                if not math.isclose(quote['previous_price'], state.last_close, rel_tol=1e-4):
+                    continue
+                if quote['previous_price'] > 0:
+                    state.returns.push(quote['current_price'] / quote['previous_price'] - 1)
+                state.previous_close = quote['previous_price']
+                state.last_date = quote['date']
+                state.last_close = quote['current_price']
+
+        volatilities = {}
+        for symbol in quotes:
+            volatility = self.get(symbol)
+            if volatility is not None:
+                volatilities[symbol] = volatility
+        return volatilities
+
+    def get(self, symbol: str) -> Optional[float]:
+        state = self._symbols.get(symbol)
+        return state.annualized if state else None
+
+    def retain(self, symbols: List[str]):
+        """Stop tracking symbols not in symbols"""
+        for symbol in set(self._symbols) - set(symbols):
+            del self._symbols[symbol]
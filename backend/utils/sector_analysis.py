@@ -1,4 +1,3 @@
-import yfinance as yf
 import logging
 from typing import Dict, List
 
@@ -6,57 +5,36 @@ logger = logging.getLogger(__name__)
 
 class SectorAnalysisService:
     """Service for sector analysis and diversification"""
-    
+
     @staticmethod
-    def get_sector_info(symbol: str) -> Dict:
-        """Get sector information for a symbol"""
-        try:
-            ticker = yf.Ticker(symbol)
-            info = ticker.info
-            
-            return {
-                'symbol': symbol,
-                'sector': info.get('sector', 'Unknown'),
-                'industry': info.get('industry', 'Unknown')
-            }
-        except Exception as e:
-            logger.error(f"Error getting sector info for {symbol}: {str(e)}")
-            return {
-                'symbol': symbol,
-                'sector': 'Unknown',
-                'industry': 'Unknown'
-            }
-    
+    def get_sector(position: Dict, metadata: Dict[str, Dict]) -> str:
+        """Sector label of a position, from its type and the symbol metadata"""
+        if position['type'] == 'crypto':
+            return 'Cryptocurrency'
+        # ETFs don't have a single sector, display as "ETF (ticker)"
+        if position['type'] == 'etf':
+            return f"ETF ({position['symbol']})"
+
+        symbol_metadata = metadata.get(position['symbol']) or {}
+        sector = symbol_metadata.get('sector') or 'Unknown'
+        # If sector is Unknown for a stock, it might be an ETF or special asset
+        if sector == 'Unknown' and symbol_metadata.get('quote_type') == 'ETF':
+            return f"ETF ({position['symbol']})"
+        return sector
+
     @staticmethod
-    def calculate_sector_distribution(positions: List[Dict]) -> List[Dict]:
-        """Calculate sector distribution of portfolio"""
+    def calculate_sector_distribution(positions: List[Dict], metadata: Dict[str, Dict]) -> List[Dict]:
+        """
+        Calculate sector distribution of portfolio
+        metadata: symbol metadata ({symbol: {'sector', 'quote_type', ...}}, see SymbolMetadataStore)
+        """
         sector_values = {}
         total_value = sum(p['total_value'] for p in positions)
-        
+
         for position in positions:
-            if position['type'] == 'crypto':
-                sector = 'Cryptocurrency'
-            elif position['type'] == 'etf':
-                # ETFs don't have a single sector, display as "ETF (ticker)"
-                sector = f"ETF ({position['symbol']})"
-            else:
-                sector_info = SectorAnalysisService.get_sector_info(position['symbol'])
-                sector = sector_info['sector']
-                # If sector is Unknown for a stock, it might be an ETF or special asset
-                if sector == 'Unknown':
-                    # Check if it's actually an ETF by looking at quoteType
-                    try:
-                        ticker = yf.Ticker(position['symbol'])
-                        quote_type = ticker.info.get('quoteType', '')
-                        if quote_type == 'ETF':
-                            sector = f"ETF ({position['symbol']})"
-                    except:
-                        pass
-            
-            if sector not in sector_values:
-                sector_values[sector] = 0
-            sector_values[sector] += position['total_value']
-        
+            sector = SectorAnalysisService.get_sector(position, metadata)
+            sector_values[sector] = sector_values.get(sector, 0) + position['total_value']
+
         # Convert to percentage
         distribution = []
         for sector, value in sector_values.items():
@@ -66,8 +44,8 @@ class SectorAnalysisService:
                 'value': round(value, 2),
                 'percentage': round(percentage, 2)
             })
-        
+
         # Sort by percentage descending
         distribution.sort(key=lambda x: x['percentage'], reverse=True)
-        
+
         return distribution
@@ -0,0 +1,107 @@
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+from .keyed_locks import KeyedLocks
+
+logger = logging.getLogger(__name__)
+
+# Age after which a symbol's metadata is fetched again from Yahoo Finance (seconds, 30 days)
+SYMBOL_METADATA_TTL = int(os.environ.get('SYMBOL_METADATA_TTL', str(30 * 24 * 3600)))
+# Symbols kept in the in-process LRU
+SYMBOL_METADATA_CACHE_SIZE = int(os.environ.get('SYMBOL_METADATA_CACHE_SIZE', '5000'))
+
+METADATA_FIELDS = ('symbol', 'name', 'sector', 'industry', 'quote_type', 'currency')
+
+
+class SymbolMetadataStore:
+    """
+    Name, sector, industry, quote type and currency of symbols.
+
+    Reads go through an in-process LRU, then the `symbol_metadata` collection; only
+    symbols missing from both (or older than SYMBOL_METADATA_TTL) call yfinance's slow
+    `.info`, once per symbol even under concurrent requests. Unknown symbols are not
+    stored, so get() returning None also validates user input.
+    """
+
+    def __init__(self, db, market_data, ttl: int = SYMBOL_METADATA_TTL, max_entries: int = SYMBOL_METADATA_CACHE_SIZE):
+        self.collection = db.symbol_metadata
+        self.market_data = market_data
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._symbol_locks = KeyedLocks()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, symbol: str) -> Optional[Dict]:
+        metadata = self._entries.get(symbol)
+        if metadata is None:
+            return None
+        if self._expired(metadata):
+            del self._entries[symbol]
+            return None
+        self._entries.move_to_end(symbol)
+        return metadata
+
+    def _remember(self, metadata: Dict):
+        self._entries[metadata['symbol']] = metadata
+        self._entries.move_to_end(metadata['symbol'])
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _expired(self, metadata: Dict) -> bool:
+        return metadata['fetched_at'] <= datetime.utcnow() - timedelta(seconds=self.ttl)
+
+    async def get(self, symbol: str) -> Optional[Dict]:
+        """Metadata of symbol, or None if Yahoo Finance does not know it"""
+        return (await self.get_many([symbol])).get(symbol)
+
+    async def get_many(self, symbols: Iterable[str]) -> Dict[str, Dict]:
+        """Metadata of several symbols: memory first, then one database query, then yfinance for the rest"""
+        symbols = [s for s in dict.fromkeys(symbols) if s]
+        found = {}
+        for symbol in symbols:
+            metadata = self._cached(symbol)
+            if metadata is not None:
+                found[symbol] = metadata
+        self.hits += len(found)
+
+        missing = [s for s in symbols if s not in found]
+        if missing:
+            async for doc in self.collection.find({"symbol": {"$in": missing}}, {"_id": 0}):
+                if not self._expired(doc):
+                    self._remember(doc)
+                    found[doc['symbol']] = doc
+
+        to_fetch = [s for s in missing if s not in found]
+        self.misses += len(to_fetch)
+        if to_fetch:
+            fetched = await asyncio.gather(*[self._fetch(symbol) for symbol in to_fetch])
+            found.update({symbol: metadata for symbol, metadata in zip(to_fetch, fetched) if metadata})
+        return found
+
+    async def _fetch(self, symbol: str) -> Optional[Dict]:
+        async with self._symbol_locks.hold(symbol):
+            # Another request may have fetched it while we waited
+            metadata = self._cached(symbol)
+            if metadata is not None:
+                return metadata
+
+            metadata = await self.market_data.get_symbol_metadata(symbol)
+            if metadata is None:
+                return None
+            metadata = {**{k: metadata.get(k) for k in METADATA_FIELDS}, 'fetched_at': datetime.utcnow()}
+            await self.collection.update_one({"symbol": symbol}, {"$set": metadata}, upsert=True)
+            self._remember(metadata)
+            return metadata
+
+    def stats(self) -> Dict:
+        return {
+            'symbols': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'ttl_seconds': self.ttl
+        }
@@ -0,0 +1,486 @@
+import uuid
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from models import Position, Transaction, CashTransaction
+
+logger = logging.getLogger(__name__)
+
+# Remaining quantities below this close the position (float residue of partial sells)
+QUANTITY_EPSILON = 1e-9
+# Attempts at a transactional booking aborted by a concurrent first insert of the same position or cash account
+BOOKING_ATTEMPTS = 3
+
+
+class TradeRejected(Exception):
+    """A trade that cannot be booked (no position, insufficient quantity); the message is user-facing"""
+
+
+class TradeConflict(Exception):
+    """Positions changed between the read and the write of a batch (the transaction is aborted, nothing is written)"""
+
+
+def _is_duplicate_key(error: BulkWriteError) -> bool:
+    return any(e.get('code') == 11000 for e in error.details.get('writeErrors', []))
+
+
+class TradeBookingService:
+    """
+    Books a buy or sell in one atomic pass.
+
+    Every write is a single atomic update instead of a read-modify-write: the position
+    is upserted with an update pipeline computing the new quantity and weighted average
+    price from the stored values, a sell is a conditional $inc (quantity >= sold), and
+    the cash account is an upserted $inc. Unique indexes on (user, portfolio, symbol)
+    and (user, portfolio, currency) make concurrent first trades converge on one
+    document: the losing upsert is retried as an update. On a replica set (or mongos)
+    the writes of a trade run in one multi-document transaction, retried on transient
+    errors; on a standalone server each write stays atomic on its own.
+    """
+
+    def __init__(self, client, db):
+        self.client = client
+        self.db = db
+        self._transactions_supported: Optional[bool] = None
+
+    async def supports_transactions(self) -> bool:
+        if self._transactions_supported is None:
+            try:
+                hello = await self.client.admin.command('hello')
+                self._transactions_supported = bool(hello.get('setName')) or hello.get('msg') == 'isdbgrid'
+            except OperationFailure as e:
+                logger.warning(f"Could not detect replica set, booking trades without transactions: {str(e)}")
+                self._transactions_supported = False
+        return self._transactions_supported
+
+    async def book(self, trade: Dict) -> Dict:
+        """
+        Book a trade: {user_id, portfolio_id, symbol, name, type, side ('buy'|'sell'), quantity,
+        price, date, link_to_cash, cash_currency}.
+        Returns {position_id, old_quantity, quantity, avg_price, created, closed, new_balance}
+        """
+        if not await self.supports_transactions():
+            return await self._apply(trade, None)
+        return await self._in_transaction(lambda s: self._apply(trade, s))
+
+    async def _in_transaction(self, callback):
+        """
+        Run callback(session) in a transaction. A duplicate key (concurrent first insert of
+        the same position or cash account) aborts the whole transaction: it is run again
+        from the start, up to BOOKING_ATTEMPTS times
+        """
+        for attempt in range(1, BOOKING_ATTEMPTS + 1):
+            try:
+                async with await self.client.start_session() as session:
+                    return await session.with_transaction(callback)
+            except (DuplicateKeyError, BulkWriteError) as e:
+                if (isinstance(e, BulkWriteError) and not _is_duplicate_key(e)) or attempt == BOOKING_ATTEMPTS:
+                    raise
+                logger.info(f"Concurrent first insert during a booking, retrying (attempt {attempt})")
+
+    async def _upsert(self, collection, query: Dict, update, session, **kwargs) -> Optional[Dict]:
+        """
+        find_one_and_update with upsert=True. Outside a transaction, losing a race to insert
+        the same key (unique index) is retried once: the second attempt matches the winner
+        """
+        try:
+            return await collection.find_one_and_update(query, update, upsert=True, session=session, **kwargs)
+        except DuplicateKeyError:
+            if session is not None:
+                raise
+            return await collection.find_one_and_update(query, update, upsert=True, **kwargs)
+
+    async def _apply(self, trade: Dict, session) -> Dict:
+        if trade['side'] == 'sell':
+            result = await self._sell(trade, session)
+        else:
+            result = await self._buy(trade, session)
+
+        total = trade['quantity'] * trade['price']
+        await self.db.transactions.insert_one(self._transaction_doc(trade), session=session)
+
+        result['new_balance'] = None
+        if trade['link_to_cash']:
+            result['new_balance'] = await self._move_cash(trade, total if trade['side'] == 'sell' else -total, session)
+        return result
+
+    @staticmethod
+    def _buy_pipeline(trade: Dict, position_id: str, now: datetime) -> List[Dict]:
+        """
+        Update pipeline adding a buy to the position (created with position_id if missing):
+        quantity += bought, avg_price = weighted average of the held and bought lots
+        """
+        quantity, price = trade['quantity'], trade['price']
+        held = {"$ifNull": ["$quantity", 0]}
+        total_quantity = {"$add": [held, quantity]}
+        # All expressions of one $set stage read the stored (pre-update) values
+        return [{"$set": {
+            "avg_price": {"$cond": [
+                {"$gt": [total_quantity, 0]},
+                {"$round": [{"$divide": [
+                    {"$add": [{"$multiply": [held, {"$ifNull": ["$avg_price", 0]}]}, quantity * price]},
+                    total_quantity
+                ]}, 4]},
+                price
+            ]},
+            "quantity": total_quantity,
+            "updated_at": now,
+            "id": {"$ifNull": ["$id", {"$literal": position_id}]},
+            "name": {"$ifNull": ["$name", {"$literal": trade['name']}]},
+            "type": {"$ifNull": ["$type", {"$literal": trade['type']}]},
+            "purchase_date": {"$ifNull": ["$purchase_date", trade['date']]},
+            "created_at": {"$ifNull": ["$created_at", now]}
+        }}]
+
+    async def _buy(self, trade: Dict, session) -> Dict:
+        quantity, price = trade['quantity'], trade['price']
+        position_id = str(uuid.uuid4())
+        before = await self._upsert(
+            self.db.positions,
+            {"user_id": trade['user_id'], "portfolio_id": trade['portfolio_id'], "symbol": trade['symbol']},
+            self._buy_pipeline(trade, position_id, datetime.utcnow()),
+            session,
+            return_document=ReturnDocument.BEFORE
+        )
+
+        if before is None:
+            return {
+                'position_id': position_id, 'old_quantity': 0.0, 'quantity': quantity,
+                'avg_price': price, 'created': True, 'closed': False
+            }
+
+        old_quantity = before['quantity']
+        total = old_quantity + quantity
+        avg_price = round((old_quantity * before['avg_price'] + quantity * price) / total, 4) if total > 0 else price
+        return {
+            'position_id': before['id'], 'old_quantity': old_quantity, 'quantity': total,
+            'avg_price': avg_price, 'created': False, 'closed': False
+        }
+
+    async def _sell(self, trade: Dict, session) -> Dict:
+        query = {"user_id": trade['user_id'], "portfolio_id": trade['portfolio_id'], "symbol": trade['symbol']}
+        quantity = trade['quantity']
+        after = await self.db.positions.find_one_and_update(
+            {**query, "quantity": {"$gte": quantity}},
+            {"$inc": {"quantity": -quantity}, "$set": {"updated_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if after is None:
+            position = await self.db.positions.find_one(query, {"_id": 0, "quantity": 1}, session=session)
+            if position is None:
+                raise TradeRejected(f"Vous ne détenez pas de position sur {trade['symbol']}")
+            raise TradeRejected(f"Quantité insuffisante. Vous détenez {position['quantity']} unités de {trade['symbol']}")
+
+        closed = after['quantity'] <= QUANTITY_EPSILON
+        if closed:
+            # Position completely sold - delete it (unless a concurrent buy refilled it)
+            await self.db.positions.delete_one(
+                {"id": after['id'], "quantity": {"$lte": QUANTITY_EPSILON}}, session=session
+            )
+        return {
+            'position_id': after['id'], 'old_quantity': after['quantity'] + quantity,
+            'quantity': 0.0 if closed else after['quantity'], 'avg_price': after['avg_price'],
+            'created': False, 'closed': closed
+        }
+
+    async def book_buys(self, trades: List[Dict]) -> int:
+        """
+        Book many buys without cash movements (imports). Lots of the same position are
+        netted into one buy (total quantity, weighted average price, earliest date) and
+        added to the stored position with the same upsert pipeline as book(), one
+        bulk_write for all positions; every lot keeps its own ledger entry.
+        Returns the number of positions written
+        """
+        if not trades:
+            return 0
+        if await self.supports_transactions():
+            return await self._in_transaction(lambda s: self._apply_buys(trades, s))
+        return await self._apply_buys(trades, None)
+
+    async def _apply_buys(self, trades: List[Dict], session) -> int:
+        now = datetime.utcnow()
+        netted: Dict[Tuple[str, str, str], Dict] = {}
+        for trade in trades:
+            key = (trade['user_id'], trade['portfolio_id'], trade['symbol'])
+            lot = netted.get(key)
+            if lot is None:
+                netted[key] = {**trade, 'cost': trade['quantity'] * trade['price']}
+                continue
+            lot['quantity'] += trade['quantity']
+            lot['cost'] += trade['quantity'] * trade['price']
+            lot['date'] = min(lot['date'], trade['date'])
+
+        operations = []
+        for (user_id, portfolio_id, symbol), lot in netted.items():
+            lot['price'] = lot['cost'] / lot['quantity'] if lot['quantity'] > 0 else 0.0
+            operations.append(UpdateOne(
+                {"user_id": user_id, "portfolio_id": portfolio_id, "symbol": symbol},
+                self._buy_pipeline(lot, str(uuid.uuid4()), now),
+                upsert=True
+            ))
+        await self._bulk_upsert(self.db.positions, operations, session)
+        await self.db.transactions.insert_many([self._transaction_doc(t) for t in trades], session=session)
+        return len(operations)
+
+    async def _bulk_upsert(self, collection, operations: List, session):
+        """
+        Unordered bulk_write of upserts. Outside a transaction, the operations that lost a
+        race to insert the same key (unique index) are retried once, as updates of the winner
+        """
+        try:
+            return await collection.bulk_write(operations, ordered=False, session=session)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if session is not None or not errors or not all(err.get('code') == 11000 for err in errors):
+                raise
+            return await collection.bulk_write([operations[err['index']] for err in errors], ordered=False)
+
+    async def book_batch(self, trades: List[Dict]) -> Dict:
+        """
+        Book many trades (same shape as book()) with a handful of round-trips: the
+        positions involved are read at once, the legs are applied in order in memory
+        (each sell checked against the quantity held at that point), and the netted
+        result is written with one bulk_write per collection, all in one transaction.
+        On a standalone server, where the netted writes could not be rolled back, each
+        leg is booked on its own with book()'s atomic updates instead.
+        Returns {results: per-leg results in input order, positions, cash_balances}
+        """
+        if await self.supports_transactions():
+            return await self._in_transaction(lambda s: self._apply_batch(trades, s))
+        return await self._apply_legs(trades)
+
+    async def _apply_legs(self, trades: List[Dict]) -> Dict:
+        """book_batch without transactions: one atomic booking per leg, in order"""
+        results = []
+        positions: Dict[Tuple[str, str, str], Dict] = {}
+        cash_balances: Dict[Tuple[str, str, str], Dict] = {}
+        for index, trade in enumerate(trades):
+            try:
+                booked = await self._apply(trade, None)
+            except TradeRejected as e:
+                results.append({'index': index, 'symbol': trade['symbol'], 'side': trade['side'], 'status': 'rejected', 'error': str(e)})
+                continue
+            quantity = 0.0 if booked['closed'] else booked['quantity']
+            results.append({
+                'index': index, 'symbol': trade['symbol'], 'side': trade['side'], 'status': 'booked',
+                'quantity': quantity, 'avg_price': booked['avg_price'], 'closed': booked['closed']
+            })
+            positions[(trade['user_id'], trade['portfolio_id'], trade['symbol'])] = {
+                'portfolio_id': trade['portfolio_id'], 'symbol': trade['symbol'],
+                'quantity': quantity, 'avg_price': booked['avg_price']
+            }
+            if booked['new_balance'] is not None:
+                cash_balances[(trade['user_id'], trade['portfolio_id'], trade['cash_currency'])] = {
+                    'portfolio_id': trade['portfolio_id'], 'currency': trade['cash_currency'],
+                    'balance': round(booked['new_balance'], 2)
+                }
+        return {'results': results, 'positions': list(positions.values()), 'cash_balances': list(cash_balances.values())}
+
+    async def _apply_batch(self, trades: List[Dict], session) -> Dict:
+        now = datetime.utcnow()
+        user_ids = {t['user_id'] for t in trades}
+        stored = await self.db.positions.find(
+            {
+                "user_id": {"$in": list(user_ids)},
+                "portfolio_id": {"$in": list({t['portfolio_id'] for t in trades})},
+                "symbol": {"$in": list({t['symbol'] for t in trades})}
+            },
+            {"_id": 0},
+            session=session
+        ).to_list(None)
+
+        # In-memory state per (user, portfolio, symbol); the first stored duplicate wins, as in find_one
+        states: Dict[Tuple[str, str, str], Dict] = {}
+        for position in stored:
+            key = (position['user_id'], position['portfolio_id'], position['symbol'])
+            if key not in states:
+                states[key] = {'stored': position, 'quantity': position['quantity'], 'avg_price': position['avg_price'], 'first_trade': None}
+
+        results, booked, touched = [], [], set()
+        for index, trade in enumerate(trades):
+            key = (trade['user_id'], trade['portfolio_id'], trade['symbol'])
+            state = states.get(key)
+            if state is None and trade['side'] == 'buy':
+                state = states[key] = {'stored': None, 'quantity': 0.0, 'avg_price': trade['price'], 'first_trade': trade}
+            try:
+                result = self._apply_leg(state, trade)
+            except TradeRejected as e:
+                results.append({'index': index, 'symbol': trade['symbol'], 'side': trade['side'], 'status': 'rejected', 'error': str(e)})
+                continue
+            booked.append(trade)
+            touched.add(key)
+            results.append({'index': index, 'symbol': trade['symbol'], 'side': trade['side'], 'status': 'booked', **result})
+
+        position_ops, expected_matches = self._netted_position_ops(states, now)
+        if position_ops:
+            written = await self.db.positions.bulk_write(position_ops, ordered=True, session=session)
+            # Raising inside the transaction aborts it: none of the writes are applied
+            if written.matched_count + written.deleted_count < expected_matches:
+                raise TradeConflict("Les positions ont été modifiées pendant l'opération, veuillez réessayer")
+
+        cash_balances = []
+        if booked:
+            await self.db.transactions.insert_many([self._transaction_doc(t) for t in booked], session=session)
+            cash_balances = await self._move_cash_batch([t for t in booked if t['link_to_cash']], now, session)
+
+        positions = [
+            {
+                'portfolio_id': portfolio_id,
+                'symbol': symbol,
+                'quantity': 0.0 if state['quantity'] <= QUANTITY_EPSILON else state['quantity'],
+                'avg_price': state['avg_price']
+            }
+            for (user_id, portfolio_id, symbol), state in states.items()
+            if (user_id, portfolio_id, symbol) in touched
+        ]
+        return {'results': results, 'positions': positions, 'cash_balances': cash_balances}
+
+    @staticmethod
+    def _apply_leg(state: Optional[Dict], trade: Dict) -> Dict:
+        """Apply one leg to the in-memory state of its position (same rules as book())"""
+        quantity, price = trade['quantity'], trade['price']
+        held = state['quantity'] if state else 0.0
+        if trade['side'] == 'sell':
+            if state is None or held <= QUANTITY_EPSILON:
+                raise TradeRejected(f"Vous ne détenez pas de position sur {trade['symbol']}")
+            if quantity > held:
+                raise TradeRejected(f"Quantité insuffisante. Vous détenez {held} unités de {trade['symbol']}")
+            state['quantity'] = held - quantity
+        else:
+            total = held + quantity
+            state['avg_price'] = round((held * state['avg_price'] + quantity * price) / total, 4) if total > 0 else price
+            state['quantity'] = total
+        return {
+            'quantity': 0.0 if state['quantity'] <= QUANTITY_EPSILON else state['quantity'],
+            'avg_price': state['avg_price'],
+            'closed': state['quantity'] <= QUANTITY_EPSILON
+        }
+
+    @staticmethod
+    def _netted_position_ops(states: Dict[Tuple[str, str, str], Dict], now: datetime) -> Tuple[List, int]:
+        """
+        One write per position touched by the batch. Updates and deletes are pinned to the
+        values read, so a concurrent change is detected instead of overwritten; returns
+        (operations, number of pinned operations)
+        """
+        operations, pinned = [], 0
+        for (user_id, portfolio_id, symbol), state in states.items():
+            stored = state['stored']
+            closed = state['quantity'] <= QUANTITY_EPSILON
+            if stored is None:
+                trade = state['first_trade']
+                if trade is None or closed:
+                    continue
+                operations.append(InsertOne(Position(
+                    user_id=user_id,
+                    portfolio_id=portfolio_id,
+                    symbol=symbol,
+                    name=trade['name'],
+                    type=trade['type'],
+                    quantity=state['quantity'],
+                    avg_price=state['avg_price'],
+                    purchase_date=trade['date'],
+                    created_at=now,
+                    updated_at=now
+                ).dict()))
+                continue
+            if state['quantity'] == stored['quantity'] and state['avg_price'] == stored['avg_price']:
+                continue
+            pin = {"id": stored['id'], "quantity": stored['quantity'], "avg_price": stored['avg_price']}
+            if closed:
+                operations.append(DeleteOne(pin))
+            else:
+                operations.append(UpdateOne(pin, {"$set": {
+                    "quantity": state['quantity'], "avg_price": state['avg_price'], "updated_at": now
+                }}))
+            pinned += 1
+        return operations, pinned
+
+    async def _move_cash_batch(self, trades: List[Dict], now: datetime, session) -> List[Dict]:
+        """Net cash of linked trades per account, applied with one bulk $inc; returns the new balances"""
+        if not trades:
+            return []
+        amounts: Dict[Tuple[str, str, str], float] = {}
+        movements = []
+        for trade in trades:
+            amount = trade['quantity'] * trade['price'] * (1 if trade['side'] == 'sell' else -1)
+            key = (trade['user_id'], trade['portfolio_id'], trade['cash_currency'])
+            amounts[key] = amounts.get(key, 0.0) + amount
+            movements.append(self._cash_movement_doc(trade, amount, now))
+
+        await self.db.cash_accounts.bulk_write([
+            UpdateOne(
+                {"user_id": user_id, "portfolio_id": portfolio_id, "currency": currency},
+                {
+                    "$inc": {"balance": amount},
+                    "$set": {"updated_at": now},
+                    "$setOnInsert": {"id": str(uuid.uuid4()), "created_at": now}
+                },
+                upsert=True
+            )
+            for (user_id, portfolio_id, currency), amount in amounts.items()
+        ], ordered=False, session=session)
+        await self.db.cash_transactions.insert_many(movements, session=session)
+
+        accounts = await self.db.cash_accounts.find(
+            {"$or": [
+                {"user_id": user_id, "portfolio_id": portfolio_id, "currency": currency}
+                for user_id, portfolio_id, currency in amounts
+            ]},
+            {"_id": 0, "portfolio_id": 1, "currency": 1, "balance": 1},
+            session=session
+        ).to_list(None)
+        return [
+            {'portfolio_id': a['portfolio_id'], 'currency': a['currency'], 'balance': round(a['balance'], 2)}
+            for a in accounts
+        ]
+
+    async def _move_cash(self, trade: Dict, amount: float, session) -> float:
+        """Credit (sale) or debit (purchase) the linked cash account and log the movement; returns the new balance"""
+        now = datetime.utcnow()
+        currency = trade['cash_currency']
+        account = await self._upsert(
+            self.db.cash_accounts,
+            {"user_id": trade['user_id'], "portfolio_id": trade['portfolio_id'], "currency": currency},
+            {
+                "$inc": {"balance": amount},
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"id": str(uuid.uuid4()), "created_at": now}
+            },
+            session,
+            return_document=ReturnDocument.AFTER
+        )
+
+        await self.db.cash_transactions.insert_one(self._cash_movement_doc(trade, amount, now), session=session)
+        return account['balance']
+
+    @staticmethod
+    def _transaction_doc(trade: Dict) -> Dict:
+        """Ledger entry of a trade"""
+        transaction = Transaction(
+            user_id=trade['user_id'],
+            symbol=trade['symbol'],
+            type=trade['side'],
+            quantity=trade['quantity'],
+            price=trade['price'],
+            total=trade['quantity'] * trade['price'],
+            date=trade['date']
+        )
+        return {**transaction.dict(), "portfolio_id": trade['portfolio_id']}
+
+    @staticmethod
+    def _cash_movement_doc(trade: Dict, amount: float, now: datetime) -> Dict:
+        """Automatic cash transaction of a trade linked to cash (amount: + sale, - purchase)"""
+        action = "Vente" if amount > 0 else "Achat"
+        cash_transaction = CashTransaction(
+            user_id=trade['user_id'],
+            type="deposit" if amount > 0 else "withdrawal",
+            amount=abs(amount),
+            description=f"{action} {trade['quantity']} x {trade['symbol']} à {trade['price']}€",
+            date=trade['date'],
+            created_at=now
+        )
+        return {**cash_transaction.dict(), "currency": trade['cash_currency'], "portfolio_id": trade['portfolio_id']}
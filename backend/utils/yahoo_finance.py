@@ -1,20 +1,94 @@
 import yfinance as yf
 import pandas as pd
 import numpy as np
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 from datetime import datetime, timedelta
 import logging
+from .history_cache import history_cache
 
 logger = logging.getLogger(__name__)
 
-# Cache for exchange rates (to avoid too many API calls)
-_exchange_rate_cache = {}
-_cache_timestamp = None
+# Cache for exchange rates (to avoid too many API calls): pair (e.g. "USDEUR") -> (rate, fetched_at)
+_exchange_rate_cache: Dict[str, Tuple[float, datetime]] = {}
 CACHE_DURATION = 300  # 5 minutes
+# Currencies used to derive cross rates from cached pairs (e.g. USD->GBP via EUR)
+FX_PIVOT_CURRENCIES = ('EUR', 'USD')
 
 class YahooFinanceService:
     """Service for fetching data from Yahoo Finance"""
     
+    @staticmethod
+    def _fresh_rate(from_currency: str, to_currency: str, now: datetime) -> Optional[float]:
+        """Cached rate for a pair, derived from the inverse pair if needed (None if absent or expired)"""
+        for pair, inverse in ((f"{from_currency}{to_currency}", False), (f"{to_currency}{from_currency}", True)):
+            entry = _exchange_rate_cache.get(pair)
+            if entry and (now - entry[1]).total_seconds() < CACHE_DURATION and entry[0] > 0:
+                return 1.0 / entry[0] if inverse else entry[0]
+        return None
+    
+    @staticmethod
+    def _cached_rate(from_currency: str, to_currency: str, now: datetime) -> Optional[float]:
+        """Cached rate for a pair: direct, inverse, or cross rate through a pivot currency"""
+        rate = YahooFinanceService._fresh_rate(from_currency, to_currency, now)
+        if rate is not None:
+            return rate
+        
+        for pivot in FX_PIVOT_CURRENCIES:
+            if pivot in (from_currency, to_currency):
+                continue
+            first_leg = YahooFinanceService._fresh_rate(from_currency, pivot, now)
+            second_leg = YahooFinanceService._fresh_rate(pivot, to_currency, now)
+            if first_leg is not None and second_leg is not None:
+                return first_leg * second_leg
+        return None
+    
+    @staticmethod
+    def get_exchange_rates(from_currencies: List[str], to_currency: str = 'EUR') -> Dict[str, float]:
+        """
+        Get exchange rates from several currencies to one currency.
+        Pairs missing from the cache are refreshed together in a single bulk download.
+        Returns {from_currency: rate}; unavailable rates fall back to 1.0.
+        """
+        to_currency = to_currency.upper()
+        now = datetime.now()
+        rates = {}
+        missing = []
+        
+        for currency in dict.fromkeys(c.upper() for c in from_currencies if c):
+            if currency == to_currency:
+                # Same currency = no conversion needed
+                rates[currency] = 1.0
+                continue
+            cached = YahooFinanceService._cached_rate(currency, to_currency, now)
+            if cached is not None:
+                rates[currency] = cached
+            else:
+                missing.append(currency)
+        
+        if missing:
+            try:
+                # Yahoo Finance format for forex: USDEUR=X
+                symbols = [f"{currency}{to_currency}=X" for currency in missing]
+                closes = YahooFinanceService._download_closes(symbols, period='5d')
+                
+                for currency, symbol in zip(missing, symbols):
+                    series = closes[symbol].dropna() if symbol in closes else pd.Series(dtype=float)
+                    if series.empty:
+                        logger.warning(f"No exchange rate data for {symbol}, using 1.0")
+                        rates[currency] = 1.0
+                        continue
+                    
+                    rate = float(series.iloc[-1])
+                    _exchange_rate_cache[f"{currency}{to_currency}"] = (rate, now)
+                    rates[currency] = rate
+                    logger.info(f"Exchange rate {currency}->{to_currency}: {rate}")
+            except Exception as e:
+                logger.error(f"Error fetching exchange rates {missing}->{to_currency}: {str(e)}")
+                for currency in missing:
+                    rates.setdefault(currency, 1.0)
+        
+        return rates
+    
     @staticmethod
     def get_exchange_rate(from_currency: str, to_currency: str = 'EUR') -> float:
         """
@@ -22,42 +96,8 @@ class YahooFinanceService:
         Returns the rate to multiply by to convert from_currency to to_currency.
         Example: get_exchange_rate('USD', 'EUR') returns ~0.92 (1 USD = 0.92 EUR)
         """
-        global _exchange_rate_cache, _cache_timestamp
-        
-        # Same currency = no conversion needed
-        if from_currency.upper() == to_currency.upper():
-            return 1.0
-        
-        cache_key = f"{from_currency.upper()}{to_currency.upper()}"
-        
-        # Check cache
-        now = datetime.now()
-        if _cache_timestamp and (now - _cache_timestamp).seconds < CACHE_DURATION:
-            if cache_key in _exchange_rate_cache:
-                return _exchange_rate_cache[cache_key]
-        
-        try:
-            # Yahoo Finance format for forex: USDEUR=X
-            symbol = f"{from_currency.upper()}{to_currency.upper()}=X"
-            ticker = yf.Ticker(symbol)
-            data = ticker.history(period='1d')
-            
-            if data.empty:
-                logger.warning(f"No exchange rate data for {symbol}, using 1.0")
-                return 1.0
-            
-            rate = float(data['Close'].iloc[-1])
-            
-            # Update cache
-            _exchange_rate_cache[cache_key] = rate
-            _cache_timestamp = now
-            
-            logger.info(f"Exchange rate {from_currency}->{to_currency}: {rate}")
-            return rate
-            
-        except Exception as e:
-            logger.error(f"Error fetching exchange rate {from_currency}->{to_currency}: {str(e)}")
-            return 1.0
+        rates = YahooFinanceService.get_exchange_rates([from_currency], to_currency)
+        return rates.get(from_currency.upper(), 1.0)
     
     @staticmethod
     def convert_to_eur(amount: float, from_currency: str) -> float:
@@ -80,6 +120,97 @@ class YahooFinanceService:
             logger.error(f"Error fetching price for {symbol}: {str(e)}")
             return None
     
+    @staticmethod
+    def _download_closes(symbols: List[str], period: str = '5d') -> pd.DataFrame:
+        """Download closing prices for several symbols in a single request (one column per symbol)"""
+        data = yf.download(
+            symbols,
+            period=period,
+            auto_adjust=True,
+            group_by='column',
+            progress=False,
+            threads=True
+        )
+        if data is None or data.empty:
+            return pd.DataFrame()
+        
+        closes = data['Close']
+        # A single ticker may come back as a Series depending on the yfinance version
+        if isinstance(closes, pd.Series):
+            closes = closes.to_frame(name=symbols[0])
+        return closes
+    
+    @staticmethod
+    def get_current_prices(symbols: List[str]) -> Dict[str, float]:
+        """
+        Get current prices for several symbols with one bulk download.
+        Symbols without data are left out of the result, so callers can fall back
+        to their own default (e.g. the average price of the position).
+        """
+        unique_symbols = list(dict.fromkeys(s for s in symbols if s))
+        if not unique_symbols:
+            return {}
+        
+        try:
+            closes = YahooFinanceService._download_closes(unique_symbols, period='5d')
+            prices = {}
+            for symbol in unique_symbols:
+                if symbol not in closes:
+                    continue
+                # Crypto trades on weekends, stocks don't: use the last valid close of each column
+                series = closes[symbol].dropna()
+                if not series.empty:
+                    prices[symbol] = float(series.iloc[-1])
+            return prices
+        except Exception as e:
+            logger.error(f"Error fetching prices for {len(unique_symbols)} symbols: {str(e)}")
+            return {}
+    
+    @staticmethod
+    def get_daily_changes(symbols: List[str]) -> Dict[str, Dict]:
+        """Get daily price changes for several symbols with one bulk download"""
+        unique_symbols = list(dict.fromkeys(s for s in symbols if s))
+        if not unique_symbols:
+            return {}
+        
+        try:
+            closes = YahooFinanceService._download_closes(unique_symbols, period='5d')
+            changes = {}
+            for symbol in unique_symbols:
+                if symbol not in closes:
+                    continue
+                series = closes[symbol].dropna()
+                if series.empty:
+                    continue
+                
+                current_price = float(series.iloc[-1])
+                # Trading day of the latest bar
+                bar_date = series.index[-1].strftime('%Y-%m-%d')
+                if len(series) < 2:
+                    changes[symbol] = {
+                        'current_price': current_price,
+                        'previous_price': current_price,
+                        'price_change': 0.0,
+                        'change_percent': 0.0,
+                        'date': bar_date
+                    }
+                    continue
+                
+                previous_price = float(series.iloc[-2])
+                price_change = current_price - previous_price
+                change_percent = (price_change / previous_price * 100) if previous_price > 0 else 0
+                changes[symbol] = {
+                    'current_price': current_price,
+                    'previous_price': previous_price,
+                    'price_change': price_change,
+                    'change_percent': change_percent,
+                    'date': bar_date
+                }
+            return changes
+        except Exception as e:
+            logger.error(f"Error fetching daily changes for {len(unique_symbols)} symbols: {str(e)}")
+            return {}
+    
     @staticmethod
     def get_ticker_info(symbol: str) -> Optional[Dict]:
         """Get ticker information"""
@@ -98,13 +229,33 @@ class YahooFinanceService:
             logger.error(f"Error fetching info for {symbol}: {str(e)}")
             return None
     
+    @staticmethod
+    def get_symbol_metadata(symbol: str) -> Optional[Dict]:
+        """Static description of a symbol (name, sector, industry, quote type, currency), None if unknown"""
+        try:
+            info = yf.Ticker(symbol).info
+            if not info or not (info.get('quoteType') or info.get('longName') or info.get('shortName')):
+                return None
+            return {
+                'symbol': symbol,
+                'name': info.get('longName', info.get('shortName', symbol)),
+                'sector': info.get('sector', 'Unknown'),
+                'industry': info.get('industry', 'Unknown'),
+                'quote_type': info.get('quoteType', ''),
+                'currency': info.get('currency', '')
+            }
+        except Exception as e:
+            logger.error(f"Error fetching metadata for {symbol}: {str(e)}")
+            return None
+    
     @staticmethod
     def get_historical_data(symbol: str, period: str = '1y') -> Optional[pd.DataFrame]:
-        """Get historical data for a symbol"""
+        """Get historical data for a symbol (served from the shared history cache)"""
         try:
-            ticker = yf.Ticker(symbol)
-            data = ticker.history(period=period)
-            return data
+            return history_cache.get_or_load(
+                (symbol, period),
+                lambda: yf.Ticker(symbol).history(period=period)
+            )
         except Exception as e:
             logger.error(f"Error fetching historical data for {symbol}: {str(e)}")
             return None
@@ -113,7 +264,6 @@ class YahooFinanceService:
     def get_historical_data_by_dates(symbol: str, start_date: datetime, end_date: datetime = None) -> Optional[pd.DataFrame]:
         """Get historical data for a symbol between specific dates"""
         try:
-            ticker = yf.Ticker(symbol)
             if end_date is None:
                 end_date = datetime.now()
             
@@ -121,8 +271,10 @@ class YahooFinanceService:
             start_str = start_date.strftime('%Y-%m-%d')
             end_str = end_date.strftime('%Y-%m-%d')
             
-            data = ticker.history(start=start_str, end=end_str)
-            return data
+            return history_cache.get_or_load(
+                (symbol, start_str, end_str),
+                lambda: yf.Ticker(symbol).history(start=start_str, end=end_str)
+            )
         except Exception as e:
             logger.error(f"Error fetching historical data for {symbol} ({start_date} to {end_date}): {str(e)}")
             return None
@@ -199,8 +351,7 @@ class YahooFinanceService:
     def get_market_data(symbol: str = '^GSPC', period: str = '1y') -> Optional[pd.Series]:
         """Get market index data (default S&P 500)"""
         try:
-            ticker = yf.Ticker(symbol)
-            data = ticker.history(period=period)
+            data = YahooFinanceService.get_historical_data(symbol, period)
             return data['Close']
         except Exception as e:
             logger.error(f"Error fetching market data: {str(e)}")
@@ -56,6 +56,13 @@ export const portfolioAPI = {
     const response = await axios.get(url);
     return response.data;
   },
+  getDashboard: async (userId, portfolioId = null, refresh = false) => {
+    let url = `${API}/dashboard?user_id=${userId}`;
+    if (portfolioId) url += `&portfolio_id=${portfolioId}`;
+    if (refresh) url += `&refresh=true`;
+    const response = await axios.get(url);
+    return response.data;
+  },
   getPositions: async (userId, portfolioId = null) => {
     let url = `${API}/positions?user_id=${userId}`;
     if (portfolioId) url += `&portfolio_id=${portfolioId}`;
@@ -81,6 +88,12 @@ export const analyticsAPI = {
   getRecommendations: async (userId) => {
     const response = await axios.get(`${API}/analytics/recommendations?user_id=${userId}`);
     return response.data;
+  },
+  getBatchPerformance: async (userId, period = 'all', portfolioId = null) => {
+    let url = `${API}/analytics/performance/batch?user_id=${userId}&period=${period}`;
+    if (portfolioId) url += `&portfolio_id=${portfolioId}`;
+    const response = await axios.get(url);
+    return response.data;
   }
 };
 
@@ -103,3 +116,19 @@ export const marketAPI = {
     return response.data;
   }
 };
+
+// Import API
+export const importAPI = {
+  uploadCsv: async (userId, file, portfolioId = null) => {
+    const formData = new FormData();
+    formData.append('file', file);
+    let url = `${API}/import/csv/upload?user_id=${userId}`;
+    if (portfolioId) url += `&portfolio_id=${portfolioId}`;
+    const response = await axios.post(url, formData);
+    return response.data;
+  },
+  getJob: async (userId, jobId) => {
+    const response = await axios.get(`${API}/import/jobs/${jobId}?user_id=${userId}`);
+    return response.data;
+  }
+};
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { TrendingUp, TrendingDown, Activity, Target, BarChart3, AlertCircle, RefreshCw, Settings, Calendar, Percent, X, Bell, CheckCircle, Briefcase, LineChart } from 'lucide-react';
-import { portfolioAPI, analyticsAPI, storage, portfoliosAPI } from '../api';
+import { portfolioAPI, storage, portfoliosAPI } from '../api';
 import { Link } from 'react-router-dom';
 import axios from 'axios';
 
@@ -41,7 +41,7 @@ const Dashboard = () => {
     return `${value >= 0 ? '+' : ''}${value.toFixed(2)}%`;
   };
 
-  const fetchData = async () => {
+  const fetchData = async (refresh = false) => {
     try {
       // Get portfolios first to determine active portfolio
       const portfoliosData = await portfoliosAPI.getAll(userId);
@@ -53,21 +53,19 @@ const Dashboard = () => {
       }
       setActivePortfolio(currentPortfolio);
       
-      // Fetch data with the active portfolio_id
-      const [portfolioData, positionsData, recommendationsData, settingsData] = await Promise.all([
-        portfolioAPI.getSummary(userId, currentPortfolio?.id),
-        portfolioAPI.getPositions(userId, currentPortfolio?.id),
-        analyticsAPI.getRecommendations(userId),
+      // Fetch summary, positions and recommendations of the active portfolio in one round-trip
+      const [dashboardData, settingsData] = await Promise.all([
+        portfolioAPI.getDashboard(userId, currentPortfolio?.id, refresh),
         axios.get(`${API}/settings?user_id=${userId}`)
       ]);
       
-      setPortfolio(portfolioData);
+      setPortfolio(dashboardData.summary);
       
       // Sort positions by weight (descending) and take top 5
-      const sortedPositions = [...positionsData].sort((a, b) => (b.weight || 0) - (a.weight || 0));
+      const sortedPositions = [...dashboardData.positions].sort((a, b) => (b.weight || 0) - (a.weight || 0));
       setPositions(sortedPositions.slice(0, 5));
       
-      setRecommendations(recommendationsData);
+      setRecommendations(dashboardData.recommendations);
       setRiskFreeRate(settingsData.data.risk_free_rate || 3.0);
       setTempRFR(settingsData.data.risk_free_rate || 3.0);
       setBenchmarkIndex(settingsData.data.benchmark_index || '^GSPC');
@@ -78,8 +76,7 @@ const Dashboard = () => {
         setCustomBenchmark(settingsData.data.benchmark_index);
       }
       
-      // Check alerts and get triggered ones
-      await axios.get(`${API}/alerts/check?user_id=${userId}`);
+      // Alerts are evaluated server-side on every quote refresh: just read the triggered ones
       const alertsResponse = await axios.get(`${API}/alerts/triggered?user_id=${userId}`);
       setTriggeredAlerts(alertsResponse.data);
     } catch (error) {
@@ -103,9 +100,38 @@ const Dashboard = () => {
     fetchData();
   }, []);
 
+  // Live quotes and alert triggers pushed by the server
+  useEffect(() => {
+    const events = new EventSource(`${API}/events?user_id=${userId}`);
+
+    events.addEventListener('quotes', (event) => {
+      const quotes = JSON.parse(event.data);
+      setPositions(current => current.map(position => {
+        const quote = quotes[position.symbol];
+        if (!quote) return position;
+        const totalValue = position.quantity * quote.current_price;
+        return {
+          ...position,
+          current_price: quote.current_price,
+          total_value: totalValue,
+          gain_loss: totalValue - position.invested,
+          gain_loss_percent: position.invested > 0 ? (totalValue - position.invested) / position.invested * 100 : 0,
+          last_update: quote.timestamp
+        };
+      }));
+    });
+
+    events.addEventListener('alert', (event) => {
+      const triggered = JSON.parse(event.data);
+      setTriggeredAlerts(current => current.some(a => a.id === triggered.id) ? current : [triggered, ...current]);
+    });
+
+    return () => events.close();
+  }, [userId]);
+
   const handleRefresh = () => {
     setRefreshing(true);
-    fetchData();
+    fetchData(true);
   };
 
   const handleSaveSettings = async () => {
@@ -179,7 +205,9 @@ const Dashboard = () => {
                 <div>
                   <span style={{ fontWeight: '700', color: 'var(--text-primary)', marginRight: '12px' }}>{alert.symbol}</span>
                   <span style={{ color: 'var(--text-muted)', fontSize: '14px' }}>
-                    {alert.alert_type === 'price_above' ? '↑' : '↓'} Cible {formatCurrency(alert.target_value)} atteinte à {formatCurrency(alert.triggered_price)}
+                    {alert.alert_type === 'volatility_high'
+                      ? `Volatilité ${alert.triggered_value}% ≥ seuil ${alert.target_value}%`
+                      : <>{alert.alert_type === 'price_above' ? '↑' : '↓'} Cible {formatCurrency(alert.target_value)} atteinte à {formatCurrency(alert.triggered_price)}</>}
                   </span>
                 </div>
                 <button
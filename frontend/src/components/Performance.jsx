@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { LineChart, Line, AreaChart, Area, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from 'recharts';
 import { TrendingUp, TrendingDown, Calendar, RefreshCw, LineChart as LineChartIcon } from 'lucide-react';
-import { portfolioAPI, storage } from '../api';
+import { portfolioAPI, analyticsAPI, storage } from '../api';
 import axios from 'axios';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -60,9 +60,10 @@ const Performance = () => {
       const userBenchmark = settingsData.data.benchmark_index || '^GSPC';
       setBenchmarkIndex(userBenchmark);
 
-      // Get portfolio performance
-      const portfolioPerfData = await axios.get(`${API}/analytics/performance?user_id=${userId}&period=${period}`);
-      setPortfolioPerf(portfolioPerfData.data);
+      // Portfolio and per-position performance in a single request
+      const perfData = await analyticsAPI.getBatchPerformance(userId, period);
+      setPortfolioPerf(perfData.portfolio);
+      setPositionsPerf(perfData.positions);
 
       // Get index comparison with user's benchmark
       if (period === 'ytd' || period === '1y' || period === '6m' || period === '3m' || period === '1m') {
@@ -70,13 +71,6 @@ const Performance = () => {
         setIndexComparison(comparisonData.data);
       }
 
-      // Get performance for each position
-      const perfPromises = positionsData.map(pos =>
-        axios.get(`${API}/analytics/performance?user_id=${userId}&period=${period}&symbol=${pos.symbol}`)
-      );
-      const perfResults = await Promise.all(perfPromises);
-      setPositionsPerf(perfResults.map(r => r.data));
-
     } catch (error) {
       console.error('Error fetching performance data:', error);
     } finally {
@@ -334,9 +328,10 @@ const Performance = () => {
           gap: '16px',
           marginBottom: '32px'
         }}>
-          {positionsPerf.map((perf, idx) => {
-            const position = positions[idx];
+          {positionsPerf.map((perf) => {
             if (!perf || !perf.data || perf.data.length === 0) return null;
+            const position = positions.find(p => p.symbol === perf.symbol);
+            if (!position) return null;
 
             return (
               <div 